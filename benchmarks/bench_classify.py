@@ -0,0 +1,100 @@
+"""
+    bench_classify.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Compares record classification speed, in records/sec, of the original
+range-scanning integer_list_to_param_dict() with the table driven
+classify_record().
+
+    $python benchmarks/bench_classify.py [dumpfile] [repeat]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import dt2000
+
+
+def legacy_integer_list_to_param_dict(list_of_integers):
+    """The original classifier, kept here as the 'before' measurement."""
+    valid_types = {}
+    valid_types["laptime"] = range(10, 20)
+    valid_types["abstime"] = range(20, 30)
+    valid_types["avtime"] = range(30, 40)
+    valid_types["fastesttime"] = range(40, 50)
+    valid_types["raceend"] = range(50, 60)
+    valid_types["raceheader"] = [90]
+
+    params = {"ptype": 0, "p1": 0, "p2": 0, "p3": 0, "p4": 0, "p5": 0}
+
+    if len(list_of_integers) != 5:
+        raise ValueError(
+            "Unable to convert list of integers to tuple; \
+             incorrect number of integers.")
+
+    params["ptype"] = 'NAK'
+    msg_type = list_of_integers[0]
+    for vt in valid_types.keys():
+        for tc in valid_types[vt]:
+            if msg_type == tc:
+                params["ptype"] = vt
+                params['p1'] = list_of_integers[0]
+                params['p2'] = list_of_integers[1]
+                params['p3'] = list_of_integers[2]
+                params['p4'] = list_of_integers[3]
+                params['p5'] = list_of_integers[4]
+
+    return params
+
+
+def records_per_sec(classify, records, repeat):
+    """Returns the best rate, in records/sec, over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for record in records:
+            classify(record)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(records) / best
+
+
+if __name__ == "__main__":
+    infile = sys.argv[1] if len(sys.argv) > 1 else 'large'
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    with open(infile, 'rb') as f:
+        bcd_buffer = f.read()
+    records = dt2000.bcd_buffer_to_integer_matrix(bcd_buffer)
+    if not isinstance(records, list):
+        records = records.tolist()
+    # Repeat small dumps so each run is long enough to time.
+    records = records * max(1, 100000 // max(1, len(records)))
+
+    before = records_per_sec(legacy_integer_list_to_param_dict, records,
+                             repeat)
+    after = records_per_sec(dt2000.classify_record, records, repeat)
+    print "records:  %d" % len(records)
+    print "before:   %.0f records/sec" % before
+    print "after:    %.0f records/sec" % after
+    print "speedup:  %.1fx" % (after / before)
@@ -0,0 +1,159 @@
+"""
+    bench_serial.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Measures sustained throughput and end-to-end latency of the serial path,
+from the virtual watch in watchsim.py writing each record to LiveReader
+having decoded it, through a port opened by dt2000.openFile().
+
+    $python benchmarks/bench_serial.py [-f dumpfile] [-s speedup] [--json FILE]
+"""
+
+import json
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import dt2000
+import watchsim
+
+# Read timeout once the simulator has finished sending, in seconds.
+READ_TIMEOUT = 0.5
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value at fraction of the way through sorted_values."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(fraction * len(sorted_values)))]
+
+
+def measure(simulator):
+    """Reads and decodes everything simulator sends.
+
+    Returns a dict of throughput and latency results.
+    """
+    port = dt2000.openFile(simulator.port)
+    port.timeout = READ_TIMEOUT
+    reader = dt2000.LiveReader(port, dt2000.Decoder())
+    latencies = []
+    naks = 0
+    simulator.start()
+    try:
+        # The clock stops once the last record has been decoded, not when
+        # its last byte arrived, nor after the read timeout that ends the
+        # loop.
+        finished = None
+        for record in reader:
+            finished = time.time()
+            latencies.append(finished - simulator.sent[len(latencies)])
+            if record.ptype == 'NAK':
+                naks += 1
+        if finished is None:
+            finished = time.time()
+    finally:
+        simulator.join()
+        port.close()
+        simulator.close()
+
+    elapsed = finished - simulator.started
+    records = len(latencies)
+    latencies.sort()
+    return {"records": records,
+            "bytes": records * dt2000.RECORD_LENGTH,
+            "elapsed": elapsed,
+            "records_per_sec": records / elapsed if elapsed else 0.0,
+            "bytes_per_sec":
+                records * dt2000.RECORD_LENGTH / elapsed if elapsed else 0.0,
+            "latency_mean_ms":
+                1000.0 * sum(latencies) / records if records else 0.0,
+            "latency_p50_ms": 1000.0 * percentile(latencies, 0.5),
+            "latency_p95_ms": 1000.0 * percentile(latencies, 0.95),
+            "latency_max_ms": 1000.0 * percentile(latencies, 1.0),
+            "naks": naks,
+            "corrupted": len(simulator.corrupted)}
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-f", "--infile",
+                      dest="infile",
+                      metavar="FILE",
+                      default=None,
+                      help="Dump file to replay; generated races if not "
+                      "specified.")
+    parser.add_option("-s", "--speedup",
+                      dest="speedup",
+                      metavar="NUM",
+                      type=float,
+                      default=0.0,
+                      help="Multiple of " + str(watchsim.BAUD) + " baud to "
+                      "send at, 0 (as fast as possible) if not specified.")
+    parser.add_option("--jitter",
+                      dest="jitter",
+                      metavar="SECONDS",
+                      type=float,
+                      default=0.0,
+                      help="Largest random delay added to each write.")
+    parser.add_option("--chunk",
+                      dest="max_chunk",
+                      metavar="NUM",
+                      type=int,
+                      default=64,
+                      help="Largest number of bytes per write, 64 if not "
+                      "specified.")
+    parser.add_option("--corrupt",
+                      dest="corrupt",
+                      metavar="RATE",
+                      type=float,
+                      default=0.0,
+                      help="Probability of each byte being corrupted.")
+    parser.add_option("--seed",
+                      dest="seed",
+                      metavar="NUM",
+                      type=int,
+                      default=1,
+                      help="Random seed, 1 if not specified.")
+    parser.add_option("--json",
+                      dest="jsonfile",
+                      metavar="FILE",
+                      default=None,
+                      help="Also save the results as JSON.")
+    (options, args) = parser.parse_args()
+
+    if options.infile:
+        with open(options.infile, 'rb') as f:
+            data = f.read()
+    else:
+        data = watchsim.generate_races(10, 200, seed=options.seed)
+
+    results = measure(watchsim.WatchSimulator(
+        data, speedup=options.speedup, jitter=options.jitter,
+        max_chunk=options.max_chunk, corrupt=options.corrupt,
+        seed=options.seed))
+    results["speedup"] = options.speedup
+    for key in sorted(results):
+        print "%-16s %s" % (key + ':', results[key])
+    if options.jsonfile:
+        with open(options.jsonfile, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,216 @@
+"""
+    bench_stages.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Times each stage of the decode pipeline separately on generated dumps of
+10^3 records up to 10^6 (or 10^7 with --max 7):
+
+    read        five byte reads, as readRecord() does
+    decode      BCD decoding of each record
+    classify    classify_record()
+    adjust      lap overflow adjustment
+    accumulate  finishing time accumulation and result rows
+    write       CSV writing
+
+plus the bulk read and decode used for dump files, and the whole pipeline
+end to end.  Records are processed a block at a time, so memory use does not
+grow with the dump.  Results are saved as JSON and can be compared with an
+earlier run:
+
+    $python benchmarks/bench_stages.py --json new.json --compare old.json
+"""
+
+import csv
+import json
+import optparse
+import os
+import platform
+import sys
+import tempfile
+from timeit import default_timer as clock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import dt2000
+import gendump
+
+STAGES = ('read', 'decode', 'classify', 'adjust', 'accumulate', 'write',
+          'read_bulk', 'decode_bulk', 'end_to_end')
+
+
+def dumpFile(workdir, records, seed):
+    """Returns the path of a generated dump, generating it if needed."""
+    path = os.path.join(workdir, "dt2000-bench-%d-%d.dump" % (records, seed))
+    if not os.path.exists(path):
+        with open(path + '.tmp', 'wb') as f:
+            gendump.generateDump(f, records, seed)
+        os.rename(path + '.tmp', path)
+    return path
+
+
+def timeStages(path, block_records=dt2000.BLOCK_RECORDS):
+    """Runs the pipeline over path once, timing each stage.
+
+    Returns a dict of seconds spent in each stage.
+    """
+    seconds = dict.fromkeys(STAGES, 0.0)
+    decoder = dt2000.Decoder()
+    builder = dt2000.ResultBuilder()
+    with open(os.devnull, 'wb') as null, open(path, 'rb') as in_file:
+        csvwriter = csv.writer(null, delimiter=',',
+                               quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        while True:
+            t0 = clock()
+            block = [in_file.read(dt2000.RECORD_LENGTH)
+                     for _ in xrange(block_records)]
+            block = [record for record in block if record]
+            t1 = clock()
+            if not block:
+                break
+            lists = [dt2000.bcd_string_to_integer_list(record)
+                     for record in block]
+            t2 = clock()
+            records = [dt2000.classify_record(values) for values in lists]
+            t3 = clock()
+            for record in records:
+                if record.ptype != 'NAK':
+                    dt2000.adjust_hundreds(decoder, record)
+            t4 = clock()
+            rows = builder.rows(records)
+            t5 = clock()
+            csvwriter.writerows(rows)
+            t6 = clock()
+            for stage, elapsed in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2,
+                                               t4 - t3, t5 - t4, t6 - t5)):
+                seconds[stage] += elapsed
+
+    with open(path, 'rb') as in_file:
+        while True:
+            t0 = clock()
+            block = in_file.read(block_records * dt2000.RECORD_LENGTH)
+            t1 = clock()
+            if not block:
+                break
+            matrix = dt2000.bcd_buffer_to_integer_matrix(block)
+            if not isinstance(matrix, list):
+                matrix = matrix.tolist()
+            t2 = clock()
+            seconds['read_bulk'] += t1 - t0
+            seconds['decode_bulk'] += t2 - t1
+
+    with open(os.devnull, 'wb') as null:
+        csvwriter = csv.writer(null, delimiter=',',
+                               quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        t0 = clock()
+        dt2000.writeResults(dt2000.iterRecords(path), csvwriter)
+        seconds['end_to_end'] = clock() - t0
+    return seconds
+
+
+def benchmark(path, records, repeat):
+    """Returns the best time and rate of each stage over repeat runs."""
+    best = {}
+    for _ in xrange(repeat):
+        for stage, elapsed in timeStages(path).items():
+            best[stage] = min(best.get(stage, elapsed), elapsed)
+    return dict((stage, {"seconds": elapsed,
+                         "records_per_sec":
+                             records / elapsed if elapsed else 0.0})
+                for stage, elapsed in best.items())
+
+
+def compare(results, previous, out):
+    """Writes the speedup of each stage over a previous run to out."""
+    for size in sorted(results, key=int):
+        if size not in previous:
+            continue
+        for stage in STAGES:
+            if stage not in previous[size]:
+                continue
+            before = previous[size][stage]["records_per_sec"]
+            after = results[size][stage]["records_per_sec"]
+            out.write("%10s %-12s %6.2fx\n"
+                      % (size, stage, after / before if before else 0.0))
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("--min",
+                      dest="min_power",
+                      metavar="NUM",
+                      type=int,
+                      default=3,
+                      help="Smallest dump, 10^NUM records; 3 if not "
+                      "specified.")
+    parser.add_option("--max",
+                      dest="max_power",
+                      metavar="NUM",
+                      type=int,
+                      default=6,
+                      help="Largest dump, 10^NUM records; 6 if not "
+                      "specified.")
+    parser.add_option("-r", "--repeat",
+                      dest="repeat",
+                      metavar="NUM",
+                      type=int,
+                      default=3,
+                      help="Runs per size, best kept; 3 if not specified.")
+    parser.add_option("--seed",
+                      dest="seed",
+                      metavar="NUM",
+                      type=int,
+                      default=1,
+                      help="Random seed of the generated dumps.")
+    parser.add_option("--workdir",
+                      dest="workdir",
+                      metavar="DIR",
+                      default=tempfile.gettempdir(),
+                      help="Where generated dumps are kept between runs.")
+    parser.add_option("--json",
+                      dest="jsonfile",
+                      metavar="FILE",
+                      default=None,
+                      help="Save the results as JSON.")
+    parser.add_option("--compare",
+                      dest="comparefile",
+                      metavar="FILE",
+                      default=None,
+                      help="Compare with results saved by an earlier run.")
+    (options, args) = parser.parse_args()
+
+    # The bulk decoder uses numpy, when installed, once it is loaded.
+    has_numpy = dt2000.load_numpy()
+    results = {}
+    for power in xrange(options.min_power, options.max_power + 1):
+        records = 10 ** power
+        path = dumpFile(options.workdir, records, options.seed)
+        results[str(records)] = benchmark(path, records, options.repeat)
+        for stage in STAGES:
+            print "%10d %-12s %12.0f records/sec" % (
+                records, stage, results[str(records)][stage]["records_per_sec"])
+
+    if options.jsonfile:
+        with open(options.jsonfile, 'w') as f:
+            json.dump({"python": platform.python_version(),
+                       "numpy": has_numpy,
+                       "seed": options.seed,
+                       "results": results}, f, indent=2, sort_keys=True)
+    if options.comparefile:
+        with open(options.comparefile) as f:
+            compare(results, json.load(f)["results"], sys.stdout)
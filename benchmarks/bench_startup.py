@@ -0,0 +1,163 @@
+"""
+    bench_startup.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Times short-lived invocations of dt2000, each in a fresh interpreter, as a
+finish-line script would run them:
+
+    python      the interpreter alone, for reference
+    import      importing dt2000
+    decode      importing dt2000 and decoding the sample dump, with
+                iter_records() or, in checkouts without it, readRecord()
+    help        the command line's --help
+    convert     the command line converting the sample dump to CSV
+
+The command line is run through dt2000cli.py, or dt2000.py in checkouts
+without it.  --path runs another copy, for example the checkout before a
+change, and results are saved as JSON and can be compared with an earlier
+run:
+
+    $python benchmarks/bench_startup.py --path old/ --json old.json
+    $python benchmarks/bench_startup.py --json new.json --compare old.json
+"""
+
+import json
+import optparse
+import os
+import platform
+import subprocess
+import sys
+from timeit import default_timer as clock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ('python', 'import', 'decode', 'help', 'convert')
+
+
+def commands(path, dump):
+    """Returns the command line of each scenario, run from path."""
+    script = os.path.join(path, 'dt2000cli.py')
+    if not os.path.exists(script):
+        script = os.path.join(path, 'dt2000.py')
+    return {
+        'python': [sys.executable, '-c', 'pass'],
+        'import': [sys.executable, '-c', 'import dt2000'],
+        'decode': [sys.executable, '-c',
+                   'import dt2000; f = open(%r, "rb"); '
+                   'list(dt2000.iter_records(f) '
+                   'if hasattr(dt2000, "iter_records") '
+                   'else dt2000.readRecord(f))' % dump],
+        'help': [sys.executable, script, '--help'],
+        'convert': [sys.executable, script, '-f', dump, '-o', os.devnull],
+    }
+
+
+def timeCommand(command, path, repeat):
+    """Runs command repeat times.
+
+    Returns a sorted list of the wall clock seconds taken by each run.
+    """
+    env = dict(os.environ, PYTHONPATH=path)
+    seconds = []
+    with open(os.devnull, 'wb') as null:
+        for _ in xrange(repeat):
+            start = clock()
+            subprocess.check_call(command, cwd=path, env=env, stdout=null,
+                                  stderr=null)
+            seconds.append(clock() - start)
+    return sorted(seconds)
+
+
+def benchmark(path, dump, repeat):
+    """Returns the best and median time of each scenario in milliseconds.
+
+    Scenarios that fail, as decode does in checkouts whose dt2000 cannot
+    be used as a library, are left out.
+    """
+    results = {}
+    for scenario, command in commands(path, dump).items():
+        try:
+            seconds = timeCommand(command, path, repeat)
+        except subprocess.CalledProcessError:
+            continue
+        results[scenario] = {"best_ms": 1000 * seconds[0],
+                             "median_ms": 1000 * seconds[len(seconds) // 2]}
+    return results
+
+
+def compare(results, previous, out):
+    """Writes the speedup of each scenario over a previous run to out."""
+    for scenario in SCENARIOS:
+        if scenario not in previous or scenario not in results:
+            continue
+        before = previous[scenario]["median_ms"]
+        after = results[scenario]["median_ms"]
+        out.write("%-8s %8.1f ms -> %8.1f ms %6.2fx\n"
+                  % (scenario, before, after, before / after if after else 0))
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-r", "--repeat",
+                      dest="repeat",
+                      metavar="NUM",
+                      type=int,
+                      default=20,
+                      help="Runs per scenario; 20 if not specified.")
+    parser.add_option("--path",
+                      dest="path",
+                      metavar="DIR",
+                      default=ROOT,
+                      help="Directory holding the dt2000 to time, this "
+                      "checkout if not specified.")
+    parser.add_option("--dump",
+                      dest="dump",
+                      metavar="FILE",
+                      default=os.path.join(ROOT, 'dump'),
+                      help="Dump file decoded and converted, the sample "
+                      "dump if not specified.")
+    parser.add_option("--json",
+                      dest="jsonfile",
+                      metavar="FILE",
+                      default=None,
+                      help="Save the results as JSON.")
+    parser.add_option("--compare",
+                      dest="comparefile",
+                      metavar="FILE",
+                      default=None,
+                      help="Compare with results saved by an earlier run.")
+    (options, args) = parser.parse_args()
+
+    path = os.path.abspath(options.path)
+    results = benchmark(path, os.path.abspath(options.dump), options.repeat)
+    for scenario in SCENARIOS:
+        if scenario not in results:
+            print "%-8s failed" % scenario
+            continue
+        print "%-8s best %8.1f ms  median %8.1f ms" % (
+            scenario, results[scenario]["best_ms"],
+            results[scenario]["median_ms"])
+
+    if options.jsonfile:
+        with open(options.jsonfile, 'w') as f:
+            json.dump({"python": platform.python_version(),
+                       "path": path,
+                       "results": results}, f, indent=2, sort_keys=True)
+    if options.comparefile:
+        with open(options.comparefile) as f:
+            compare(results, json.load(f)["results"], sys.stdout)
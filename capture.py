@@ -0,0 +1,327 @@
+"""
+    capture.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Captures the watch's inverted serial output from a GPIO pin bit-banged by
+pigpio, without spinning a CPU core.  The capture thread polls with an
+adaptive backoff and hands whole records to the dt2000 decoder through a
+ring buffer.
+"""
+
+import optparse
+import signal
+import sys
+import threading
+import time
+import csv
+from binascii import hexlify
+
+import dt2000
+
+# Default GPIO pin wired to the watch, as used by intr2.py.
+RXD = 23
+
+# Shortest and longest sleep between polls of an idle source, in seconds.
+MIN_SLEEP = 0.002
+MAX_SLEEP = 0.1
+
+# Longest single wait for captured records, so signals are still handled.
+WAIT_SLICE = 0.5
+
+
+class RingBuffer(object):
+    """Fixed size byte ring buffer shared by one producer and one consumer.
+
+    'head' counts every byte ever written and is only advanced by the
+    producer; 'tail' counts every byte ever read and is only advanced by the
+    consumer.  Each side publishes its counter after copying the bytes, so
+    neither needs a lock.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = bytearray(capacity)
+        self.head = 0
+        self.tail = 0
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def free(self):
+        """Returns the number of bytes that can be written."""
+        return self.capacity - len(self)
+
+    def write(self, data):
+        """Writes all of data, or nothing if it does not fit.
+
+        Returns True if data was written.
+        """
+        size = len(data)
+        if size > self.free():
+            return False
+        start = self.head % self.capacity
+        first = min(size, self.capacity - start)
+        self._data[start:start + first] = data[:first]
+        self._data[:size - first] = data[first:]
+        self.head += size
+        return True
+
+    def read(self, size=None):
+        """Reads up to size bytes, or every byte held if size is None.
+
+        Returns the bytes as a string.
+        """
+        available = len(self)
+        if size is None or size > available:
+            size = available
+        start = self.tail % self.capacity
+        first = min(size, self.capacity - start)
+        chunk = str(self._data[start:start + first]) \
+            + str(self._data[:size - first])
+        self.tail += size
+        return chunk
+
+
+class BitBangSource(object):
+    """Reads an inverted serial line bit-banged by pigpio on a GPIO pin.
+
+    pigpio is imported only when no pi connection is given.
+    """
+
+    def __init__(self, gpio=RXD, baud=4800, invert=True, pi=None):
+        if pi is None:
+            import pigpio
+            pi = pigpio.pi()
+        self.pi = pi
+        self.gpio = gpio
+
+        # A previous capture may have left the pin open.
+        try:
+            pi.bb_serial_read_close(gpio)
+        except Exception:
+            pass
+        pi.bb_serial_read_open(gpio, baud)
+        pi.bb_serial_invert(gpio, 1 if invert else 0)
+
+    def read(self):
+        """Returns whatever bytes pigpio has buffered, possibly none."""
+        count, data = self.pi.bb_serial_read(self.gpio)
+        if count <= 0:
+            return ''
+        return str(data)
+
+    def close(self):
+        self.pi.bb_serial_read_close(self.gpio)
+        self.pi.stop()
+
+
+class MockBitBangSource(object):
+    """Stands in for BitBangSource, replaying data for tests.
+
+    Each read returns the next chunk_size bytes, after idle_polls empty
+    reads, as pigpio would between bursts.
+    """
+
+    def __init__(self, data, chunk_size=16, idle_polls=0):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.idle_polls = idle_polls
+        self.polls = 0
+        self._idle = idle_polls
+
+    def read(self):
+        self.polls += 1
+        if self._idle or not self.data:
+            self._idle = max(0, self._idle - 1)
+            return ''
+        self._idle = self.idle_polls
+        chunk = self.data[:self.chunk_size]
+        self.data = self.data[self.chunk_size:]
+        return chunk
+
+    def close(self):
+        pass
+
+
+class CaptureDaemon(object):
+    """Captures records from a source on a background thread.
+
+    The capture thread polls the source, sleeping for MIN_SLEEP after data
+    arrives and doubling the sleep up to MAX_SLEEP while the line is idle.
+    Only whole records are passed through the ring buffer.  If the ring is
+    full, the records in that read are dropped and counted; the ring stays
+    aligned on record boundaries.
+    """
+
+    def __init__(self, source, decoder=None, ring_size=65536,
+                 min_sleep=MIN_SLEEP, max_sleep=MAX_SLEEP):
+        self.source = source
+        self.decoder = decoder if decoder is not None else dt2000.Decoder()
+        self.ring = RingBuffer(ring_size - ring_size % dt2000.RECORD_LENGTH)
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.delay = min_sleep
+
+        self.bytes_received = 0
+        self.polls = 0
+        self.idle_polls = 0
+        self.overruns = 0
+        self.dropped_frames = 0
+        self.started = None
+
+        self._partial = ''
+        self._ready = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        """Reads once from the source into the ring buffer.
+
+        Returns the number of bytes received.
+        """
+        self.polls += 1
+        data = self.source.read()
+        if not data:
+            self.idle_polls += 1
+            self.delay = min(self.delay * 2, self.max_sleep)
+            return 0
+        self.delay = self.min_sleep
+        received = len(data)
+        self.bytes_received += received
+
+        data = self._partial + data
+        whole = len(data) - len(data) % dt2000.RECORD_LENGTH
+        self._partial = data[whole:]
+        if whole:
+            if self.ring.write(data[:whole]):
+                self._ready.set()
+            else:
+                self.overruns += 1
+                self.dropped_frames += whole // dt2000.RECORD_LENGTH
+        return received
+
+    def _capture(self):
+        while not self._stopping.is_set():
+            self.poll()
+            time.sleep(self.delay)
+        self._ready.set()
+
+    def start(self):
+        """Starts the capture thread."""
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._capture)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the capture thread.
+
+        Records already captured can still be read.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def frames(self, timeout=None):
+        """Generator of captured blocks of whole five byte records.
+
+        Waits to be woken by the capture thread rather than polling the ring,
+        until the thread has stopped and the ring is empty, or nothing has
+        arrived for timeout seconds.
+        """
+        idle_since = time.time()
+        while True:
+            self._ready.clear()
+            stopped = self._thread is None or not self._thread.is_alive()
+            if len(self.ring):
+                yield self.ring.read()
+                idle_since = time.time()
+                continue
+            if stopped:
+                return
+            if timeout is not None and time.time() - idle_since >= timeout:
+                return
+            self._ready.wait(WAIT_SLICE)
+
+    def records(self, timeout=None):
+        """Generator of decoded records; see frames()."""
+        for block in self.frames(timeout):
+            for record in self.decoder.decode_block(block):
+                yield record
+
+    def stats(self):
+        """Returns a dict of capture counters."""
+        elapsed = time.time() - self.started if self.started else 0.0
+        return {"bytes": self.bytes_received,
+                "bytes_per_sec": self.bytes_received / elapsed
+                if elapsed else 0.0,
+                "polls": self.polls,
+                "idle_polls": self.idle_polls,
+                "overruns": self.overruns,
+                "dropped_frames": self.dropped_frames}
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-g", "--gpio",
+                      dest="gpio",
+                      metavar="NUM",
+                      type=int,
+                      default=RXD,
+                      help="GPIO pin wired to the watch, "
+                      + str(RXD) + " if not specified.")
+    parser.add_option("-o", "--outfile",
+                      dest="outfile",
+                      metavar="FILE",
+                      default=sys.stdout,
+                      help="Output file, stdout if not specified.")
+    parser.add_option("--hex",
+                      dest="hexmode",
+                      default=0,
+                      action='store_const',
+                      const=1,
+                      help="Write the raw records as hex instead of CSV.")
+    (options, args) = parser.parse_args()
+
+    if isinstance(options.outfile, file):
+        op = options.outfile
+    else:
+        op = open(options.outfile, 'wb')
+
+    daemon = CaptureDaemon(BitBangSource(options.gpio))
+    signal.signal(signal.SIGINT, lambda signum, frame: daemon.stop())
+    daemon.start()
+
+    try:
+        if options.hexmode:
+            for block in daemon.frames():
+                op.write(hexlify(block))
+                op.flush()
+        else:
+            csvwriter = csv.writer(op, delimiter=',',
+                                   quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            dt2000.writeResults(dt2000.flushEachRecord(daemon.records(), op),
+                                csvwriter)
+    finally:
+        daemon.stop()
+        daemon.source.close()
+        op.close()
+        stats = daemon.stats()
+        sys.stderr.write("Captured %(bytes)d bytes, %(bytes_per_sec).1f "
+                         "bytes/sec, %(overruns)d overruns, "
+                         "%(dropped_frames)d dropped frames.\n" % stats)
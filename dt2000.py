@@ -18,10 +18,104 @@
     USA
 """
 
-import optparse
+import array
+import collections
+import imp
+import importlib
+import itertools
+import os
+import stat
+import struct
 import sys
-import serial
-import csv
+import mmap
+import time
+
+# pyserial, optparse, csv and multiprocessing, and the modules only needed
+# by --dump, --ingest, race indexes and archives, are imported where they
+# are used, so scripts using this module as a library only load what they
+# need.
+
+
+class LazyModule(object):
+    """Stands in for a module, importing it when it is first used."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+# numpy is optional; the bulk decoder falls back to pure Python without it.
+# It takes longer to load than everything else here, and than decoding a
+# small dump, so it is only used once something has loaded it; see
+# use_numpy().
+try:
+    imp.find_module('numpy')
+    numpy = LazyModule('numpy')
+except ImportError:
+    numpy = None
+
+# Every record sent by the watch is exactly five bytes wide.
+RECORD_LENGTH = 5
+
+# Number of records decoded together when streaming a dump file.
+BLOCK_RECORDS = 4096
+
+# Runs of fewer finishers than this are timed one lap at a time: numpy's
+# overhead on each call only pays off on longer runs.
+VECTOR_MIN_LAPS = 256
+
+# Blocks of fewer records than this are decoded with str.translate(), as
+# numpy's overhead on each call only pays off on larger blocks.
+NUMPY_MIN_RECORDS = 256
+
+# readBulkRecord() loads numpy for dumps of at least this many records,
+# where the bulk decoder saves more time than loading numpy takes.
+NUMPY_LOAD_RECORDS = 65536
+
+# Suffix of the race index saved alongside a dump file.
+RACE_INDEX_SUFFIX = '.idx'
+
+# Raw capture files are started afresh once they reach this size, and are
+# written through a buffer of DUMP_BUFFER_BYTES and synced to disk at least
+# every DUMP_SYNC_SECONDS while data is arriving.
+DUMP_ROTATE_BYTES = 64 * 1024 * 1024
+DUMP_BUFFER_BYTES = 1024 * 1024
+DUMP_SYNC_SECONDS = 1.0
+
+# Compressed dump archives start with ARCHIVE_MAGIC and hold their records in
+# independently compressed chunks of ARCHIVE_CHUNK_RECORDS, so any record can
+# be reached by decompressing a single chunk.  They end with the chunk index
+# and ARCHIVE_TRAILER: the records per chunk, the number of records and the
+# offset of the index.
+ARCHIVE_MAGIC = 'DT2000Z1'
+ARCHIVE_CHUNK_RECORDS = 4 * BLOCK_RECORDS
+ARCHIVE_TRAILER = struct.Struct('<IQQ')
+
+
+def load_numpy():
+    """Loads numpy, if it is installed, so that use_numpy() can choose it.
+
+    Returns True if numpy is available.
+    """
+    if numpy is None:
+        return False
+    importlib.import_module('numpy')
+    return True
+
+
+def use_numpy(count, minimum):
+    """Returns whether count items are worth handing to numpy.
+
+    numpy is used for minimum items or more, but only once it has been
+    loaded; see load_numpy().  readBulkRecord() loads it for large dumps.
+    """
+    return numpy is not None and count >= minimum \
+        and 'numpy' in sys.modules
 
 
 def static_vars(**kwargs):
@@ -73,79 +167,433 @@ def bcd_string_to_integer_list(bcd_string):
     return [bcd_to_int(byte) for byte in bcd_string]
 
 
-def integer_list_to_param_dict(list_of_integers):
-    valid_types = {}
-    valid_types["laptime"] = range(10, 20)
-    valid_types["abstime"] = range(20, 30)
-    valid_types["avtime"] = range(30, 40)
-    valid_types["fastesttime"] = range(40, 50)
-    valid_types["raceend"] = range(50, 60)
-    valid_types["raceheader"] = [90]
+def int_to_bcd(value):
+    """Converts an int between 0 and 99 to a packed, little-endian, BCD byte.
+
+    The inverse of bcd_to_int().  A ValueError is generated if value is out
+    of range.
+
+    Returns a string of length 1.
+    """
+    if not 0 <= value <= 99:
+        raise ValueError("Invalid value; BCD byte must be between 0 and 99.")
+    return chr((value // 10) | ((value % 10) << 4))
+
+
+def integer_list_to_bcd_string(list_of_integers):
+    """Converts a list of integers to a packed, little-endian, BCD string.
+
+    Returns a string; see int_to_bcd().
+    """
+    return ''.join(int_to_bcd(value) for value in list_of_integers)
+
+
+# Decoded value of every possible byte, indexed by the byte itself.  Built
+# with bcd_to_int() so the bulk decoder gives identical results, including
+# for bytes that are not valid BCD.
+BCD_LOOKUP = [bcd_to_int(chr(byte)) for byte in range(256)]
+
+# The same lookup as a str.translate() table; every entry fits in a byte.
+BCD_TRANSLATION = ''.join(chr(value) for value in BCD_LOOKUP)
+
+# The same lookup as a numpy array, built when first needed.
+BCD_LOOKUP_ARRAY = None
+
+
+def bcd_buffer_to_integer_matrix(bcd_buffer):
+    """Converts a buffer of whole five byte records to a matrix of integers.
+
+    Every byte is decoded at once through the BCD lookup table.  A ValueError
+    is generated if the buffer does not hold a whole number of records.
+
+    Returns an N x 5 numpy array when numpy is used, see use_numpy(),
+    otherwise a list of N lists of five integers.
+    """
+    if len(bcd_buffer) % RECORD_LENGTH:
+        raise ValueError(
+            "Invalid length; buffer is not a whole number of records.")
+
+    if use_numpy(len(bcd_buffer) // RECORD_LENGTH, NUMPY_MIN_RECORDS):
+        global BCD_LOOKUP_ARRAY
+        if BCD_LOOKUP_ARRAY is None:
+            BCD_LOOKUP_ARRAY = numpy.array(BCD_LOOKUP, dtype=numpy.uint8)
+        raw = numpy.frombuffer(bcd_buffer, dtype=numpy.uint8)
+        return BCD_LOOKUP_ARRAY[raw].reshape(-1, RECORD_LENGTH)
+
+    decoded = bytearray(str(bcd_buffer).translate(BCD_TRANSLATION))
+    return [list(decoded[i:i + RECORD_LENGTH])
+            for i in xrange(0, len(decoded), RECORD_LENGTH)]
+
+
+# Type codes used by the watch for each kind of record.
+VALID_TYPES = (("laptime", range(10, 20)),
+               ("abstime", range(20, 30)),
+               ("avtime", range(30, 40)),
+               ("fastesttime", range(40, 50)),
+               ("raceend", range(50, 60)),
+               ("raceheader", [90]))
+
+# Record type for each of the 100 two digit type codes; any code not listed
+# in VALID_TYPES is unknown - NAK.
+RECORD_TYPES = ['NAK'] * 100
+for _ptype, _codes in VALID_TYPES:
+    for _code in _codes:
+        RECORD_TYPES[_code] = _ptype
+
+
+class Record(object):
+    """A single decoded record.
+
+    A lightweight replacement for the parameter dict.  Fields are attributes,
+    but may also be read and written by key (record['p5']) like the dict.
+    """
+    __slots__ = ('ptype', 'p1', 'p2', 'p3', 'p4', 'p5')
+
+    def __init__(self, ptype, p1=0, p2=0, p3=0, p4=0, p5=0):
+        self.ptype = ptype
+        self.p1 = p1
+        self.p2 = p2
+        self.p3 = p3
+        self.p4 = p4
+        self.p5 = p5
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        if isinstance(other, Record):
+            return self.as_dict() == other.as_dict()
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
 
-    params = {"ptype": 0, "p1": 0, "p2": 0, "p3": 0, "p4": 0, "p5": 0}
+    def __repr__(self):
+        return "Record(%r, %r, %r, %r, %r, %r)" % (
+            self.ptype, self.p1, self.p2, self.p3, self.p4, self.p5)
 
+    def as_dict(self):
+        """Returns the record as a parameter dict."""
+        return {"ptype": self.ptype, "p1": self.p1, "p2": self.p2,
+                "p3": self.p3, "p4": self.p4, "p5": self.p5}
+
+
+def classify_record(list_of_integers):
+    """Classifies a list of five integers by its type code.
+
+    The first integer is the type code, looked up directly in RECORD_TYPES.
+    A ValueError is generated if the list is not five integers long.
+
+    Returns a Record.  Unknown types are returned as a 'NAK' record with all
+    parameters zero.
+    """
     # List of integers must be length of five.
     if len(list_of_integers) != 5:
         raise ValueError(
             "Unable to convert list of integers to tuple; \
              incorrect number of integers.")
 
-    # First byte is the type; default to unknown - NAK
-    params["ptype"] = 'NAK'
     msg_type = list_of_integers[0]
-    for vt in valid_types.keys():
-        for tc in valid_types[vt]:
-            if msg_type == tc:
-                # Got a match
-                params["ptype"] = vt
-                params['p1'] = list_of_integers[0]
-                params['p2'] = list_of_integers[1]
-                params['p3'] = list_of_integers[2]
-                params['p4'] = list_of_integers[3]
-                params['p5'] = list_of_integers[4]
+    if 0 <= msg_type < 100:
+        ptype = RECORD_TYPES[msg_type]
+        if ptype != 'NAK':
+            return Record(ptype, *list_of_integers)
+    return Record('NAK')
 
-    return params
 
+def integer_list_to_param_dict(list_of_integers):
+    """Classifies a list of five integers by its type code.
 
-@static_vars(lap_hundreds=0, abs_hundreds=0)
-def adjust_lap_hundreds_p_dict(param_dict):
+    Returns a parameter dict; see classify_record().
+    """
+    return classify_record(list_of_integers).as_dict()
+
+
+def adjust_hundreds(state, param_dict):
     """Adjusts the lap records to account for more than 99 laps/runners.
 
     As BCD cannot represent a value greater than 100, if there are more than
     100 laps/runners within a single race, the ultrak498 timer overflows to
-    the lap to 0.
+    the lap to 0.  The running hundreds are kept in the lap_hundreds and
+    abs_hundreds attributes of state.
     """
 
     rtc = param_dict['ptype']
     if rtc != 'NAK':
         # Reset hundreds place when a new races starts.
         if rtc == 'raceheader':
-            adjust_lap_hundreds_p_dict.lap_hundreds = 0
-            adjust_lap_hundreds_p_dict.abs_hundreds = 0
+            state.lap_hundreds = 0
+            state.abs_hundreds = 0
 
         # Adjust lap by hundreds place; increment on overflow.
         elif rtc == 'laptime':
             # type minutes seconds hundreths laps
             if param_dict['p5'] == 0:
-                adjust_lap_hundreds_p_dict.lap_hundreds += 100
-            param_dict['p5'] = param_dict['p5'] \
-                + adjust_lap_hundreds_p_dict.lap_hundreds
+                state.lap_hundreds += 100
+            param_dict['p5'] = param_dict['p5'] + state.lap_hundreds
 
         # Adjust abs by hundreds place; increment on overflow.
         elif rtc == 'abstime':
             if param_dict['p5'] == 0:
-                adjust_lap_hundreds_p_dict.abs_hundreds += 100
-            param_dict['p5'] = param_dict['p5'] \
-                + adjust_lap_hundreds_p_dict.abs_hundreds
+                state.abs_hundreds += 100
+            param_dict['p5'] = param_dict['p5'] + state.abs_hundreds
 
     return param_dict
 
 
-def readRecord(in_file):
+@static_vars(lap_hundreds=0, abs_hundreds=0)
+def adjust_lap_hundreds_p_dict(param_dict):
+    """Adjusts the lap records to account for more than 99 laps/runners.
+
+    The overflow state is shared by every caller; use a Decoder to decode
+    more than one stream.  See adjust_hundreds().
+    """
+    return adjust_hundreds(adjust_lap_hundreds_p_dict, param_dict)
+
+
+class Decoder(object):
+    """Decodes the records of a single input stream.
+
+    Each decoder owns its own overflow state, so any number of streams can be
+    decoded side by side.  Raw records are copied to dump_file, if given, and
+    printed as integers when debug is set.  Stages are timed and counted in
+    stats, a PipelineStats, if given.
+    """
+
+    def __init__(self, dump_file=None, debug=False, stats=None):
+        self.dump_file = dump_file
+        self.debug = debug
+        self.stats = stats
+        self.lap_hundreds = 0
+        self.abs_hundreds = 0
+
+        # Copying, printing and timing are chosen once, here, so the plain
+        # decoders do not check for them on every record.
+        if dump_file is not None or debug or stats is not None:
+            self.decode = self._decode_traced
+            self.decode_block = self._decode_block_traced
+
+    def adjust(self, record):
+        """Adjusts a record for lap overflow; see adjust_hundreds()."""
+        return adjust_hundreds(self, record)
+
+    def decode(self, record_as_bcd_string):
+        """Decodes, classifies and adjusts a single five byte record.
+
+        Returns the record.
+        """
+        record = classify_record(bcd_string_to_integer_list(
+            record_as_bcd_string))
+
+        if record.ptype != 'NAK':
+            record = adjust_hundreds(self, record)
+
+        return record
+
+    def decode_block(self, block):
+        """Generator to decode a buffer of whole records with the bulk decoder.
+
+        Yields the same records as decode() would for each record in turn.
+        """
+        matrix = bcd_buffer_to_integer_matrix(block)
+        if not isinstance(matrix, list):
+            matrix = matrix.tolist()
+        for record_as_integer_list in matrix:
+            record = classify_record(record_as_integer_list)
+
+            if record.ptype != 'NAK':
+                record = adjust_hundreds(self, record)
+
+            yield record
+
+    def _classify(self, record_as_integer_list):
+        """Classifies and adjusts a record, timing and counting in stats."""
+        if self.debug:
+            print record_as_integer_list
+        stats = self.stats
+        if stats is None:
+            record = classify_record(record_as_integer_list)
+            if record.ptype != 'NAK':
+                record = adjust_hundreds(self, record)
+            return record
+
+        start = time.time()
+        record = classify_record(record_as_integer_list)
+        classified = time.time()
+        stats.seconds['classify'] += classified - start
+        stats.records += 1
+        if record.ptype == 'NAK':
+            stats.naks += 1
+            return record
+
+        hundreds = self.lap_hundreds + self.abs_hundreds
+        record = adjust_hundreds(self, record)
+        if self.lap_hundreds + self.abs_hundreds > hundreds:
+            stats.overflows += 1
+        stats.seconds['adjust'] += time.time() - classified
+        return record
+
+    def _decode_traced(self, record_as_bcd_string):
+        """decode(), also copying, printing and timing each record."""
+        if self.dump_file is not None:
+            self.dump_file.write(record_as_bcd_string)
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+        record_as_integer_list = bcd_string_to_integer_list(
+            record_as_bcd_string)
+        if stats is not None:
+            stats.seconds['decode'] += time.time() - start
+            stats.bytes += len(record_as_bcd_string)
+        return self._classify(record_as_integer_list)
+
+    def _decode_block_traced(self, block):
+        """decode_block(), also copying, printing and timing each record."""
+        if self.dump_file is not None:
+            self.dump_file.write(block)
+        stats = self.stats
+        start = time.time()
+        matrix = bcd_buffer_to_integer_matrix(block)
+        if not isinstance(matrix, list):
+            matrix = matrix.tolist()
+        if stats is not None:
+            stats.seconds['decode'] += time.time() - start
+            stats.bytes += len(block)
+        for record_as_integer_list in matrix:
+            yield self._classify(record_as_integer_list)
+
+
+class DumpTee(object):
+    """Copies raw records to capture files from a background thread.
+
+    write() only queues the bytes, so a slow or stalled disk never holds up
+    decoding.  The writer thread drains everything queued into one large
+    buffered write and syncs to disk every sync_interval seconds.  Files are
+    named prefix-YYYYMMDD-HHMMSS in directory, after the time each was
+    started, and a new file is started once one reaches max_bytes; files
+    always hold whole records.  The names of the files written are kept in
+    'paths'.  An error in the writer thread, such as a full disk, is kept in
+    'error' and never interrupts decoding: later data is dropped, and the
+    error is raised by close().
+    """
+
+    def __init__(self, directory='.', prefix='dump',
+                 max_bytes=DUMP_ROTATE_BYTES,
+                 sync_interval=DUMP_SYNC_SECONDS):
+        import Queue
+        import threading
+
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max(RECORD_LENGTH,
+                             max_bytes - max_bytes % RECORD_LENGTH)
+        self.sync_interval = sync_interval
+        self.paths = []
+        self.error = None
+
+        self._file = None
+        self._size = 0
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data):
+        """Queues data, which may be a buffer, to be written.
+
+        Data is dropped once the writer thread has failed.
+        """
+        if self.error is None:
+            self._queue.put(str(data))
+
+    def close(self):
+        """Writes everything queued, then syncs and closes the file."""
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _rotate(self):
+        self._close_file()
+        name = self.prefix + '-' + time.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.directory, name)
+        suffix = 1
+        while os.path.exists(path):
+            suffix += 1
+            path = os.path.join(self.directory, name + '-' + str(suffix))
+        self._file = open(path, 'wb', DUMP_BUFFER_BYTES)
+        self._size = 0
+        self.paths.append(path)
+
+    def _sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _close_file(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def _write(self, data):
+        while data:
+            if self._file is None or self._size >= self.max_bytes:
+                self._rotate()
+            room = self.max_bytes - self._size
+            self._file.write(data[:room])
+            self._size += len(data[:room])
+            data = data[room:]
+
+    def _run(self):
+        import Queue
+
+        last_sync = time.time()
+        closing = False
+        while not closing:
+            try:
+                chunks = [self._queue.get(timeout=self.sync_interval)]
+            except Queue.Empty:
+                chunks = []
+            while True:
+                try:
+                    chunks.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            if None in chunks:
+                closing = True
+                chunks = [chunk for chunk in chunks if chunk is not None]
+
+            if self.error is not None:
+                continue
+            try:
+                self._write(''.join(chunks))
+                if closing:
+                    self._close_file()
+                elif time.time() - last_sync >= self.sync_interval:
+                    self._sync()
+                    last_sync = time.time()
+            except (IOError, OSError) as e:
+                self.error = e
+
+
+def readRecord(in_file, decoder=None):
     """Generator to read each record from the input file.
 
+    Records are decoded by decoder, a new Decoder if not given.
+
     Returns the next record as a named tuples.
     """
+    if decoder is None:
+        decoder = Decoder()
     while True:
 
         # Records are always five bytes wide; read one record.
@@ -156,62 +604,1302 @@ def readRecord(in_file):
             raise ValueError(":TODO:wrong length")
 
         # Now process the input
-        record_as_integer_list = bcd_string_to_integer_list(
-            record_as_bcd_string)
-        if options.dumpmode:
-            d.write(record_as_bcd_string)
-        if options.debugmode:
-            print record_as_integer_list
-        p_dict = integer_list_to_param_dict(record_as_integer_list)
+        yield decoder.decode(record_as_bcd_string)
+
+
+class LiveReader(object):
+    """Reads records from a serial port as soon as each one arrives.
+
+    Every read takes whatever the port is holding, and records are
+    reassembled across read boundaries.  The time the last byte of the
+    current record arrived is kept in 'arrival' so callers can measure
+    arrival-to-output latency.  Records are decoded by decoder, a new Decoder
+    if not given.
+    """
+
+    def __init__(self, port, decoder=None):
+        self.port = port
+        self.decoder = decoder if decoder is not None else Decoder()
+        self.arrival = None
+
+    def waiting(self):
+        """Returns the number of bytes the port is holding, if it can tell."""
+        try:
+            return self.port.in_waiting
+        except AttributeError:
+            pass
+        try:
+            return self.port.inWaiting()
+        except AttributeError:
+            return 0
+
+    def frames(self):
+        """Generator of five byte records, read until the port times out.
+
+        Each read asks for everything the port is holding, or at least the
+        rest of the current record.  Bytes of an incomplete record left when
+        the port times out are reported on stderr and discarded.
+        """
+        pending = ''
+        while True:
+            needed = RECORD_LENGTH - len(pending) % RECORD_LENGTH
+            chunk = self.port.read(max(needed, self.waiting()))
+            if not chunk:
+                break
+            self.arrival = time.time()
+            pending += chunk
+            whole = len(pending) - len(pending) % RECORD_LENGTH
+            for offset in xrange(0, whole, RECORD_LENGTH):
+                yield pending[offset:offset + RECORD_LENGTH]
+            pending = pending[whole:]
+
+        if pending:
+            sys.stderr.write("Discarding " + str(len(pending))
+                             + " bytes of an incomplete record.\n")
+
+    def __iter__(self):
+        for record_as_bcd_string in self.frames():
+            yield self.decoder.decode(record_as_bcd_string)
+
+
+class LatencyStats(object):
+    """Accumulates arrival-to-output latency of live records."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.first = None
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+    def add(self, arrival):
+        """Adds a record output now that arrived at time arrival."""
+        now = time.time()
+        if self.first is None:
+            self.first = now - self.start
+        latency = now - arrival
+        self.count += 1
+        self.total += latency
+        self.worst = max(self.worst, latency)
+
+    def report(self, out):
+        if not self.count:
+            out.write("Live: no records received.\n")
+            return
+        out.write("Live: %d records, first row after %.3f s, latency "
+                  "mean %.3f ms, max %.3f ms.\n"
+                  % (self.count, self.first,
+                     1000.0 * self.total / self.count, 1000.0 * self.worst))
+
+
+class PipelineStats(object):
+    """Times and counts each stage of the decode pipeline for --stats.
+
+    Decoding, classification and overflow adjustment are timed by a Decoder
+    given this object; reading by a TimedFile, or timed() for dump blocks,
+    and writing by a TimedWriter.
+    'arrival' is the time the record being decoded was read, so the latency
+    from read to written row can be measured.
+    """
+    STAGES = ('read', 'decode', 'classify', 'adjust', 'write')
+
+    def __init__(self):
+        self.start = time.time()
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.records = 0
+        self.bytes = 0
+        self.naks = 0
+        self.overflows = 0
+        self.rows = 0
+        self.arrival = None
+        self.latency = LatencyStats()
+
+    def timed(self, stage, iterable):
+        """Generator of the items of iterable, timing each under stage.
+
+        Items timed under 'read' also set 'arrival', as TimedFile does.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            now = time.time()
+            self.seconds[stage] += now - start
+            if stage == 'read':
+                self.arrival = now
+            yield item
+
+    def report(self, out):
+        elapsed = time.time() - self.start
+        out.write("Stats: %d records, %d bytes in %.3f s: %.0f records/sec, "
+                  "%.0f bytes/sec.\n"
+                  % (self.records, self.bytes, elapsed,
+                     self.records / elapsed if elapsed else 0.0,
+                     self.bytes / elapsed if elapsed else 0.0))
+        out.write("Stats: %d NAKs, %d overflow corrections, %d rows.\n"
+                  % (self.naks, self.overflows, self.rows))
+        out.write("Stats: " + ", ".join("%s %.3f s" % (stage,
+                                                      self.seconds[stage])
+                                        for stage in self.STAGES) + ".\n")
+        latency = self.latency
+        if latency.count:
+            out.write("Stats: read to row latency mean %.3f ms, max %.3f ms."
+                      "\n" % (1000.0 * latency.total / latency.count,
+                               1000.0 * latency.worst))
+
+
+class TimedFile(object):
+    """Wraps an input file or serial port, timing its reads in stats."""
+
+    def __init__(self, in_file, stats):
+        self.in_file = in_file
+        self.stats = stats
+
+    def read(self, size=-1):
+        start = time.time()
+        data = self.in_file.read(size)
+        now = time.time()
+        self.stats.seconds['read'] += now - start
+        self.stats.arrival = now
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.in_file, name)
+
+
+class TimedWriter(object):
+    """Wraps a csv writer, timing its writes and read to row latency."""
+
+    def __init__(self, csvwriter, stats):
+        self.csvwriter = csvwriter
+        self.stats = stats
+
+    def writerow(self, row):
+        stats = self.stats
+        start = time.time()
+        self.csvwriter.writerow(row)
+        stats.seconds['write'] += time.time() - start
+        stats.rows += 1
+        if stats.arrival is not None:
+            stats.latency.add(stats.arrival)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+def readDumpFile(in_file):
+    """Reads and decodes a whole dump file in one pass.
+
+    Returns the records as an N x 5 integer matrix; see
+    bcd_buffer_to_integer_matrix().
+    """
+    bcd_buffer = in_file.read()
+    return bcd_buffer_to_integer_matrix(bcd_buffer)
+
+
+class DumpReader(object):
+    """Random access reader for a memory-mapped dump file.
+
+    Records are returned as buffer objects sliced straight from the mapping,
+    so no bytes are copied until a record is decoded and memory use does not
+    grow with the size of the dump.  A ValueError is generated if the file is
+    not a whole number of records.
+    """
+
+    def __init__(self, in_file):
+        self._owns_file = not isinstance(in_file, file)
+        if self._owns_file:
+            in_file = open(in_file, "rb")
+        self.in_file = in_file
+
+        self.size = os.fstat(in_file.fileno()).st_size
+        if self.size % RECORD_LENGTH:
+            self.close()
+            raise ValueError(
+                "Invalid length; dump is not a whole number of records.")
+
+        # mmap() refuses to map an empty file.
+        if self.size:
+            self._map = mmap.mmap(in_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        else:
+            self._map = ''
+
+    def __len__(self):
+        return self.size // RECORD_LENGTH
+
+    def __getitem__(self, index):
+        """Returns record number index, or a slice of whole records."""
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("Record slices must be contiguous.")
+            return buffer(self._map, start * RECORD_LENGTH,
+                          max(0, stop - start) * RECORD_LENGTH)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Record index out of range.")
+        return buffer(self._map, index * RECORD_LENGTH, RECORD_LENGTH)
+
+    def __iter__(self):
+        for offset in xrange(0, self.size, RECORD_LENGTH):
+            yield buffer(self._map, offset, RECORD_LENGTH)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def blocks(self, start=0, stop=None, block_records=BLOCK_RECORDS):
+        """Generator of buffers holding up to block_records whole records.
+
+        Covers records start to stop, defaulting to the whole dump.
+        """
+        if stop is None or stop > len(self):
+            stop = len(self)
+        for first in xrange(start, stop, block_records):
+            yield self[first:min(first + block_records, stop)]
+
+    def close(self):
+        if getattr(self, '_map', ''):
+            self._map.close()
+        self._map = ''
+        if self._owns_file:
+            self.in_file.close()
+
+
+class ArchiveReader(object):
+    """Random access reader for a compressed dump archive.
+
+    Has the interface of DumpReader, but records are returned as strings.
+    Only the chunks holding the records asked for are read and decompressed,
+    and the last one is kept, so reading in order decompresses each chunk
+    once.  Also has read(), so readRecord() can stream the records as from
+    a plain dump.  A ValueError is generated if the file is not an archive.
+    See writeArchive().
+    """
+
+    def __init__(self, in_file):
+        self._owns_file = not isinstance(in_file, file)
+        if self._owns_file:
+            in_file = open(in_file, "rb")
+        self.in_file = in_file
+        self.name = getattr(in_file, 'name', None)
+
+        size = os.fstat(in_file.fileno()).st_size
+        in_file.seek(0)
+        magic = in_file.read(len(ARCHIVE_MAGIC))
+        if magic != ARCHIVE_MAGIC or size < len(ARCHIVE_MAGIC) \
+                + ARCHIVE_TRAILER.size:
+            self.close()
+            raise ValueError("Invalid archive; bad header or trailer.")
+        in_file.seek(size - ARCHIVE_TRAILER.size)
+        self.chunk_records, self.records, index_offset = \
+            ARCHIVE_TRAILER.unpack(in_file.read(ARCHIVE_TRAILER.size))
+
+        # The index holds the offset of each chunk, and of its end, as
+        # 64 bit integers.
+        chunks = -(-self.records // self.chunk_records) \
+            if self.chunk_records else -1
+        if index_offset + 8 * (chunks + 1) + ARCHIVE_TRAILER.size != size:
+            self.close()
+            raise ValueError("Invalid archive; bad chunk index.")
+        in_file.seek(index_offset)
+        self.offsets = struct.unpack('<%dQ' % (chunks + 1),
+                                     in_file.read(8 * (chunks + 1)))
+
+        self.position = 0
+        self._chunk_number = None
+        self._chunk = ''
+
+    def __len__(self):
+        return self.records
+
+    def chunk(self, number):
+        """Returns chunk number, decompressed."""
+        if number != self._chunk_number:
+            import zlib
+
+            self.in_file.seek(self.offsets[number])
+            data = zlib.decompress(self.in_file.read(
+                self.offsets[number + 1] - self.offsets[number]))
+            self._chunk_number, self._chunk = number, data
+        return self._chunk
+
+    def __getitem__(self, index):
+        """Returns record number index, or a slice of whole records."""
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("Record slices must be contiguous.")
+            pieces = []
+            while start < stop:
+                number, first = divmod(start, self.chunk_records)
+                last = min(self.chunk_records, first + stop - start)
+                pieces.append(self.chunk(number)[first * RECORD_LENGTH:
+                                                 last * RECORD_LENGTH])
+                start += last - first
+            return ''.join(pieces)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Record index out of range.")
+        return self[index:index + 1]
+
+    def __iter__(self):
+        for block in self.blocks():
+            for offset in xrange(0, len(block), RECORD_LENGTH):
+                yield block[offset:offset + RECORD_LENGTH]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def blocks(self, start=0, stop=None, block_records=BLOCK_RECORDS):
+        """Generator of strings holding up to block_records whole records.
+
+        Covers records start to stop, defaulting to the whole archive.
+        """
+        if stop is None or stop > len(self):
+            stop = len(self)
+        for first in xrange(start, stop, block_records):
+            yield self[first:min(first + block_records, stop)]
+
+    def read(self, size=-1):
+        """Reads up to size bytes of records from the current position."""
+        total = len(self) * RECORD_LENGTH
+        if size < 0 or self.position + size > total:
+            size = total - self.position
+        pieces = []
+        while size > 0:
+            number, offset = divmod(self.position,
+                                    self.chunk_records * RECORD_LENGTH)
+            piece = self.chunk(number)[offset:offset + size]
+            pieces.append(piece)
+            self.position += len(piece)
+            size -= len(piece)
+        return ''.join(pieces)
+
+    def fileno(self):
+        return self.in_file.fileno()
+
+    def close(self):
+        self._chunk = ''
+        if self._owns_file:
+            self.in_file.close()
+
+
+def writeArchive(in_file, out_file, chunk_records=ARCHIVE_CHUNK_RECORDS,
+                 level=9):
+    """Compresses the records read from in_file into an archive.
+
+    Each chunk_records records are compressed with zlib on their own, at
+    the given level.  in_file is read until each chunk is full, so streams
+    giving short reads, such as serial ports and pipes, still give full
+    chunks.  A ValueError is generated if in_file does not hold a whole
+    number of records.
+
+    Returns the number of records archived.
+    """
+    import zlib
+
+    out_file.write(ARCHIVE_MAGIC)
+    offsets = [len(ARCHIVE_MAGIC)]
+    records = 0
+    chunk_bytes = chunk_records * RECORD_LENGTH
+    while True:
+        pieces = []
+        size = 0
+        while size < chunk_bytes:
+            piece = in_file.read(chunk_bytes - size)
+            if not piece:
+                break
+            pieces.append(piece)
+            size += len(piece)
+        data = ''.join(pieces)
+        if not data:
+            break
+        if len(data) % RECORD_LENGTH:
+            raise ValueError(
+                "Invalid length; dump is not a whole number of records.")
+        compressed = zlib.compress(data, level)
+        out_file.write(compressed)
+        offsets.append(offsets[-1] + len(compressed))
+        records += len(data) // RECORD_LENGTH
+    out_file.write(struct.pack('<%dQ' % len(offsets), *offsets))
+    out_file.write(ARCHIVE_TRAILER.pack(chunk_records, records,
+                                        offsets[-1]))
+    return records
+
+
+def isDumpFile(in_file):
+    """Checks whether in_file is a regular file that can be memory-mapped.
+
+    Returns True for regular files; False for pipes, ttys and serial ports.
+    """
+    try:
+        return stat.S_ISREG(os.fstat(in_file.fileno()).st_mode)
+    except (AttributeError, ValueError, OSError):
+        return False
+
+
+def isArchiveFile(in_file):
+    """Checks whether in_file is a regular file holding a dump archive.
+
+    Returns True for archives and ArchiveReaders; False otherwise.
+    """
+    if isinstance(in_file, ArchiveReader):
+        return True
+    if not isDumpFile(in_file):
+        return False
+    position = in_file.tell()
+    in_file.seek(0)
+    magic = in_file.read(len(ARCHIVE_MAGIC))
+    in_file.seek(position)
+    return magic == ARCHIVE_MAGIC
+
+
+def openDumpReader(in_file):
+    """Opens a random access reader of a dump file or archive.
+
+    in_file is a file name, file object or ArchiveReader; file objects and
+    readers are left open when the reader is closed.
+
+    Returns an ArchiveReader for archives, otherwise a DumpReader.
+    """
+    if isinstance(in_file, ArchiveReader):
+        return ArchiveReader(in_file.in_file)
+    if isinstance(in_file, basestring):
+        with open(in_file, "rb") as f:
+            archive = isArchiveFile(f)
+        return ArchiveReader(in_file) if archive else DumpReader(in_file)
+    if isArchiveFile(in_file):
+        return ArchiveReader(in_file)
+    return DumpReader(in_file)
+
+
+def readBulkRecord(in_file, start=0, stop=None, decoder=None):
+    """Generator to read each record from a dump file using the bulk decoder.
+
+    The file is memory-mapped and decoded one block of records at a time,
+    from record number start up to, but not including, record number stop.
+    Records are decoded by decoder, a new Decoder if not given.  numpy is
+    loaded for dumps of NUMPY_LOAD_RECORDS or more.
+
+    Yields the same records as readRecord().
+    """
+    if decoder is None:
+        decoder = Decoder()
+    with openDumpReader(in_file) as reader:
+        if len(reader) >= NUMPY_LOAD_RECORDS:
+            load_numpy()
+        blocks = reader.blocks(start, stop)
+        if decoder.stats is not None:
+            blocks = decoder.stats.timed('read', blocks)
+        for block in blocks:
+            for record in decoder.decode_block(block):
+                yield record
 
-        if p_dict['ptype'] != 'NAK':
-            p_dict = adjust_lap_hundreds_p_dict(p_dict)
 
-        yield p_dict
+def buildRaceIndex(reader, block_records=BLOCK_RECORDS):
+    """Scans a dump for raceheader records in a single pass.
 
+    Only the type byte of each record is decoded.  Records before the first
+    raceheader do not belong to any race.
 
-def openFile(infile):
+    Returns a list of races in dump order, each a dict giving the byte
+    'offset' of its raceheader, the number of 'records' up to the next
+    raceheader, and its number of 'laps' and 'abstimes'.
+    """
+    header = chr(RECORD_TYPES.index('raceheader'))
+    lap_codes = [chr(code) for code in range(100)
+                 if RECORD_TYPES[code] == 'laptime']
+    abs_codes = [chr(code) for code in range(100)
+                 if RECORD_TYPES[code] == 'abstime']
+
+    races = []
+    base = 0
+    for block in reader.blocks(block_records=block_records):
+        types = str(block)[0::RECORD_LENGTH].translate(BCD_TRANSLATION)
+
+        # Split the block at each raceheader.  Records before the first one
+        # continue the race left open by the previous block.
+        starts = [0]
+        position = types.find(header)
+        while position >= 0:
+            starts.append(position)
+            position = types.find(header, position + 1)
+        starts.append(len(types))
+
+        for first, last in zip(starts, starts[1:]):
+            if first == last:
+                continue
+            segment = types[first:last]
+            if segment[0] == header:
+                races.append({"offset": (base + first) * RECORD_LENGTH,
+                              "records": 0, "laps": 0, "abstimes": 0})
+            if races:
+                race = races[-1]
+                race["records"] += len(segment)
+                race["laps"] += sum(segment.count(c) for c in lap_codes)
+                race["abstimes"] += sum(segment.count(c) for c in abs_codes)
+        base += len(types)
+    return races
+
+
+def loadRaceIndex(in_file):
+    """Gets the race index for a dump file, building it only when needed.
+
+    The index is saved alongside the dump, keyed by the dump's size and
+    modification time, and is rebuilt whenever either changes.  Files
+    without a usable name, e.g. stdin, are indexed without saving.
+
+    Returns the list of races; see buildRaceIndex().
+    """
+    filename = in_file if isinstance(in_file, basestring) else in_file.name
+    if not os.path.isfile(filename):
+        with openDumpReader(in_file) as reader:
+            return buildRaceIndex(reader)
+
+    import json
+
+    st = os.stat(filename)
+    index_filename = filename + RACE_INDEX_SUFFIX
+    try:
+        with open(index_filename, 'r') as f:
+            saved = json.load(f)
+        if saved["size"] == st.st_size and saved["mtime"] == st.st_mtime:
+            return saved["races"]
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+
+    with openDumpReader(filename) as reader:
+        races = buildRaceIndex(reader)
+
+    # Failing to save only means the index is rebuilt next time.
+    try:
+        with open(index_filename, 'w') as f:
+            json.dump({"size": st.st_size, "mtime": st.st_mtime,
+                       "races": races}, f)
+    except IOError:
+        pass
+    return races
+
+
+def parseRaceIds(raceids):
+    """Parses a race selection: a race number "N", a range "N-M" or "last".
+
+    Races are numbered from 1 in dump order.  A ValueError is generated for
+    anything else.
+
+    Returns a (first, last) tuple of race numbers; "last" is (-1, -1),
+    counting from the end of the dump.
+    """
+    if raceids.strip().lower() == 'last':
+        return (-1, -1)
+    try:
+        parts = [int(part) for part in raceids.split('-')]
+    except ValueError:
+        parts = []
+    if len(parts) == 1:
+        parts = parts * 2
+    if len(parts) != 2 or parts[0] < 1 or parts[1] < parts[0]:
+        raise ValueError(
+            "Invalid race ID; expected N, N-M or 'last': " + raceids)
+    return tuple(parts)
+
+
+def resolveRaceIds(selection, race_count):
+    """Converts a race selection to race numbers counted from 1.
+
+    A ValueError is generated if any selected race is not in the dump.
+
+    Returns a (first, last) tuple of race numbers.
+    """
+    first, last = [race_count + 1 + race if race < 0 else race
+                   for race in selection]
+    if first < 1 or last > race_count:
+        raise ValueError("Race ID out of range; dump holds "
+                         + str(race_count) + " races.")
+    return first, last
+
+
+def selectRaces(records, selection):
+    """Generator to filter a stream of records down to the selected races.
+
+    Used where the input cannot seek, such as a serial port.  Selections
+    counted from the end of the dump hold back the trailing races until the
+    stream ends.  A ValueError is generated, once the stream ends, if any
+    selected race was not in it; see resolveRaceIds().
+    """
+    first, last = selection
+    race = 0
+    if first > 0:
+        for record in records:
+            if record.ptype == 'raceheader':
+                race += 1
+                if race > last:
+                    return
+            if first <= race:
+                yield record
+        resolveRaceIds(selection, race)
+        return
+
+    kept = collections.deque(maxlen=-first)
+    for record in records:
+        if record.ptype == 'raceheader':
+            race += 1
+            kept.append([])
+        if kept:
+            kept[-1].append(record)
+    first, last = resolveRaceIds(selection, race)
+    for number, race_records in enumerate(kept, race - len(kept) + 1):
+        if first <= number <= last:
+            for record in race_records:
+                yield record
+
+
+def iterRaceRecords(infile, selection, decoder=None):
+    """Generator to read the records of the selected races only.
+
+    Dump files are looked up in their race index and only the selected
+    slice is decoded; other inputs are filtered with selectRaces().
+    """
+    infile = openFile(infile, decoder is not None and decoder.debug)
+    if not isDumpFile(infile):
+        return selectRaces(readRecord(infile, decoder), selection)
+
+    races = loadRaceIndex(infile)
+    first, last = resolveRaceIds(selection, len(races))
+    start = races[first - 1]["offset"] // RECORD_LENGTH
+    stop = races[last - 1]["offset"] // RECORD_LENGTH \
+        + races[last - 1]["records"]
+    return readBulkRecord(infile, start, stop, decoder)
+
+
+def openFile(infile, debug=False):
     """Attempts to open the given file.
 
-    Returns a file object.
+    Returns a file object; an ArchiveReader for a dump archive.
     """
 
     # First, use infile if it is a file object.
     if isinstance(infile, file):
-        if options.debugmode:
+        if debug:
             print "infile: " + str(infile) + " is an instance of a file"
         return infile
 
     # Next, check if it is a serial port we can open.  Ignore exceptions so we
-    # can try to open infile as a normal file next.
-    try:
-        return serial.Serial(infile, baudrate=4800, timeout=10)
-    except:
-        pass
+    # can try to open infile as a normal file next.  pyserial is only loaded
+    # here, when it is needed, and not at all for regular files.
+    if not os.path.isfile(infile):
+        try:
+            import serial
+            return serial.Serial(infile, baudrate=4800, timeout=10)
+        except:
+            pass
 
     # Finally, try to open it as a normal file.  Let open() throw its
-    # exception normally on failure.
-    if options.debugmode:
+    # exception normally on failure.  Archives are read through an
+    # ArchiveReader, so they read like any other dump.
+    if debug:
         print "Trying to open: " + str(infile) + " as a normal file"
-    return open(infile, "rb")
+    in_file = open(infile, "rb")
+    if isArchiveFile(in_file):
+        return ArchiveReader(in_file)
+    return in_file
+
+
+def iterRecords(infile, decoder=None):
+    """Generator to read each record from the input file or serial port.
+
+    Dump files are memory-mapped and decoded in blocks; anything else is
+    read one record at a time.  Records are decoded by decoder, a new Decoder
+    if not given.
+    """
+    debug = decoder is not None and decoder.debug
+    infile = openFile(infile, debug)
+    if isDumpFile(infile):
+        return readBulkRecord(infile, decoder=decoder)
+    if decoder is not None and decoder.stats is not None:
+        infile = TimedFile(infile, decoder.stats)
+    return readRecord(infile, decoder)
 
 
-def readRecords(infile):
+def readRecords(infile, decoder=None):
     """Reads all records from the input file.
 
-    Returns a list of named tuples, one for each record read.
+    Returns a list of records, one for each record read.
     """
-    infile = openFile(infile)
-    return [record for record in readRecord(infile)]
+    return [record for record in iterRecords(infile, decoder)]
+
+
+def decode_bytes(data, decoder=None):
+    """Decodes a string of whole records, as read from the watch.
+
+    Records are decoded by decoder, a new Decoder if not given.  A
+    ValueError is generated if data is not a whole number of records.
+
+    Returns a list of records.
+    """
+    if decoder is None:
+        decoder = Decoder()
+    return list(decoder.decode_block(data))
+
+
+def iter_records(source, decoder=None):
+    """Generator of the records of a dump file, archive or serial port.
+
+    source is a file name, serial device or file object; see iterRecords().
+    """
+    return iterRecords(source, decoder)
+
+
+def iter_races(source, decoder=None):
+    """Generator of the races of a dump file, archive or serial port.
+
+    Yields a Race for each race; see iterRaces().
+    """
+    return iterRaces(iterRecords(source, decoder))
+
+
+def spoolStream(in_file, dump_file=None):
+    """Copies a stream, such as a serial port, to a temporary file.
+
+    Reads until the stream ends or times out.  Everything read is also
+    written to dump_file, if given.
+
+    Returns the temporary file, positioned at its start, so it can be
+    memory-mapped like any other dump file.
+    """
+    import tempfile
+
+    spool = tempfile.TemporaryFile()
+    while True:
+        chunk = in_file.read(BLOCK_RECORDS * RECORD_LENGTH)
+        if not chunk:
+            break
+        spool.write(chunk)
+        if dump_file is not None:
+            dump_file.write(chunk)
+    spool.flush()
+    spool.seek(0)
+    return spool
+
+
+def teeInput(infile, dump_file, debug=False):
+    """Copies all of the raw records of infile to dump_file up front.
+
+    A race selection or --ingest only decodes some of the races, so their
+    Decoder cannot copy the raw data as it decodes it.  Dump files are
+    copied a block at a time; streams are read to the end and spooled.
+
+    Returns what to read the records from: infile for dump files, or the
+    spooled stream.
+    """
+    in_file = openFile(infile, debug)
+    if not isDumpFile(in_file):
+        return spoolStream(in_file, dump_file)
+    with openDumpReader(in_file) as reader:
+        for block in reader.blocks():
+            dump_file.write(block)
+    return infile
+
+
+def raceFingerprint(race_bytes):
+    """Returns a hex fingerprint of the raw bytes of a race."""
+    import hashlib
+
+    return hashlib.sha1(race_bytes).hexdigest()
+
+
+def loadFingerprints(filename):
+    """Reads the fingerprints of previously ingested races.
+
+    Returns a set of fingerprints; empty if the cache does not exist yet.
+    """
+    try:
+        with open(filename, 'r') as f:
+            return set(line.strip() for line in f if line.strip())
+    except IOError:
+        return set()
+
+
+def saveFingerprints(filename, fingerprints):
+    """Appends newly ingested race fingerprints to the cache."""
+    with open(filename, 'a') as f:
+        for fingerprint in fingerprints:
+            f.write(fingerprint + "\n")
+
+
+def iterNewRaces(infile, known, decoder=None):
+    """Generator to decode only the races that have not been seen before.
+
+    Every download from the watch repeats all of its races, so each race is
+    fingerprinted from its raceheader up to the next raceheader, taking in
+    its raceend and summaries, and skipped if the fingerprint is in known.
+    A race that was still running at the last download has changed, so it
+    is decoded again.  A race repeated within the same dump is only decoded
+    once.  Streams are spooled to a temporary file first.
+
+    Yields a (fingerprint, records) tuple for each new or changed race.
+    """
+    if decoder is None:
+        decoder = Decoder()
+    in_file = openFile(infile, decoder.debug)
+    if not isDumpFile(in_file):
+        in_file = spoolStream(in_file)
+
+    races = loadRaceIndex(in_file)
+    seen = set()
+    with openDumpReader(in_file) as reader:
+        for race in races:
+            start = race["offset"] // RECORD_LENGTH
+            race_bytes = reader[start:start + race["records"]]
+            fingerprint = raceFingerprint(race_bytes)
+            if fingerprint in known or fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            yield fingerprint, list(decoder.decode_block(race_bytes))
+
+
+def chainNewRaces(new_races, fingerprints):
+    """Generator to chain the records of the races from iterNewRaces().
+
+    Each race's fingerprint is appended to fingerprints as its records are
+    reached, ready to be saved once they have been output.
+    """
+    for fingerprint, records in new_races:
+        fingerprints.append(fingerprint)
+        for record in records:
+            yield record
+
+
+def record_hundredths(record):
+    """Converts the time held in a laptime, avtime or fastesttime record.
+
+    The hours are the units digit of the type code.
+
+    Returns the time in hundredths of a second.
+    """
+    return (((record.p1 % 10) * 60 + record.p2) * 60 + record.p3) * 100 \
+        + record.p4
+
+
+def split_hundredths(hundredths):
+    """Splits a time in hundredths of a second into its parts.
+
+    Returns an (hours, minutes, seconds, hundredths) tuple.
+    """
+    seconds, hundredths = divmod(hundredths, 100)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return hours, minutes, seconds, hundredths
+
+
+def format_hundredths(hundredths):
+    """Formats a time in hundredths of a second as H:MM:SS.hh."""
+    return "%d:%02d:%02d.%02d" % split_hundredths(hundredths)
+
+
+def parse_hundredths(text):
+    """Parses a time written as [[H:]MM:]SS[.hh].
+
+    A ValueError is generated if text is not a time.
+
+    Returns the time in hundredths of a second.
+    """
+    seconds, _, fraction = text.strip().partition('.')
+    if len(fraction) > 2 or not (fraction.isdigit() or fraction == ''):
+        raise ValueError("Invalid time: " + text)
+    parts = seconds.split(':')
+    if len(parts) > 3 or not all(part.isdigit() for part in parts):
+        raise ValueError("Invalid time: " + text)
+    total = 0
+    for part in parts:
+        total = total * 60 + int(part)
+    return total * 100 + int((fraction + '00')[:2])
+
+
+def finish_times(lap_hundredths, start=0):
+    """Computes every finisher's elapsed time in one cumulative sum.
+
+    lap_hundredths holds the lap times of a race, in hundredths of a second,
+    in finishing order, and start the elapsed time before the first of them.
+
+    Returns a list of finishing times in hundredths of a second.
+    """
+    if use_numpy(len(lap_hundredths), VECTOR_MIN_LAPS):
+        return (numpy.cumsum(numpy.asarray(lap_hundredths,
+                                           dtype=numpy.int64))
+                + start).tolist()
+    times = []
+    total = start
+    for lap in lap_hundredths:
+        total += lap
+        times.append(total)
+    return times
+
+
+def finish_gaps(times, leader=None, previous=None):
+    """Computes every finisher's gaps in one pass over their finishing times.
+
+    times holds finishing times in finishing order.  leader is the leader's
+    time and previous the finish before times[0], if they came earlier;
+    otherwise the first of times is the leader, with gaps of zero.
+
+    Returns a (gaps_to_leader, gaps_to_previous) tuple of lists.
+    """
+    if not len(times):
+        return [], []
+    if leader is None:
+        leader = previous = times[0]
+    if use_numpy(len(times), VECTOR_MIN_LAPS):
+        times = numpy.asarray(times, dtype=numpy.int64)
+        return ((times - leader).tolist(),
+                numpy.diff(numpy.concatenate(([previous], times))).tolist())
+    to_leader = [finish - leader for finish in times]
+    to_previous = [finish - before for finish, before
+                   in itertools.izip(times, itertools.chain([previous],
+                                                            times))]
+    return to_leader, to_previous
+
+
+def race_results(lap_hundredths):
+    """Computes the results of a race from its lap times.
+
+    Each lap is the time from one finisher to the next, so a finisher's gap
+    to the previous finisher is their lap time; the leader's is zero.
+
+    Returns a list of (position, finish, gap_to_leader, gap_to_previous)
+    tuples, with times in hundredths of a second.
+    """
+    times = finish_times(lap_hundredths)
+    to_leader, to_previous = finish_gaps(times)
+    return zip(xrange(1, len(times) + 1), times, to_leader, to_previous)
+
+
+Lap = collections.namedtuple('Lap', ['lap', 'hundredths'])
+
+
+class Race(object):
+    """A race held compactly in memory.
+
+    Laps are stored as parallel array('i') columns of lap number and lap time
+    in hundredths of a second, a few bytes per lap.  Indexing returns a Lap,
+    slicing returns a Race holding just those laps, and iteration yields each
+    Lap in turn.  The watch's summary is kept as the 'average' and 'fastest'
+    lap times in hundredths, and 'end', the raceend record; each is None
+    until its record is seen.  'watch_number' is the race number the watch
+    gave in the raceheader, as 'number' only counts races in the input.
+    """
+    __slots__ = ('number', 'watch_number', 'laps', 'hundredths', 'average',
+                 'fastest', 'end')
+
+    def __init__(self, number=None, watch_number=None):
+        self.number = number
+        self.watch_number = watch_number
+        self.laps = array.array('i')
+        self.hundredths = array.array('i')
+        self.average = None
+        self.fastest = None
+        self.end = None
+
+    def __len__(self):
+        return len(self.laps)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            race = Race(self.number, self.watch_number)
+            race.laps = self.laps[index]
+            race.hundredths = self.hundredths[index]
+            race.average = self.average
+            race.fastest = self.fastest
+            race.end = self.end
+            return race
+        return Lap(self.laps[index], self.hundredths[index])
+
+    def __iter__(self):
+        return itertools.starmap(Lap, itertools.izip(self.laps,
+                                                     self.hundredths))
+
+    def __repr__(self):
+        return "<Race %s: %d laps>" % (self.number, len(self))
+
+    def append(self, lap, hundredths):
+        """Adds a lap to the end of the race."""
+        self.laps.append(lap)
+        self.hundredths.append(hundredths)
+
+    def add_record(self, record):
+        """Adds a decoded laptime, avtime, fastesttime or raceend record."""
+        rtc = record.ptype
+        if rtc == 'laptime':
+            self.append(record.p5, record_hundredths(record))
+        elif rtc == 'avtime':
+            self.average = record_hundredths(record)
+        elif rtc == 'fastesttime':
+            self.fastest = record_hundredths(record)
+        elif rtc == 'raceend':
+            self.end = record
+
+    def finish_times(self):
+        """Returns each finisher's elapsed time; see finish_times()."""
+        return finish_times(self.hundredths)
+
+    def results(self):
+        """Returns the results of the race; see race_results()."""
+        return race_results(self.hundredths)
+
+
+def iterRaces(records):
+    """Generator to group decoded records into races.
+
+    Records before the first raceheader do not belong to any race.
+
+    Yields a Race for each raceheader, numbered from 1 and with the watch's
+    race number, once all of its records have been read.
+    """
+    race = None
+    number = 0
+    for record in records:
+        if record.ptype == 'raceheader':
+            if race is not None:
+                yield race
+            number += 1
+            race = Race(number, record.p5)
+        elif race is not None:
+            race.add_record(record)
+    if race is not None:
+        yield race
+
+
+class ResultBuilder(object):
+    """Builds the CSV result rows of a stream of decoded records.
+
+    Lap times are summed, as integer hundredths of a second, to give each
+    finisher's elapsed time.  With gaps set, each finisher's row also gets
+    their gap to the leader and to the previous finisher.  row() builds one
+    record's row at a time; rows() computes the times and gaps of each run
+    of finishers in a batch at once, once the run is long enough to be
+    worth it.  The position and running times are kept between calls, so
+    records may be passed in any number of batches.
+    """
+
+    # Record types that give a row.  The NAKs and abstimes between laps do
+    # not, so they do not end a run of finishers.
+    ROW_TYPES = frozenset(['raceheader', 'laptime', 'raceend', 'avtime',
+                           'fastesttime'])
+
+    def __init__(self, gaps=False):
+        self.gaps = gaps
+        self.position = 0
+        self.finish = 0
+        self.leader = 0
+
+    def row(self, record):
+        """Returns the result row for record, or None if it has none."""
+        rtc = record.ptype
+        if rtc == 'raceheader':
+            self.position = 0
+            self.finish = self.leader = 0
+            return ['New Race Detected']
+        elif rtc == 'laptime':
+            self.position += 1
+            if self.position != record.p5:
+                raise ValueError(
+                    "Mismatch between lap record and internal counter")
+            previous = self.finish
+            self.finish += record_hundredths(record)
+            if self.position == 1:
+                self.leader = previous = self.finish
+            row = ['Finisher', self.position] \
+                + list(split_hundredths(self.finish))
+            if self.gaps:
+                row += [format_hundredths(self.finish - self.leader),
+                        format_hundredths(self.finish - previous)]
+            return row
+        elif rtc == 'raceend':
+            return ['Race Finished']
+        elif rtc == 'avtime':
+            return ['Average Lap Time'] \
+                + list(split_hundredths(record_hundredths(record)))
+        elif rtc == 'fastesttime':
+            return ['Fastest Lap Time'] \
+                + list(split_hundredths(record_hundredths(record)))
+        return None
+
+    def lap_rows(self, records):
+        """Returns the result rows of consecutive laptime records.
+
+        The finishing times and gaps of the whole run are computed at once;
+        see finish_times() and finish_gaps().
+        """
+        position = self.position
+        for expected, record in enumerate(records, position + 1):
+            if record.p5 != expected:
+                raise ValueError(
+                    "Mismatch between lap record and internal counter")
+        times = finish_times([record_hundredths(record)
+                              for record in records], self.finish)
+        rows = [['Finisher', expected] + list(split_hundredths(finish))
+                for expected, finish in enumerate(times, position + 1)]
+        if self.gaps:
+            if position:
+                gaps = finish_gaps(times, self.leader, self.finish)
+            else:
+                gaps = finish_gaps(times)
+            for row, to_leader, to_previous in itertools.izip(rows, *gaps):
+                row += [format_hundredths(to_leader),
+                        format_hundredths(to_previous)]
+        if not position:
+            self.leader = times[0]
+        self.position += len(records)
+        self.finish = times[-1]
+        return rows
+
+    def rows(self, records):
+        """Returns the list of result rows for a batch of records.
+
+        The laptime records of a batch up to the next record with a row are
+        a run of finishers.  Runs of VECTOR_MIN_LAPS or more go through
+        lap_rows(), shorter ones through row().
+        """
+        rows = []
+        laps = []
+        row = self.row
+        row_types = self.ROW_TYPES
+        for record in records:
+            rtc = record.ptype
+            if rtc == 'laptime':
+                laps.append(record)
+            elif rtc in row_types:
+                if laps:
+                    rows.extend(self.run_rows(laps))
+                    laps = []
+                rows.append(row(record))
+        if laps:
+            rows.extend(self.run_rows(laps))
+        return rows
+
+    def run_rows(self, laps):
+        """Returns the rows of a run of laptime records; see rows()."""
+        if len(laps) >= VECTOR_MIN_LAPS:
+            return self.lap_rows(laps)
+        row = self.row
+        return [row(record) for record in laps]
+
+
+def writeResults(records, csvwriter, gaps=False):
+    """Writes the finishers and race summaries of records as CSV rows.
+
+    Each row is written as soon as its record is read; see ResultBuilder.
+    """
+    row = ResultBuilder(gaps).row
+    for record in records:
+        result = row(record)
+        if result is not None:
+            csvwriter.writerow(result)
+
+
+def flushEachRecord(records, out, live_stats=None):
+    """Generator to flush out after each live record has been written.
+
+    The latency of each record is added to live_stats, if given.
+    """
+    for record in records:
+        yield record
+        out.flush()
+        if live_stats is not None:
+            live_stats.add(records.arrival)
+
+
+def convertFile(paths):
+    """Converts one dump file to a CSV file.
+
+    paths is an (infile, outfile) tuple, so this can be mapped across a
+    process pool.  Each call decodes with its own Decoder.
+
+    Returns an (infile, outfile, error) tuple; error is None on success.
+    """
+    import csv
+    infile, outfile = paths
+    try:
+        with open(outfile, 'wb') as op:
+            csvwriter = csv.writer(op, delimiter=',',
+                                   quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writeResults(iterRecords(infile, Decoder()), csvwriter)
+    except (IOError, OSError, ValueError) as e:
+        return infile, outfile, str(e)
+    return infile, outfile, None
+
+
+def convertDirectory(indir, outdir, processes=None):
+    """Converts every dump file in indir to a CSV file in outdir.
+
+    Files are converted in parallel across a pool of processes, one per CPU
+    if processes is not given.  Race indexes and CSV files in indir are
+    skipped.
+
+    Returns a list of (infile, outfile, error) tuples; see convertFile().
+    """
+    jobs = []
+    for name in sorted(os.listdir(indir)):
+        infile = os.path.join(indir, name)
+        if not os.path.isfile(infile) \
+                or name.endswith((RACE_INDEX_SUFFIX, '.csv')):
+            continue
+        outfile = os.path.join(outdir, os.path.splitext(name)[0] + '.csv')
+        jobs.append((infile, outfile))
+
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(convertFile, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv=None):
+    """Runs the command line, with the arguments argv or sys.argv.
+
+    dt2000cli.py only imports this module and calls main(), so the module is
+    loaded from its compiled .pyc rather than compiled on every run.
+    """
+    import csv
+    import optparse
 
-if __name__ == "__main__":
     parser = optparse.OptionParser()
     parser.add_option("--dump",
                       dest="dumpmode",
                       default=0,
                       action='store_const',
                       const=1,
-                      help="Dump raw data")
+                      help="Also copy the raw data to timestamped capture "
+                      "files, dump-YYYYMMDD-HHMMSS.")
+    parser.add_option("--dump-dir",
+                      dest="dumpdir",
+                      metavar="DIR",
+                      default='.',
+                      help="Directory for --dump capture files, the current "
+                      "directory if not specified.")
+    parser.add_option("--dump-size",
+                      dest="dumpsize",
+                      metavar="MB",
+                      type=int,
+                      default=DUMP_ROTATE_BYTES // (1024 * 1024),
+                      help="Start a new --dump capture file after this many "
+                      "megabytes, " + str(DUMP_ROTATE_BYTES // (1024 * 1024))
+                      + " if not specified.")
     parser.add_option("-d", "--debug",
                       dest="debugmode",
                       default=0,
@@ -231,10 +1919,117 @@ if __name__ == "__main__":
     parser.add_option("-r", "--raceid",
                       dest="raceid",
                       metavar="NUM",
+                      default=None,
+                      help="Race ID to display: a race number, a range "
+                      "N-M or 'last'.  All races if not specified.")
+    parser.add_option("--live",
+                      dest="livemode",
+                      default=0,
+                      action='store_const',
+                      const=1,
+                      help="Write each row as soon as its record arrives, "
+                      "and report latency on stderr.")
+    parser.add_option("--gaps",
+                      dest="gaps",
+                      default=0,
+                      action='store_const',
+                      const=1,
+                      help="Add each finisher's gap to the leader and to "
+                      "the previous finisher.")
+    parser.add_option("--sqlite",
+                      dest="database",
+                      metavar="FILE",
+                      default=None,
+                      help="Store races in an SQLite results database "
+                      "instead of writing CSV; see resultsdb.py.")
+    parser.add_option("--sink",
+                      dest="sinks",
+                      metavar="KIND:FILE",
+                      action='append',
+                      default=[],
+                      help="Write results to FILE ('-' for stdout) as KIND: "
+                      "csv, jsonl, board, sqlite or stats.  May be repeated; "
+                      "all are written in one pass.  Replaces the CSV "
+                      "output to -o.")
+    parser.add_option("--season",
+                      dest="season",
+                      metavar="NAME",
+                      default=None,
+                      help="Season name stored with races for --sqlite.")
+    parser.add_option("--ingest",
+                      dest="ingestcache",
+                      metavar="FILE",
+                      default=None,
+                      help="Only output races not already listed in the "
+                      "fingerprint cache FILE, then add them to it.")
+    parser.add_option("--batch",
+                      dest="batchdir",
+                      metavar="DIR",
+                      default=None,
+                      help="Convert every dump file in DIR to a CSV file in "
+                      "the output directory, DIR if -o is not specified.")
+    parser.add_option("-j", "--jobs",
+                      dest="jobs",
+                      metavar="NUM",
                       type=int,
-                      default=1,
-                      help="Race ID to display.")
-    (options, args) = parser.parse_args()
+                      default=None,
+                      help="Number of processes for --batch, one per CPU "
+                      "if not specified.")
+    parser.add_option("--archive",
+                      dest="archivefile",
+                      metavar="FILE",
+                      default=None,
+                      help="Compress the input dump into the archive FILE, "
+                      "which can then be read with -f like any dump, and "
+                      "exit.")
+    parser.add_option("--stats",
+                      dest="stats",
+                      default=0,
+                      action='store_const',
+                      const=1,
+                      help="Time each stage and report throughput, NAKs, "
+                      "overflow corrections and latency on stderr.")
+    parser.add_option("--profile",
+                      dest="profile",
+                      metavar="FILE",
+                      default=None,
+                      help="Profile the run with cProfile and save the "
+                      "stats to FILE.")
+    (options, args) = parser.parse_args(argv)
+    if options.jobs is not None and options.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+
+    if options.batchdir:
+        outdir = options.outfile
+        if isinstance(outdir, file):
+            outdir = options.batchdir
+        failed = 0
+        for infile, outfile, error in convertDirectory(
+                options.batchdir, outdir, options.jobs):
+            if error:
+                failed += 1
+                sys.stderr.write(infile + ": " + error + "\n")
+            elif options.debugmode:
+                print infile + " -> " + outfile
+        sys.exit(1 if failed else 0)
+
+    if options.archivefile:
+        in_file = openFile(options.infile, options.debugmode)
+        try:
+            with open(options.archivefile, 'wb') as f:
+                records = writeArchive(in_file, f)
+        except (IOError, ValueError) as e:
+            parser.error(str(e))
+        if options.debugmode:
+            print "Archived " + str(records) + " records"
+        sys.exit(0)
+
+    race_selection = None
+    if options.raceid:
+        try:
+            race_selection = parseRaceIds(options.raceid)
+        except ValueError as e:
+            parser.error(str(e))
 
     if options.debugmode:
         print "debugmode = " + str(options.debugmode)
@@ -242,8 +2037,18 @@ if __name__ == "__main__":
         print "outfile = " + str(options.outfile)
         print "dumpmode = " + str(options.dumpmode)
 
+    # --dump copies the raw data as it is decoded, unless only some races
+    # will be decoded; then all of it is copied before any are selected.
+    d = None
     if options.dumpmode:
-        d = open('dump', 'w')
+        if options.dumpsize < 1:
+            parser.error("--dump-size must be at least 1.")
+        d = DumpTee(options.dumpdir,
+                    max_bytes=options.dumpsize * 1024 * 1024)
+    tee_first = d is not None and bool(race_selection or options.ingestcache)
+    stats = PipelineStats() if options.stats else None
+    decoder = Decoder(dump_file=None if tee_first else d,
+                      debug=options.debugmode, stats=stats)
     if isinstance(options.outfile, file):
         if options.debugmode:
             print "outfile: " + str(options.outfile) \
@@ -260,88 +2065,105 @@ if __name__ == "__main__":
         csvwriter.writerow(['Spam'] * 5 + ['Baked Beans'])
         csvwriter.writerow(['Spam', 'Lovely Spam', 'Wonderful Spam'])
 
-    current_race = 0
-    elapsed_secs = 0L
-    position = 0
-    pos_hundredths = pos_secs = pos_mins = pos_hours = 0
-
-    for record in readRecords(options.infile):
-        if not options.dumpmode:
-            rtc = record['ptype']
-            if rtc != 'NAK':
-                if rtc == 'raceheader':
-                    csvwriter.writerow(['New Race Detected'])
-                    # print "New Race Detected"
-                    elapsed_secs = 0L
-                    position = 0
-                    pos_hundredths = pos_secs = pos_mins = pos_hours = 0
-                elif rtc == 'laptime':
-                    position += 1
-                    lap_time_hours = record['p1'] % 10
-                    lap_time_minutes = record['p2']
-                    lap_time_secs = record['p3']
-                    lap_time_hundredths = record['p4']
-                    elapsed_secs += (lap_time_hours * 3600 + lap_time_minutes * 60
-                                     + lap_time_secs
-                                     + lap_time_hundredths / 100.0)
-                    pos_hundredths += lap_time_hundredths
-                    if pos_hundredths >= 100:
-                        pos_hundredths = pos_hundredths % 100
-                        pos_secs += 1
-                    pos_secs += lap_time_secs
-                    if pos_secs >= 60:
-                        pos_secs = pos_secs % 60
-                        pos_mins += 1
-                    pos_mins += lap_time_minutes
-                    if pos_mins >= 60:
-                        pos_mins = pos_mins % 60
-                        pos_hours += 1
-                    pos_hours += lap_time_hours
-                    if position != record['p5']:
-                        raise ValueError(
-                            "Mismatch between lap record and internal counter")
-                    csvwriter.writerow(['Finisher']
-                                       + [str(position)]
-                                       + [str(pos_hours)]
-                                       + [str(pos_mins)]
-                                       + [str(pos_secs)]
-                                       + [str(pos_hundredths)])
-                    # print "Finisher: " + str(position) + "  Finishing time: " \
-                    #     + str(pos_hours) + " Hrs. " + str(pos_mins) + " Mins. " \
-                    #     + str(pos_secs) + " Secs. " \
-                    #     + str(pos_hundredths) + " Hundr. "
-                elif rtc == 'raceend':
-                    # print "Race finished"
-                    csvwriter.writerow(['Race Finished'])
-                elif rtc == 'avtime':
-                    av_lap_time_hours = record['p1'] % 10
-                    av_lap_time_minutes = record['p2']
-                    av_lap_time_secs = record['p3']
-                    av_lap_time_hundredths = record['p4']
-                    csvwriter.writerow(['Average Lap Time']
-                                       + [str(av_lap_time_hours)]
-                                       + [str(av_lap_time_minutes)]
-                                       + [str(av_lap_time_secs)]
-                                       + [str(av_lap_time_hundredths)])
-                    # print "Average Lap time: " + str(av_lap_time_hours) \
-                    #     + " Hrs. " + str(av_lap_time_minutes) + " Mins. " \
-                    #     + str(av_lap_time_secs) + " Secs. " \
-                    #     + str(av_lap_time_hundredths) + " Hundr. "
-                elif rtc == 'fastesttime':
-                    f_lap_time_hours = record['p1'] % 10
-                    f_lap_time_minutes = record['p2']
-                    f_lap_time_secs = record['p3']
-                    f_lap_time_hundredths = record['p4']
-                    csvwriter.writerow(['Fastest Lap Time']
-                                       + [str(f_lap_time_hours)]
-                                       + [str(f_lap_time_minutes)]
-                                       + [str(f_lap_time_secs)]
-                                       + [str(f_lap_time_hundredths)])
-                    # print "Fastest Lap time: " + str(f_lap_time_hours) \
-                    #     + " Hrs. " + str(f_lap_time_minutes) + " Mins. " \
-                    #     + str(f_lap_time_secs) + " Secs. " \
-                    #     + str(f_lap_time_hundredths) + " Hundr. "
+    import sinks
+    outputs = []
+    try:
+        for spec in options.sinks:
+            outputs.append(sinks.openSink(spec, options.gaps,
+                                          str(options.infile),
+                                          options.season))
+    except (IOError, ValueError) as e:
+        parser.error(str(e))
+    if options.database:
+        import resultsdb
+        outputs.append(sinks.SqliteSink(resultsdb.connect(options.database),
+                                        str(options.infile), options.season,
+                                        owned=True))
+    if not outputs:
+        outputs.append(sinks.CsvSink(op, options.gaps))
+    if stats is not None:
+        for sink in outputs:
+            if isinstance(sink, sinks.CsvSink):
+                sink.csvwriter = TimedWriter(sink.csvwriter, stats)
+
+    live_stats = None
+    new_fingerprints = []
+    infile = options.infile
+    if options.ingestcache:
+        if race_selection or options.livemode:
+            parser.error("--ingest cannot be combined with --raceid or "
+                         "--live.")
+        if tee_first:
+            infile = teeInput(infile, d, options.debugmode)
+        known = loadFingerprints(options.ingestcache)
+        records = chainNewRaces(iterNewRaces(infile, known, decoder),
+                                new_fingerprints)
+    elif options.livemode:
+        if race_selection:
+            parser.error("--live cannot be combined with --raceid.")
+        port = openFile(options.infile, options.debugmode)
+        if stats is not None:
+            port = TimedFile(port, stats)
+        records = LiveReader(port, decoder)
+        live_stats = LatencyStats()
+        records = flushEachRecord(records, op, live_stats)
+    elif race_selection:
+        if tee_first:
+            infile = teeInput(infile, d, options.debugmode)
+        try:
+            records = iterRaceRecords(infile, race_selection, decoder)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        records = iterRecords(options.infile, decoder)
+
+    if options.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # Live rows are written, and flushed, one record at a time.  A race
+    # selection read from a stream is only checked once the stream ends.
+    try:
+        if options.livemode:
+            sinks.writeSinks(records, outputs, batch_records=1, flush=True)
         else:
-            if options.dumpmode:
-                d.close()
+            sinks.writeSinks(records, outputs)
+    except ValueError as e:
+        if not race_selection:
+            raise
+        parser.error(str(e))
+    for sink in outputs:
+        sink.close()
+        if options.debugmode and isinstance(sink, sinks.SqliteSink):
+            print "Stored " + str(len(sink.race_ids)) + " races"
+
+    if options.profile:
+        profiler.disable()
+        profiler.dump_stats(options.profile)
+    tee_failed = False
+    if d is not None:
+        # Decoding copied the raw records to the capture files.  A failure
+        # there did not stop the results, so it is only reported.
+        try:
+            d.close()
+        except (IOError, OSError) as e:
+            tee_failed = True
+            sys.stderr.write("--dump: raw data not saved: " + str(e) + "\n")
+        if options.debugmode:
+            print "Raw data saved to " + ', '.join(d.paths)
+    if options.ingestcache:
+        saveFingerprints(options.ingestcache, new_fingerprints)
+        if options.debugmode:
+            print "Ingested " + str(len(new_fingerprints)) + " new races"
     op.close()
+    if live_stats is not None:
+        live_stats.report(sys.stderr)
+    if stats is not None:
+        stats.report(sys.stderr)
+    if tee_failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
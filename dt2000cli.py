@@ -0,0 +1,30 @@
+"""
+    dt2000cli.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Runs dt2000.py's command line; it takes the same options.
+
+Python compiles the script it is given on every run, but loads imported
+modules from their compiled .pyc, so starting through this small script
+saves compiling all of dt2000.py each time.
+"""
+
+import dt2000
+
+if __name__ == "__main__":
+    dt2000.main()
@@ -0,0 +1,149 @@
+"""
+    gendump.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Generates valid DT2000 dump files of any size for testing and benchmarks.
+
+Each race has a field of runners whose finishing times are drawn from a
+log-normal distribution, as real fields bunch around the median and trail
+off behind it.  The watch records the time between one finisher and the
+next, so laps are the gaps between sorted finishing times.  Fields of more
+than 99 runners exercise the lap number overflow.
+"""
+
+import math
+import optparse
+import random
+import sys
+
+import dt2000
+import watchsim
+
+# Median finishing time, in hundredths of a second, and the spread of the
+# log-normal distribution: about 25 minutes, as for a 5k.
+MEDIAN = 150000
+SPREAD = 0.2
+
+# Smallest and largest field.
+MIN_RUNNERS = 20
+MAX_RUNNERS = 400
+
+# Longest time a record can hold: hours are a single digit.
+MAX_HUNDREDTHS = ((9 * 60 + 59) * 60 + 59) * 100 + 99
+
+
+def race_laps(runners, rng, median=MEDIAN, spread=SPREAD):
+    """Draws a field's finishing times.
+
+    Returns the laps, in hundredths of a second, between each finisher and
+    the one before; the leader's lap is their finishing time.
+    """
+    mu = math.log(median)
+    times = sorted(min(int(rng.lognormvariate(mu, spread)), MAX_HUNDREDTHS)
+                   for _ in xrange(runners))
+    return [finish - previous
+            for previous, finish in zip([0] + times[:-1], times)]
+
+
+def iterRaces(seed=None, min_runners=MIN_RUNNERS, max_runners=MAX_RUNNERS,
+              naks=True):
+    """Generator of an endless series of races, numbered from 1.
+
+    Yields each race as a string of records; see watchsim.race_bytes().
+    """
+    rng = random.Random(seed)
+    number = 0
+    while True:
+        number += 1
+        runners = rng.randint(min_runners, max_runners)
+        yield watchsim.race_bytes(race_laps(runners, rng), number, naks)
+
+
+def generateDump(out_file, records, seed=None, min_runners=MIN_RUNNERS,
+                 max_runners=MAX_RUNNERS, naks=True):
+    """Writes a dump of exactly records records to out_file.
+
+    The last race is cut short, as if the download had been interrupted, if
+    it does not fit.
+
+    Returns the number of races written.
+    """
+    remaining = records * dt2000.RECORD_LENGTH
+    races = 0
+    for race in iterRaces(seed, min_runners, max_runners, naks):
+        if remaining <= 0:
+            break
+        out_file.write(race[:remaining])
+        remaining -= len(race)
+        races += 1
+    return races
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--records",
+                      dest="records",
+                      metavar="NUM",
+                      type=int,
+                      default=100000,
+                      help="Number of records, 100000 if not specified.")
+    parser.add_option("-o", "--outfile",
+                      dest="outfile",
+                      metavar="FILE",
+                      default=sys.stdout,
+                      help="Output file, stdout if not specified.")
+    parser.add_option("--seed",
+                      dest="seed",
+                      metavar="NUM",
+                      type=int,
+                      default=None,
+                      help="Random seed, for repeatable dumps.")
+    parser.add_option("--min-runners",
+                      dest="min_runners",
+                      metavar="NUM",
+                      type=int,
+                      default=MIN_RUNNERS,
+                      help="Smallest field, " + str(MIN_RUNNERS)
+                      + " if not specified.")
+    parser.add_option("--max-runners",
+                      dest="max_runners",
+                      metavar="NUM",
+                      type=int,
+                      default=MAX_RUNNERS,
+                      help="Largest field, " + str(MAX_RUNNERS)
+                      + " if not specified.")
+    parser.add_option("--no-naks",
+                      dest="naks",
+                      default=True,
+                      action='store_false',
+                      help="Leave out the unknown record the watch sends "
+                      "after each lap.")
+    (options, args) = parser.parse_args()
+    if options.min_runners > options.max_runners:
+        parser.error("--min-runners is larger than --max-runners.")
+
+    if isinstance(options.outfile, file):
+        op = options.outfile
+    else:
+        op = open(options.outfile, 'wb')
+    races = generateDump(op, options.records, options.seed,
+                         options.min_runners, options.max_runners,
+                         options.naks)
+    op.close()
+    sys.stderr.write("Wrote " + str(options.records) + " records in "
+                     + str(races) + " races.\n")
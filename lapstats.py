@@ -0,0 +1,244 @@
+"""
+    lapstats.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Lap statistics of each race, kept up to date as laps arrive rather than
+waiting for the watch's summary records after the raceend.
+
+Each lap is added in constant time and memory: the count, mean, fastest and
+slowest are running values, percentiles are estimated with the P-squared
+algorithm (Jain and Chlamtac, 1985), which keeps five markers per
+percentile, and the finishing rate counts the finishers in the last minute
+of race time.  Once the watch's average and fastest lap arrive they are
+checked against these.
+"""
+
+import bisect
+import collections
+import json
+
+import dt2000
+import sinks
+
+# Percentiles estimated for each race.
+QUANTILES = (0.5, 0.9)
+
+# Race time, in hundredths of a second, over which the finishing rate is
+# counted.
+RATE_WINDOW = 6000
+
+
+class P2Quantile(object):
+    """Estimates a quantile of a stream of values in constant memory.
+
+    The P-squared algorithm keeps five markers, the minimum, the quantile
+    p/2, p and (1+p)/2 and the maximum, and moves them towards their
+    desired positions as values arrive.  Exact until five values are seen.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0]
+        self.increments = [0.0, p / 2.0, p, (1 + p) / 2.0, 1.0]
+
+    def add(self, value):
+        heights = self.heights
+        if len(heights) < 5:
+            bisect.insort(heights, value)
+            return
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = bisect.bisect_right(heights, value) - 1
+
+        positions = self.positions
+        for i in xrange(cell + 1, 5):
+            positions[i] += 1
+        for i in xrange(5):
+            self.desired[i] += self.increments[i]
+
+        for i in xrange(1, 4):
+            offset = self.desired[i] - positions[i]
+            if (offset >= 1 and positions[i + 1] - positions[i] > 1) or \
+                    (offset <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if offset > 0 else -1
+                height = self.parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * float(
+                        heights[i + step] - heights[i]) \
+                        / (positions[i + step] - positions[i])
+                heights[i] = height
+                positions[i] += step
+
+    def parabolic(self, i, step):
+        """Returns marker i's height moved by step, by the P-squared
+        parabolic formula."""
+        q, n = self.heights, self.positions
+        return q[i] + float(step) / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * float(q[i + 1] - q[i])
+            / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * float(q[i] - q[i - 1])
+            / (n[i] - n[i - 1]))
+
+    def value(self):
+        """Returns the estimate, or None if no values have been added."""
+        heights = self.heights
+        if not heights:
+            return None
+        if len(heights) < 5:
+            return heights[int(round(self.p * (len(heights) - 1)))]
+        return heights[2]
+
+
+class RaceStats(object):
+    """Running lap statistics of one race.
+
+    Lap times are in hundredths of a second.  'finish' is the race time of
+    the last finisher, and 'recent' the race times of the finishers in the
+    RATE_WINDOW before it.
+    """
+
+    def __init__(self, number=None, quantiles=QUANTILES):
+        self.number = number
+        self.count = 0
+        self.total = 0
+        self.fastest = None
+        self.slowest = None
+        self.finish = 0
+        self.sketches = [P2Quantile(p) for p in quantiles]
+        self.recent = collections.deque()
+
+    def add(self, hundredths):
+        """Adds the next finisher's lap time."""
+        self.count += 1
+        self.total += hundredths
+        if self.fastest is None or hundredths < self.fastest:
+            self.fastest = hundredths
+        if self.slowest is None or hundredths > self.slowest:
+            self.slowest = hundredths
+        for sketch in self.sketches:
+            sketch.add(hundredths)
+        self.finish += hundredths
+        recent = self.recent
+        recent.append(self.finish)
+        while recent[0] <= self.finish - RATE_WINDOW:
+            recent.popleft()
+
+    def mean(self):
+        """Returns the mean lap time, or None before the first lap."""
+        return self.total / float(self.count) if self.count else None
+
+    def rate(self):
+        """Returns the number of finishers in the last minute of race time."""
+        return len(self.recent)
+
+    def summary(self):
+        """Returns the statistics as a dict, as written by StatsSink."""
+        mean = self.mean()
+        return {"race": self.number,
+                "count": self.count,
+                "mean": round(mean, 2) if mean is not None else None,
+                "fastest": self.fastest,
+                "slowest": self.slowest,
+                "percentiles": dict(
+                    ("p%g" % (100 * sketch.p),
+                     round(sketch.value(), 2)
+                     if sketch.value() is not None else None)
+                    for sketch in self.sketches),
+                "rate": self.rate()}
+
+    def check(self, average=None, fastest=None):
+        """Compares the watch's average and fastest lap with these.
+
+        The watch's average is the mean lap truncated to the hundredth.
+
+        Returns a list of the names of the values that differ.
+        """
+        differ = []
+        if average is not None and (not self.count
+                                    or self.total // self.count != average):
+            differ.append('average')
+        if fastest is not None and fastest != self.fastest:
+            differ.append('fastest')
+        return differ
+
+
+class StatsSink(sinks.FileSink):
+    """Writes the running lap statistics of each race as JSON lines.
+
+    After each batch of records holding laps, the current race's statistics
+    are written as an 'event' of 'stats'; see RaceStats.summary().  When the
+    watch's average or fastest lap arrives, a 'check' event records it with
+    'differ', the list of values that do not agree.  Times are integer
+    hundredths of a second.
+    """
+
+    def __init__(self, out_file, owned=False, quantiles=QUANTILES):
+        sinks.FileSink.__init__(self, out_file, owned)
+        self.quantiles = quantiles
+        self.stats = None
+        self.number = 0
+
+    def events(self, records):
+        """Returns the event dicts for a batch of records."""
+        events = []
+        changed = False
+        for record in records:
+            rtc = record.ptype
+            if rtc == 'raceheader':
+                if changed:
+                    events.append(self.stats_event())
+                    changed = False
+                self.number += 1
+                self.stats = RaceStats(self.number, self.quantiles)
+            elif self.stats is None:
+                continue
+            elif rtc == 'laptime':
+                self.stats.add(dt2000.record_hundredths(record))
+                changed = True
+            elif rtc in ('avtime', 'fastesttime'):
+                if changed:
+                    events.append(self.stats_event())
+                    changed = False
+                watch = dt2000.record_hundredths(record)
+                kind = 'average' if rtc == 'avtime' else 'fastest'
+                events.append({"event": "check", "race": self.number,
+                               kind: watch,
+                               "differ": self.stats.check(
+                                   **{kind: watch})})
+        if changed:
+            events.append(self.stats_event())
+        return events
+
+    def stats_event(self):
+        event = self.stats.summary()
+        event["event"] = "stats"
+        return event
+
+    def write(self, records):
+        events = self.events(records)
+        if events:
+            self.out_file.write(''.join(json.dumps(event, sort_keys=True)
+                                        + '\n' for event in events))
+
@@ -0,0 +1,372 @@
+"""
+    liveserver.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Serves live results while records arrive from the watch, or from a replayed
+dump.  Standings are kept up to date one record at a time, and each event is
+pushed to every connected client:
+
+    GET /standings    the current race's standings and running lap
+                      statistics as JSON; see lapstats.py
+    GET /events       a Server-Sent Events stream of race events
+    --tcp PORT        the same events as JSON lines over plain TCP
+
+The rendered standings are cached and only rebuilt after they change, so
+any number of clients can poll them during a busy finish.
+"""
+
+import BaseHTTPServer
+import json
+import optparse
+import Queue
+import SocketServer
+import sys
+import threading
+import time
+
+import dt2000
+import lapstats
+import sinks
+
+# Seconds between keep-alive comments on an idle event stream, so clients
+# that have gone away are noticed.
+KEEPALIVE_SECONDS = 15
+
+# Events held for each client.  A client that falls this far behind is
+# disconnected, so one stalled client cannot grow memory without limit.
+SUBSCRIBER_EVENTS = 1000
+
+# Seconds shutdown() waits for each client thread to finish.
+JOIN_SECONDS = 5
+
+
+class LiveResults(sinks.JsonLinesSink):
+    """Keeps the standings of the current race and broadcasts its events.
+
+    A sink, so it can be fed by sinks.writeSinks().  Each subscriber has a
+    queue of the JSON encoded events that arrive after it subscribed, ended
+    by None when the subscriber is dropped for falling behind or close() is
+    called.  Records before the first raceheader, as when joining a download
+    part way through a race, are skipped.
+    """
+
+    def __init__(self):
+        sinks.JsonLinesSink.__init__(self, None)
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.standings = {"race": None, "finished": False, "finishers": [],
+                          "average": None, "fastest": None, "stats": None}
+        self.stats = None
+        self.closed = False
+        self._snapshot = None
+
+    def subscribe(self):
+        """Returns a new queue of event lines."""
+        subscriber = Queue.Queue(SUBSCRIBER_EVENTS)
+        with self.lock:
+            if self.closed:
+                subscriber.put(None)
+            else:
+                self.subscribers.append(subscriber)
+        return subscriber
+
+    def drop(self, subscriber):
+        """Unsubscribes a subscriber and ends its queue."""
+        self.unsubscribe(subscriber)
+        while True:
+            try:
+                subscriber.put_nowait(None)
+                return
+            except Queue.Full:
+                # Make room by discarding the oldest event.
+                try:
+                    subscriber.get_nowait()
+                except Queue.Empty:
+                    pass
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def snapshot(self):
+        """Returns the standings as JSON, rebuilt only if they changed."""
+        with self.lock:
+            if self._snapshot is None:
+                self._snapshot = json.dumps(self.standings, sort_keys=True)
+            return self._snapshot
+
+    def update(self, event):
+        """Applies an event to the standings; the lock must be held."""
+        kind = event["event"]
+        standings = self.standings
+        if kind == 'race':
+            self.stats = lapstats.RaceStats(event["race"])
+            standings.update(race=event["race"], finished=False,
+                             finishers=[], average=None, fastest=None,
+                             stats=self.stats.summary())
+        elif kind == 'finisher':
+            if self.stats is None:
+                return
+            self.stats.add(event["lap"])
+            standings["stats"] = self.stats.summary()
+            standings["finishers"].append({
+                "position": event["position"],
+                "finish": event["finish"],
+                "time": dt2000.format_hundredths(event["finish"]),
+                "gap": event["gap"]})
+        elif kind == 'end':
+            standings["finished"] = True
+        elif kind in ('average', 'fastest'):
+            standings[kind] = event["time"]
+        self._snapshot = None
+
+    def write(self, records):
+        for record in records:
+            if not self.race and record.ptype != 'raceheader':
+                continue
+            event = self.event(record)
+            if event is None:
+                continue
+            line = json.dumps(event, sort_keys=True)
+            with self.lock:
+                self.update(event)
+                subscribers = list(self.subscribers)
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(line)
+                except Queue.Full:
+                    self.drop(subscriber)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Ends the queue of every subscriber, so their streams finish."""
+        with self.lock:
+            self.closed = True
+            subscribers, self.subscribers = self.subscribers, []
+        for subscriber in subscribers:
+            self.drop(subscriber)
+
+
+class ResultsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves /standings and the /events stream of server.results."""
+
+    def do_GET(self):
+        if self.path == '/standings':
+            body = self.server.results.snapshot()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/events':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.stream()
+        else:
+            self.send_error(404)
+
+    def stream(self):
+        results = self.server.results
+        subscriber = results.subscribe()
+        try:
+            self.wfile.write("event: standings\ndata: "
+                             + results.snapshot() + "\n\n")
+            self.wfile.flush()
+            while True:
+                try:
+                    line = subscriber.get(timeout=KEEPALIVE_SECONDS)
+                    if line is None:
+                        break
+                    self.wfile.write("data: " + line + "\n\n")
+                except Queue.Empty:
+                    self.wfile.write(": keep-alive\n\n")
+                self.wfile.flush()
+        except (IOError, OSError):
+            pass
+        finally:
+            results.unsubscribe(subscriber)
+
+    # A client going away mid-stream is not an error.
+    def handle(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        except (IOError, OSError):
+            pass
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except (IOError, OSError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ClientThreadsMixIn(SocketServer.ThreadingMixIn):
+    """Serves each client on a thread, ended and joined by shutdown().
+
+    shutdown() closes the server's results, so every event stream finishes.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    # Client threads still running, replaced per server on each request.
+    threads = ()
+
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self.process_request_thread,
+                                  args=(request, client_address))
+        thread.daemon = self.daemon_threads
+        self.threads = [t for t in self.threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def shutdown(self):
+        self.results.close()
+        SocketServer.BaseServer.shutdown(self)
+        for thread in self.threads:
+            thread.join(JOIN_SECONDS)
+
+
+class ResultsHTTPServer(ClientThreadsMixIn, BaseHTTPServer.HTTPServer):
+    """An HTTP server with a thread per client, serving results."""
+
+    def __init__(self, address, results):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ResultsHandler)
+        self.results = results
+
+
+class EventStreamHandler(SocketServer.StreamRequestHandler):
+    """Sends the standings, then each event, as lines of JSON."""
+
+    def handle(self):
+        results = self.server.results
+        subscriber = results.subscribe()
+        try:
+            self.wfile.write(results.snapshot() + "\n")
+            while True:
+                try:
+                    line = subscriber.get(timeout=KEEPALIVE_SECONDS)
+                    if line is None:
+                        break
+                    self.wfile.write(line + "\n")
+                except Queue.Empty:
+                    self.wfile.write("\n")
+                self.wfile.flush()
+        except (IOError, OSError):
+            pass
+        finally:
+            results.unsubscribe(subscriber)
+
+    def finish(self):
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except (IOError, OSError):
+            # The client went away mid-stream.
+            pass
+
+
+class ResultsTCPServer(ClientThreadsMixIn, SocketServer.TCPServer):
+    """A TCP server with a thread per client, streaming events."""
+
+    def __init__(self, address, results):
+        SocketServer.TCPServer.__init__(self, address, EventStreamHandler)
+        self.results = results
+
+
+def startServer(server):
+    """Serves requests on a background thread."""
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def pacedRecords(records, delay):
+    """Generator of records, sleeping delay seconds after each finisher."""
+    for record in records:
+        yield record
+        if record.ptype == 'laptime':
+            time.sleep(delay)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-f", "--infile",
+                      dest="infile",
+                      metavar="FILE",
+                      default=sys.stdin,
+                      help="Serial port or dump file, stdin if not "
+                      "specified.")
+    parser.add_option("--host",
+                      dest="host",
+                      metavar="ADDRESS",
+                      default='',
+                      help="Address to listen on, all if not specified.")
+    parser.add_option("-p", "--port",
+                      dest="port",
+                      metavar="NUM",
+                      type=int,
+                      default=8000,
+                      help="HTTP port, 8000 if not specified.")
+    parser.add_option("--tcp",
+                      dest="tcp_port",
+                      metavar="NUM",
+                      type=int,
+                      default=None,
+                      help="Also stream events as JSON lines on this TCP "
+                      "port.")
+    parser.add_option("--delay",
+                      dest="delay",
+                      metavar="SECONDS",
+                      type=float,
+                      default=0.0,
+                      help="Pause after each finisher, to replay a dump "
+                      "at a watchable pace.")
+    (options, args) = parser.parse_args()
+
+    results = LiveResults()
+    servers = [ResultsHTTPServer((options.host, options.port), results)]
+    if options.tcp_port is not None:
+        servers.append(ResultsTCPServer((options.host, options.tcp_port),
+                                        results))
+    for server in servers:
+        startServer(server)
+
+    in_file = dt2000.openFile(options.infile)
+    if dt2000.isDumpFile(in_file):
+        records = dt2000.readBulkRecord(in_file)
+    else:
+        records = dt2000.LiveReader(in_file)
+    if options.delay:
+        records = pacedRecords(records, options.delay)
+
+    try:
+        sinks.writeSinks(records, [results], batch_records=1)
+        sys.stderr.write("Input finished; still serving, Ctrl-C to stop.\n")
+        while True:
+            time.sleep(KEEPALIVE_SECONDS)
+    except KeyboardInterrupt:
+        pass
+    for server in servers:
+        server.shutdown()
@@ -0,0 +1,285 @@
+"""
+    multiwatch.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Merges the results of several watches timing the same event, for example
+one per finish chute, and backup watches timing the same runners again.
+
+Every source, serial port or dump file, is read at the same time on its own
+thread with its own Decoder.  The races of each watch are then aligned with
+those of the first: races are held in the same order on every watch, and
+two races match when their spans of finishing times mostly overlap, so a
+race missed by one watch, or a test race on another, does not throw the
+rest out.  The finishers of matched races are merged in time order.  Every
+finish on a chute watch is a runner of their own, however close to a finish
+in another chute.  A finish on a backup watch within the tolerance of
+another watch's finish is the same runner, and is only kept if no other
+watch recorded them.
+
+A watch only records times since it was started, not the time of day, so
+the watches must be started together, for example by the same gun.  An
+offset between their starts cannot be corrected, and races whose finishes
+are offset by more than the tolerance are not merged as the same runners.
+"""
+
+import collections
+import csv
+import optparse
+import sys
+import threading
+
+import dt2000
+
+# A finish on a backup watch this close, in hundredths of a second, to one
+# on another watch is the same runner.
+TOLERANCE = 25
+
+# Smallest overlap of two races' finishing spans for them to match.
+MIN_OVERLAP = 0.5
+
+# A merged finisher: finishing time in hundredths and the list of indexes of
+# the sources that recorded it.
+Finisher = collections.namedtuple('Finisher', ['finish', 'sources'])
+
+
+def readSources(infiles):
+    """Reads and groups the races of every source concurrently.
+
+    Each source is read on its own thread with its own Decoder.
+
+    Returns a list of (races, error) tuples, one per source in order; error
+    is None on success.
+    """
+    results = [None] * len(infiles)
+
+    def read(index, infile):
+        try:
+            races = list(dt2000.iterRaces(dt2000.iterRecords(
+                infile, dt2000.Decoder())))
+            results[index] = (races, None)
+        except (IOError, OSError, ValueError) as e:
+            results[index] = ([], str(e))
+
+    threads = [threading.Thread(target=read, args=(index, infile))
+               for index, infile in enumerate(infiles)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def raceOverlap(first, second, tolerance=TOLERANCE):
+    """Measures how far the finishing spans of two races overlap.
+
+    Each span runs from the first to the last finish, widened by tolerance
+    either side.
+
+    Returns the overlap as a fraction of the combined span, 0 to 1.
+    """
+    if not len(first) or not len(second):
+        return 0.0
+    first = first.finish_times()
+    second = second.finish_times()
+    low = max(first[0], second[0]) - tolerance
+    high = min(first[-1], second[-1]) + tolerance
+    union = max(first[-1], second[-1]) - min(first[0], second[0]) \
+        + 2 * tolerance
+    return max(0, high - low) / float(union)
+
+
+def alignRaces(reference, other, min_overlap=MIN_OVERLAP,
+               tolerance=TOLERANCE):
+    """Matches the races of two watches, keeping them in order.
+
+    Finds the matching, in order, of races with an overlap of at least
+    min_overlap that has the greatest total overlap.
+
+    Returns a list of (reference index, other index) pairs.
+    """
+    rows, columns = len(reference), len(other)
+    best = [[0.0] * (columns + 1) for _ in xrange(rows + 1)]
+    for i in xrange(1, rows + 1):
+        for j in xrange(1, columns + 1):
+            score = max(best[i - 1][j], best[i][j - 1])
+            overlap = raceOverlap(reference[i - 1], other[j - 1], tolerance)
+            if overlap >= min_overlap:
+                score = max(score, best[i - 1][j - 1] + overlap)
+            best[i][j] = score
+
+    pairs = []
+    i, j = rows, columns
+    while i and j:
+        if best[i][j] == best[i - 1][j]:
+            i -= 1
+        elif best[i][j] == best[i][j - 1]:
+            j -= 1
+        else:
+            pairs.append((i - 1, j - 1))
+            i -= 1
+            j -= 1
+    pairs.reverse()
+    return pairs
+
+
+def groupRaces(sources, min_overlap=MIN_OVERLAP, tolerance=TOLERANCE):
+    """Groups the races of every source that were the same race.
+
+    sources is a list of race lists, one per watch; the first is the
+    reference.  A race with no match on the reference watch gets a group of
+    its own, after the group of its watch's previous race.
+
+    Returns a list of dicts of source index to Race, in race order.
+    """
+    if not sources:
+        return []
+    groups = [{0: race} for race in sources[0]]
+    for index in xrange(1, len(sources)):
+        races = sources[index]
+        reference_groups = list(groups)
+        matches = dict((j, i) for i, j in alignRaces(
+            sources[0], races, min_overlap, tolerance))
+        previous = None
+        for j, race in enumerate(races):
+            if j in matches:
+                previous = reference_groups[matches[j]]
+                previous[index] = race
+                continue
+            group = {index: race}
+            position = groups.index(previous) + 1 \
+                if previous is not None else 0
+            groups.insert(position, group)
+            previous = group
+    return groups
+
+
+def mergeFinishers(group, tolerance=TOLERANCE, backups=()):
+    """Merges the finishers of one race recorded by several watches.
+
+    backups holds the indexes of the sources that are backup watches; the
+    others are chute watches.  Finishes are taken in time order.  One within
+    tolerance of the previous merged finisher, from a watch that did not
+    record that finisher, is the same runner if either finish is from a
+    backup watch; two chute watches never record the same runner.  The
+    earliest time is kept.
+
+    Returns a list of Finisher in finishing order.
+    """
+    backups = frozenset(backups)
+    finishes = sorted((finish, source)
+                      for source, race in group.items()
+                      for finish in race.finish_times())
+    merged = []
+    for finish, source in finishes:
+        if merged and finish - merged[-1].finish <= tolerance \
+                and source not in merged[-1].sources \
+                and (source in backups
+                     or backups.issuperset(merged[-1].sources)):
+            merged[-1].sources.append(source)
+        else:
+            merged.append(Finisher(finish, [source]))
+    return merged
+
+
+def writeMergedResults(groups, csvwriter, tolerance=TOLERANCE, backups=()):
+    """Writes the merged races as CSV rows.
+
+    Rows are as from dt2000.writeResults(), and each finisher's row ends
+    with the watches, numbered from 1, that recorded them, e.g. '1+3'.
+    backups holds the indexes of the backup watches; see mergeFinishers().
+    Returns the number of duplicate finishes merged.
+    """
+    duplicates = 0
+    for group in groups:
+        csvwriter.writerow(['New Race Detected'])
+        rows = []
+        for position, finisher in enumerate(
+                mergeFinishers(group, tolerance, backups), 1):
+            duplicates += len(finisher.sources) - 1
+            rows.append(['Finisher', position]
+                        + list(dt2000.split_hundredths(finisher.finish))
+                        + ['+'.join(str(source + 1)
+                                    for source in sorted(finisher.sources))])
+        csvwriter.writerows(rows)
+        if any(race.end is not None for race in group.values()):
+            csvwriter.writerow(['Race Finished'])
+    return duplicates
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(
+        usage="%prog -f SOURCE [-f SOURCE ...] [-b SOURCE ...] [-o FILE]")
+    parser.add_option("-f", "--infile",
+                      dest="infiles",
+                      metavar="FILE",
+                      action='append',
+                      default=[],
+                      help="Serial port or dump file of a chute watch; give "
+                      "one for each chute.  The first is the reference.")
+    parser.add_option("-b", "--backup",
+                      dest="backups",
+                      metavar="FILE",
+                      action='append',
+                      default=[],
+                      help="Serial port or dump file of a backup watch, "
+                      "timing runners also timed by another watch.  Its "
+                      "finishes close to another watch's are dropped as "
+                      "duplicates.")
+    parser.add_option("-o", "--outfile",
+                      dest="outfile",
+                      metavar="FILE",
+                      default=sys.stdout,
+                      help="Output file, stdout if not specified.")
+    parser.add_option("-t", "--tolerance",
+                      dest="tolerance",
+                      metavar="SECONDS",
+                      type=float,
+                      default=TOLERANCE / 100.0,
+                      help="Finishes on a backup watch this close to "
+                      "another watch's are the same runner, %.2f if not "
+                      "specified." % (TOLERANCE / 100.0))
+    (options, args) = parser.parse_args()
+    if not options.infiles:
+        parser.error("Give the reference watch with -f.")
+    infiles = options.infiles + options.backups
+    if len(infiles) < 2:
+        parser.error("Give at least two sources to merge.")
+    tolerance = int(round(options.tolerance * 100))
+    backups = range(len(options.infiles), len(infiles))
+
+    results = readSources(infiles)
+    sources = []
+    for infile, (races, error) in zip(infiles, results):
+        if error:
+            sys.stderr.write(infile + ": " + error + "\n")
+        sources.append(races)
+    if not sources[0]:
+        parser.error("No races read from the reference watch.")
+
+    if isinstance(options.outfile, file):
+        op = options.outfile
+    else:
+        op = open(options.outfile, 'wb')
+    csvwriter = csv.writer(op, delimiter=',',
+                           quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    groups = groupRaces(sources, tolerance=tolerance)
+    duplicates = writeMergedResults(groups, csvwriter, tolerance, backups)
+    op.close()
+    sys.stderr.write("Merged %d races from %d watches; %d duplicate "
+                     "finishes removed.\n"
+                     % (len(groups), len(sources), duplicates))
@@ -0,0 +1,273 @@
+"""
+    resultsdb.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Stores decoded races in a local SQLite database so historical questions can
+be answered without re-parsing the raw dumps.  All times are stored as
+integer hundredths of a second.
+
+Races are identified by their source and the race number the watch gave
+them, with a digest of their laps and summary.  Storing a race already held
+unchanged does nothing, and a race that was still running when it was last
+stored, so its laps so far are the start of the new copy, is replaced.
+"""
+
+import hashlib
+import optparse
+import sqlite3
+import sys
+import csv
+
+import dt2000
+
+# Number of finisher rows inserted per transaction.
+BATCH_ROWS = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS races (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    season TEXT,
+    laps INTEGER NOT NULL,
+    average INTEGER,
+    fastest INTEGER,
+    finished INTEGER NOT NULL,
+    fingerprint TEXT
+);
+CREATE TABLE IF NOT EXISTS finishers (
+    race_id INTEGER NOT NULL REFERENCES races (id),
+    position INTEGER NOT NULL,
+    lap INTEGER NOT NULL,
+    finish INTEGER NOT NULL,
+    PRIMARY KEY (race_id, position)
+);
+CREATE INDEX IF NOT EXISTS races_season ON races (season);
+CREATE INDEX IF NOT EXISTS races_source ON races (source, number);
+CREATE INDEX IF NOT EXISTS finishers_position ON finishers (position);
+CREATE INDEX IF NOT EXISTS finishers_finish ON finishers (finish);
+CREATE INDEX IF NOT EXISTS finishers_lap ON finishers (lap);
+"""
+
+
+def connect(filename):
+    """Opens a results database, creating its tables if needed.
+
+    Returns an sqlite3 connection.
+    """
+    conn = sqlite3.connect(filename)
+    conn.executescript(SCHEMA)
+    # Databases made before races had a fingerprint gain the column.
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(races)")]
+    if 'fingerprint' not in columns:
+        conn.execute("ALTER TABLE races ADD COLUMN fingerprint TEXT")
+        conn.commit()
+    return conn
+
+
+def raceFingerprint(race):
+    """Returns a digest of a race's laps and summary."""
+    digest = hashlib.sha1(race.laps.tostring())
+    digest.update(race.hundredths.tostring())
+    digest.update(repr((race.average, race.fastest, race.end is not None)))
+    return digest.hexdigest()
+
+
+def findRace(cursor, race, source, fingerprint):
+    """Looks for the stored copy of a race.
+
+    Returns a (race_id, unchanged) tuple: the id of the latest race from
+    source with the same number, if it is unchanged or is an unfinished
+    start of race, otherwise (None, False).
+    """
+    row = cursor.execute(
+        "SELECT id, finished, fingerprint FROM races WHERE source = ?"
+        " AND number = ? ORDER BY id DESC LIMIT 1",
+        (source, race.number)).fetchone()
+    if row is None:
+        return None, False
+    race_id, finished, stored = row
+    if stored == fingerprint:
+        return race_id, True
+    if finished:
+        return None, False
+    laps = [lap for lap, in cursor.execute(
+        "SELECT lap FROM finishers WHERE race_id = ? ORDER BY position",
+        (race_id,))]
+    if laps == race.hundredths[:len(laps)].tolist():
+        return race_id, False
+    return None, False
+
+
+def storeRaces(conn, races, source, season=None, batch_rows=BATCH_ROWS):
+    """Inserts races, their finishers and summaries into the database.
+
+    races is an iterable of dt2000.Race, numbered by the watch's race number
+    where it is known.  A race already stored unchanged is skipped, and an
+    unfinished copy of a race is replaced by the new one; see findRace().
+    Rows are inserted in transactions of about batch_rows finishers, so a
+    large archive neither holds one huge transaction open nor commits once
+    per row.
+
+    Returns the list of ids of the races inserted or replaced.
+    """
+    race_ids = []
+    pending = 0
+    cursor = conn.cursor()
+    try:
+        for race in races:
+            if race.watch_number is not None:
+                race = race[:]
+                race.number = race.watch_number
+            fingerprint = raceFingerprint(race)
+            race_id, unchanged = findRace(cursor, race, source, fingerprint)
+            if unchanged:
+                continue
+            row = (source, race.number, season, len(race), race.average,
+                   race.fastest, int(race.end is not None), fingerprint)
+            if race_id is None:
+                cursor.execute(
+                    "INSERT INTO races (source, number, season, laps,"
+                    " average, fastest, finished, fingerprint)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+                race_id = cursor.lastrowid
+            else:
+                cursor.execute(
+                    "UPDATE races SET source = ?, number = ?, season = ?,"
+                    " laps = ?, average = ?, fastest = ?, finished = ?,"
+                    " fingerprint = ? WHERE id = ?", row + (race_id,))
+                cursor.execute("DELETE FROM finishers WHERE race_id = ?",
+                               (race_id,))
+            race_ids.append(race_id)
+            cursor.executemany(
+                "INSERT INTO finishers (race_id, position, lap, finish)"
+                " VALUES (?, ?, ?, ?)",
+                [(race_id, position, lap, finish)
+                 for position, lap, finish in
+                 zip(xrange(1, len(race) + 1), race.hundredths,
+                     race.finish_times())])
+            pending += len(race) + 1
+            if pending >= batch_rows:
+                conn.commit()
+                pending = 0
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    return race_ids
+
+
+def listRaces(conn, season=None):
+    """Returns (id, source, number, season, laps, average, fastest) rows."""
+    query = "SELECT id, source, number, season, laps, average, fastest" \
+        " FROM races"
+    args = ()
+    if season is not None:
+        query += " WHERE season = ?"
+        args = (season,)
+    return conn.execute(query + " ORDER BY id", args).fetchall()
+
+
+def topFinishers(conn, race_id, count=10):
+    """Returns the first count (position, finish) rows of a race."""
+    return conn.execute(
+        "SELECT position, finish FROM finishers WHERE race_id = ?"
+        " ORDER BY position LIMIT ?", (race_id, count)).fetchall()
+
+
+def finishersUnder(conn, hundredths, season=None):
+    """Finds every finisher faster than a time, fastest first.
+
+    Returns (race_id, position, finish) rows.
+    """
+    query = "SELECT f.race_id, f.position, f.finish FROM finishers f"
+    args = [hundredths]
+    if season is not None:
+        query += " JOIN races r ON r.id = f.race_id WHERE f.finish < ?" \
+            " AND r.season = ?"
+        args.append(season)
+    else:
+        query += " WHERE f.finish < ?"
+    return conn.execute(query + " ORDER BY f.finish", args).fetchall()
+
+
+def fastestLaps(conn, count=10, season=None):
+    """Finds the fastest laps, fastest first.
+
+    Returns (race_id, position, lap) rows.
+    """
+    query = "SELECT f.race_id, f.position, f.lap FROM finishers f"
+    args = []
+    if season is not None:
+        query += " JOIN races r ON r.id = f.race_id WHERE r.season = ?"
+        args.append(season)
+    args.append(count)
+    return conn.execute(query + " ORDER BY f.lap LIMIT ?", args).fetchall()
+
+
+def formatRow(row, time_columns):
+    """Formats the time columns of a result row as H:MM:SS.hh."""
+    return [dt2000.format_hundredths(value)
+            if column in time_columns and value is not None else value
+            for column, value in enumerate(row)]
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(
+        usage="%prog -d DB races|top RACE [N]|under TIME|fastest [N]")
+    parser.add_option("-d", "--database",
+                      dest="database",
+                      metavar="FILE",
+                      default="results.db",
+                      help="Results database, results.db if not specified.")
+    parser.add_option("-s", "--season",
+                      dest="season",
+                      metavar="NAME",
+                      default=None,
+                      help="Only query races from this season.")
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("No query given.")
+
+    conn = connect(options.database)
+    csvwriter = csv.writer(sys.stdout, delimiter=',',
+                           quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    command = args[0]
+    try:
+        if command == 'races':
+            rows = [formatRow(row, (5, 6))
+                    for row in listRaces(conn, options.season)]
+        elif command == 'top' and len(args) in (2, 3):
+            count = int(args[2]) if len(args) > 2 else 10
+            rows = [formatRow(row, (1,))
+                    for row in topFinishers(conn, int(args[1]), count)]
+        elif command == 'under' and len(args) == 2:
+            rows = [formatRow(row, (2,))
+                    for row in finishersUnder(
+                        conn, dt2000.parse_hundredths(args[1]),
+                        options.season)]
+        elif command == 'fastest' and len(args) in (1, 2):
+            count = int(args[1]) if len(args) > 1 else 10
+            rows = [formatRow(row, (2,))
+                    for row in fastestLaps(conn, count, options.season)]
+        else:
+            parser.error("Unknown query: " + ' '.join(args))
+    except ValueError as e:
+        parser.error(str(e))
+    csvwriter.writerows(rows)
+    conn.close()
@@ -0,0 +1,246 @@
+"""
+    sinks.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Output sinks for decoded records, so one decode pass can feed several
+outputs at once: CSV, JSON Lines, a fixed-width results board, the SQLite
+results database and running lap statistics; see lapstats.py.
+
+Every sink has write(records), taking a batch of records, plus flush() and
+close().  Each batch is turned into rows and written in one bulk write.
+"""
+
+import csv
+import itertools
+import json
+import sys
+
+import dt2000
+
+# Kinds of sink that can be given to openSink().
+SINK_KINDS = ('csv', 'jsonl', 'board', 'sqlite', 'stats')
+
+
+class FileSink(object):
+    """Base class of sinks writing to a file object.
+
+    The file is closed by close() only if owned is set.
+    """
+
+    def __init__(self, out_file, owned=False):
+        self.out_file = out_file
+        self.owned = owned
+
+    def flush(self):
+        self.out_file.flush()
+
+    def close(self):
+        if self.owned:
+            self.out_file.close()
+
+
+class CsvSink(FileSink):
+    """Writes the CSV result rows of dt2000.writeResults()."""
+
+    def __init__(self, out_file, gaps=False, owned=False):
+        FileSink.__init__(self, out_file, owned)
+        self.csvwriter = csv.writer(out_file, delimiter=',',
+                                    quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        self.builder = dt2000.ResultBuilder(gaps)
+
+    def write(self, records):
+        self.csvwriter.writerows(self.builder.rows(records))
+
+
+class JsonLinesSink(FileSink):
+    """Writes one JSON object per line for each race event.
+
+    Every object has an 'event' of 'race', 'finisher', 'end', 'average' or
+    'fastest' and the 'race' number, counted from 1.  Times are integer
+    hundredths of a second.
+    """
+
+    def __init__(self, out_file, owned=False):
+        FileSink.__init__(self, out_file, owned)
+        self.builder = dt2000.ResultBuilder()
+        self.race = 0
+
+    def event(self, record):
+        """Returns the event dict for record, or None if it has none."""
+        rtc = record.ptype
+        if rtc == 'raceheader':
+            self.builder.row(record)
+            self.race += 1
+            return {"event": "race", "race": self.race}
+        elif rtc == 'laptime':
+            builder = self.builder
+            builder.row(record)
+            return {"event": "finisher", "race": self.race,
+                    "position": builder.position,
+                    "lap": dt2000.record_hundredths(record),
+                    "finish": builder.finish,
+                    "gap": builder.finish - builder.leader}
+        elif rtc == 'raceend':
+            return {"event": "end", "race": self.race}
+        elif rtc == 'avtime':
+            return {"event": "average", "race": self.race,
+                    "time": dt2000.record_hundredths(record)}
+        elif rtc == 'fastesttime':
+            return {"event": "fastest", "race": self.race,
+                    "time": dt2000.record_hundredths(record)}
+        return None
+
+    def write(self, records):
+        events = [event for event in itertools.imap(self.event, records)
+                  if event is not None]
+        if events:
+            self.out_file.write(''.join(json.dumps(event, sort_keys=True)
+                                        + '\n' for event in events))
+
+
+class BoardSink(FileSink):
+    """Writes a fixed-width results board, one line per finisher."""
+
+    def __init__(self, out_file, owned=False):
+        FileSink.__init__(self, out_file, owned)
+        self.builder = dt2000.ResultBuilder(gaps=True)
+        self.race = 0
+
+    def line(self, record):
+        """Returns the board line(s) for record, or None if it has none."""
+        row = self.builder.row(record)
+        if row is None:
+            return None
+        rtc = record.ptype
+        if rtc == 'raceheader':
+            self.race += 1
+            return "Race %d\n%4s  %11s  %11s\n" % (self.race, "Pos", "Time",
+                                                   "Gap")
+        elif rtc == 'laptime':
+            return "%4d  %11s  %11s\n" % (
+                self.builder.position,
+                dt2000.format_hundredths(self.builder.finish), row[-2])
+        elif rtc == 'raceend':
+            return "Finished\n"
+        return "%-17s  %11s\n" % (
+            row[0], dt2000.format_hundredths(dt2000.record_hundredths(
+                record)))
+
+    def write(self, records):
+        lines = [line for line in itertools.imap(self.line, records)
+                 if line is not None]
+        if lines:
+            self.out_file.write(''.join(lines))
+
+
+class SqliteSink(object):
+    """Stores races in a results database; see resultsdb.storeRaces().
+
+    Each race is stored once its next raceheader, or the end of the
+    records, is seen.  Races are keyed on the watch's race number, so a race
+    sent again by a later download replaces the partial copy stored before.
+    The ids of the races stored are kept in 'race_ids'.  The connection is
+    closed by close() only if owned is set.
+    """
+
+    def __init__(self, conn, source, season=None, owned=False):
+        self.conn = conn
+        self.source = source
+        self.season = season
+        self.owned = owned
+        self.race_ids = []
+        self.race = None
+        self.number = 0
+
+    def store(self, races):
+        if races:
+            import resultsdb
+            self.race_ids += resultsdb.storeRaces(self.conn, races,
+                                                  self.source, self.season)
+
+    def write(self, records):
+        finished = []
+        for record in records:
+            if record.ptype == 'raceheader':
+                if self.race is not None:
+                    finished.append(self.race)
+                self.number += 1
+                self.race = dt2000.Race(self.number, record.p5)
+            elif self.race is not None:
+                self.race.add_record(record)
+        self.store(finished)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.race is not None:
+            self.store([self.race])
+            self.race = None
+        if self.owned:
+            self.conn.close()
+
+
+def openSink(spec, gaps=False, source=None, season=None):
+    """Opens a sink given as KIND:FILE, with '-' for stdout.
+
+    KIND is one of SINK_KINDS; source and season are stored with races in
+    an sqlite database.  A ValueError is generated if spec is not valid.
+
+    Returns the sink.
+    """
+    kind, _, filename = spec.partition(':')
+    if kind not in SINK_KINDS or not filename:
+        raise ValueError("Invalid sink: " + spec + "; expected KIND:FILE "
+                         "with KIND one of " + ', '.join(SINK_KINDS) + ".")
+    if kind == 'sqlite':
+        import resultsdb
+        return SqliteSink(resultsdb.connect(filename), source, season,
+                          owned=True)
+
+    if filename == '-':
+        out_file, owned = sys.stdout, False
+    else:
+        out_file, owned = open(filename, 'wb'), True
+    if kind == 'csv':
+        return CsvSink(out_file, gaps, owned)
+    elif kind == 'jsonl':
+        return JsonLinesSink(out_file, owned)
+    elif kind == 'stats':
+        import lapstats
+        return lapstats.StatsSink(out_file, owned)
+    return BoardSink(out_file, owned)
+
+
+def writeSinks(records, sinks, batch_records=dt2000.BLOCK_RECORDS,
+               flush=False):
+    """Writes records to every sink in a single pass.
+
+    Records are read batch_records at a time and each batch is written to
+    every sink in turn.  With flush set, each sink is flushed after every
+    batch.
+    """
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_records))
+        if not batch:
+            break
+        for sink in sinks:
+            sink.write(batch)
+            if flush:
+                sink.flush()
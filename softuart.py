@@ -0,0 +1,271 @@
+"""
+    softuart.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+Decodes the watch's inverted 4800 8N1 serial output in software, from
+logic analyser edge timestamps or from oversampled bit arrays, so recorded
+captures can be turned into records without the Arduino inverter.
+
+Each frame is re-anchored on its own start bit edge and sampled at the
+centre of each bit, which tolerates a few percent of clock drift between
+the watch and the capture.  A frame whose start bit is not low at its
+centre, or whose stop bit is not high, is a framing error.
+"""
+
+import bisect
+import collections
+import optparse
+import sys
+import csv
+import StringIO
+
+import dt2000
+
+# numpy is optional; the decoder falls back to pure Python without it.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BAUD = 4800
+
+# Bits in a frame: start, eight data bits (least significant first), stop.
+FRAME_BITS = 10
+
+# Where the search for the next start bit resumes, in bit times from the
+# start of the previous frame: the middle of its stop bit.
+RESYNC_BITS = FRAME_BITS - 0.5
+
+UartResult = collections.namedtuple('UartResult', ['data', 'errors'])
+
+
+def _find_starts(edges, level, bit_time):
+    """Finds the start bit edge of each frame.
+
+    level is the (non-inverted) line level before the first edge.
+
+    Returns a list of start times.
+    """
+    # Edges alternate in direction; falling edges are those after which the
+    # line is low.
+    falling = edges[1 - level::2]
+    starts = []
+    j = 0
+    while j < len(falling):
+        start = falling[j]
+        starts.append(start)
+        j = bisect.bisect_right(falling, start + RESYNC_BITS * bit_time, j + 1)
+    return starts
+
+
+def decode_edges(edges, baud=BAUD, initial_level=0, invert=True):
+    """Decodes 8N1 frames from the times at which the line changed level.
+
+    edges holds the time, in seconds, of each level change in order, and
+    initial_level is the raw line level before the first of them.  invert
+    is set for the watch's inverted signal, which idles low.
+
+    Returns a UartResult of the decoded bytes as a string and a list of the
+    indexes of any bytes with framing errors.
+    """
+    bit_time = 1.0 / baud
+    level = initial_level ^ int(bool(invert))
+    if numpy is not None:
+        edges = numpy.asarray(edges, dtype=numpy.float64)
+    starts = _find_starts(edges, level, bit_time)
+    if not len(starts):
+        return UartResult('', [])
+
+    offsets = [(bit + 0.5) * bit_time for bit in range(FRAME_BITS)]
+    if numpy is not None:
+        times = numpy.add.outer(numpy.asarray(starts), offsets)
+        counts = numpy.searchsorted(edges, times, side='right')
+        bits = (level ^ (counts & 1)).astype(numpy.uint8)
+        data = bits[:, 1:9].dot(1 << numpy.arange(8)).astype(numpy.uint8)
+        errors = numpy.flatnonzero((bits[:, 0] != 0) | (bits[:, 9] != 1))
+        return UartResult(data.tostring(), errors.tolist())
+
+    data = bytearray()
+    errors = []
+    for index, start in enumerate(starts):
+        bits = [level ^ (bisect.bisect_right(edges, start + offset) & 1)
+                for offset in offsets]
+        value = 0
+        for bit in reversed(bits[1:9]):
+            value = (value << 1) | bit
+        data.append(value)
+        if bits[0] != 0 or bits[9] != 1:
+            errors.append(index)
+    return UartResult(str(data), errors)
+
+
+def decode_samples(samples, samples_per_bit, invert=True):
+    """Decodes 8N1 frames from a line sampled at a fixed rate.
+
+    samples is a sequence of raw 0/1 levels and samples_per_bit, which need
+    not be a whole number, is the sample rate divided by the baud rate.
+
+    Returns a UartResult; see decode_edges().
+    """
+    if not len(samples):
+        return UartResult('', [])
+    # A change happened somewhere between two samples; take the midpoint.
+    # Times are measured in bit times, so the baud rate is one.
+    if numpy is not None:
+        levels = numpy.asarray(samples, dtype=numpy.int8)
+        changes = numpy.flatnonzero(numpy.diff(levels)) + 1
+        edges = (changes - 0.5) / samples_per_bit
+    else:
+        edges = [(index - 0.5) / samples_per_bit
+                 for index in xrange(1, len(samples))
+                 if samples[index] != samples[index - 1]]
+    initial_level = int(samples[0])
+    return decode_edges(edges, 1, initial_level, invert)
+
+
+def encode_edges(data, baud=BAUD, invert=True, idle_bits=2, drift=0.0):
+    """Builds the edge times of a synthetic 8N1 signal carrying data.
+
+    drift is the fractional error of the sender's clock, e.g. 0.02 for a
+    watch running 2% slow.
+
+    The line idles for at least one bit before the first start bit, even
+    with idle_bits of 0, so that it has a falling edge to frame on.
+
+    Returns an (edges, initial_level) tuple for decode_edges().
+    """
+    bit_time = (1.0 + drift) / baud
+    levels = [1] * max(idle_bits, 1)
+    for byte in bytearray(data):
+        levels.append(0)
+        levels.extend((byte >> bit) & 1 for bit in range(8))
+        levels.append(1)
+        levels.extend([1] * idle_bits)
+
+    edges = [index * bit_time for index in xrange(1, len(levels))
+             if levels[index] != levels[index - 1]]
+    return edges, int(bool(invert)) ^ 1
+
+
+def encode_samples(data, samples_per_bit, invert=True, idle_bits=2):
+    """Builds a synthetic oversampled 8N1 signal carrying data.
+
+    Returns a list of raw 0/1 levels for decode_samples().
+    """
+    edges, initial_level = encode_edges(data, 1, invert, idle_bits)
+    total = len(data) * (FRAME_BITS + idle_bits) + max(idle_bits, 1)
+    samples = []
+    level = initial_level
+    edge = 0
+    for index in xrange(int(total * samples_per_bit)):
+        while edge < len(edges) and edges[edge] * samples_per_bit <= index:
+            level ^= 1
+            edge += 1
+        samples.append(level)
+    return samples
+
+
+def read_edge_csv(in_file):
+    """Reads a logic analyser export of 'time,level' rows.
+
+    Header rows and rows that do not change the level are skipped.
+
+    Returns an (edges, initial_level) tuple for decode_edges().
+    """
+    edges = []
+    initial_level = None
+    level = None
+    for row in csv.reader(in_file):
+        try:
+            time, value = float(row[0]), int(float(row[1]))
+        except (IndexError, ValueError):
+            continue
+        if initial_level is None:
+            initial_level = level = value
+        elif value != level:
+            edges.append(time)
+            level = value
+    return edges, initial_level or 0
+
+
+def openCapture(in_file, baud=BAUD, invert=True):
+    """Decodes a logic analyser edge export into a readable dump.
+
+    Framing errors are reported on stderr.
+
+    Returns a file object that dt2000.readRecord() can read records from.
+    """
+    edges, initial_level = read_edge_csv(in_file)
+    result = decode_edges(edges, baud, initial_level, invert)
+    if result.errors:
+        sys.stderr.write(str(len(result.errors))
+                         + " framing errors, first at byte "
+                         + str(result.errors[0]) + "\n")
+    return StringIO.StringIO(result.data)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-f", "--infile",
+                      dest="infile",
+                      metavar="FILE",
+                      default=sys.stdin,
+                      help="Logic analyser 'time,level' CSV export, stdin "
+                      "if not specified.")
+    parser.add_option("-o", "--outfile",
+                      dest="outfile",
+                      metavar="FILE",
+                      default=sys.stdout,
+                      help="Output file, stdout if not specified.")
+    parser.add_option("-b", "--baud",
+                      dest="baud",
+                      metavar="NUM",
+                      type=int,
+                      default=BAUD,
+                      help="Baud rate, " + str(BAUD) + " if not specified.")
+    parser.add_option("--no-invert",
+                      dest="invert",
+                      default=True,
+                      action='store_false',
+                      help="The capture is not inverted.")
+    parser.add_option("--raw",
+                      dest="rawmode",
+                      default=0,
+                      action='store_const',
+                      const=1,
+                      help="Write the decoded bytes as a dump file "
+                      "instead of CSV.")
+    (options, args) = parser.parse_args()
+
+    if isinstance(options.infile, file):
+        ip = options.infile
+    else:
+        ip = open(options.infile, 'r')
+    if isinstance(options.outfile, file):
+        op = options.outfile
+    else:
+        op = open(options.outfile, 'wb')
+
+    source = openCapture(ip, options.baud, options.invert)
+    if options.rawmode:
+        op.write(source.getvalue())
+    else:
+        csvwriter = csv.writer(op, delimiter=',',
+                               quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        dt2000.writeResults(dt2000.readRecord(source), csvwriter)
+    op.close()
@@ -0,0 +1,109 @@
+##############################################################################
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Anthony Rogers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+import os
+import unittest
+import capture
+import dt2000
+
+DUMP_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dump')
+
+
+class TEST_RingBuffer(unittest.TestCase):
+    def testReadReturnsWrittenBytesAcrossWrap(self):
+        ring = capture.RingBuffer(8)
+        self.assertTrue(ring.write('abcdef'))
+        self.assertEqual(ring.read(4), 'abcd')
+        self.assertTrue(ring.write('ghijk'))
+        self.assertEqual(len(ring), 7)
+        self.assertEqual(ring.read(), 'efghijk')
+        self.assertEqual(len(ring), 0)
+
+    def testWriteThatDoesNotFitIsRejected(self):
+        ring = capture.RingBuffer(8)
+        self.assertTrue(ring.write('abcde'))
+        self.assertFalse(ring.write('fghi'))
+        self.assertEqual(ring.read(), 'abcde')
+
+
+class TEST_CaptureDaemon(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+        self.expected = list(dt2000.Decoder().decode_block(self.bcd_buffer))
+
+    def testIdlePollsBackOff(self):
+        daemon = capture.CaptureDaemon(capture.MockBitBangSource(''),
+                                       min_sleep=0.001, max_sleep=0.008)
+        delays = []
+        for _ in range(5):
+            daemon.poll()
+            delays.append(daemon.delay)
+        self.assertEqual(delays, [0.002, 0.004, 0.008, 0.008, 0.008])
+        self.assertEqual(daemon.idle_polls, 5)
+
+    def testDataResetsBackOff(self):
+        source = capture.MockBitBangSource(self.bcd_buffer, idle_polls=3)
+        daemon = capture.CaptureDaemon(source, min_sleep=0.001)
+        for _ in range(4):
+            daemon.poll()
+        self.assertEqual(daemon.delay, 0.001)
+        self.assertEqual(daemon.bytes_received, 16)
+
+    def testOnlyWholeRecordsEnterRing(self):
+        source = capture.MockBitBangSource(self.bcd_buffer, chunk_size=7)
+        daemon = capture.CaptureDaemon(source)
+        daemon.poll()
+        self.assertEqual(len(daemon.ring), 5)
+        daemon.poll()
+        self.assertEqual(len(daemon.ring), 10)
+
+    def testOverrunDropsWholeRecords(self):
+        source = capture.MockBitBangSource(self.bcd_buffer, chunk_size=25)
+        daemon = capture.CaptureDaemon(source, ring_size=60)
+        for _ in range(4):
+            daemon.poll()
+        self.assertEqual(daemon.overruns, 2)
+        self.assertEqual(daemon.dropped_frames, 10)
+        self.assertEqual(daemon.ring.read(), self.bcd_buffer[:50])
+        daemon.poll()
+        self.assertEqual(daemon.ring.read(), self.bcd_buffer[100:125])
+
+    def testThreadedCaptureDecodesEveryRecord(self):
+        source = capture.MockBitBangSource(self.bcd_buffer, chunk_size=13,
+                                           idle_polls=1)
+        daemon = capture.CaptureDaemon(source, min_sleep=0.0001,
+                                       max_sleep=0.001)
+        daemon.start()
+        try:
+            records = list(daemon.records(timeout=0.2))
+        finally:
+            daemon.stop()
+        self.assertEqual(records, self.expected)
+        stats = daemon.stats()
+        self.assertEqual(stats['bytes'], len(self.bcd_buffer))
+        self.assertEqual(stats['overruns'], 0)
@@ -24,6 +24,15 @@
 #
 ##############################################################################
 
+import csv
+import json
+import os
+import shutil
+import StringIO
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 import dt2000
 
@@ -99,6 +108,20 @@ class TEST_bcd_string_to_integer_list(unittest.TestCase):
         value = dt2000.bcd_string_to_integer_list(chr(0x11) + chr(0x21) + chr(0x31) + chr(0x41) + chr(0x51))
         self.assertEqual(value, [11,12,13,14,15])
 
+class TEST_int_to_bcd(unittest.TestCase):
+    def testEveryValueRoundTrips(self):
+        for value in range(100):
+            self.assertEqual(dt2000.bcd_to_int(dt2000.int_to_bcd(value)),
+                             value)
+
+    def testOutOfRangeRaisesException(self):
+        with self.assertRaises(ValueError):
+            dt2000.int_to_bcd(100)
+
+    def testListEncodesEachValue(self):
+        value = dt2000.integer_list_to_bcd_string([11,12,13,14,15])
+        self.assertEqual(value, chr(0x11) + chr(0x21) + chr(0x31) + chr(0x41) + chr(0x51))
+
 class TEST_integer_list_to_param_dict(unittest.TestCase):
     def testInvalidInputArgument(self):
         with self.assertRaises(ValueError):
@@ -142,6 +165,39 @@ class TEST_integer_list_to_param_dict(unittest.TestCase):
         self.assertEqual(value['p4'], 3)
         self.assertEqual(value['p5'], 4)
 
+class TEST_classify_record(unittest.TestCase):
+    def testInvalidLengthOfTuple(self):
+        with self.assertRaises(ValueError):
+            dt2000.classify_record([0, 0, 0])
+
+    def testEveryTypeCodeMatchesValidTypes(self):
+        for code in range(100):
+            expected = 'NAK'
+            for ptype, codes in dt2000.VALID_TYPES:
+                if code in codes:
+                    expected = ptype
+            value = dt2000.classify_record([code, 1, 2, 3, 4])
+            self.assertEqual(value.ptype, expected)
+
+    def testLapTimeRecord(self):
+        value = dt2000.classify_record([11, 2, 3, 4, 5])
+        self.assertEqual(value.ptype, 'laptime')
+        self.assertEqual((value.p1, value.p2, value.p3, value.p4, value.p5),
+                         (11, 2, 3, 4, 5))
+        self.assertEqual(value['p5'], 5)
+
+    def testUnknownTypeIsNakWithZeroParameters(self):
+        for code in (0, 60, 89, 91, 99, 165):
+            value = dt2000.classify_record([code, 1, 2, 3, 4])
+            self.assertEqual(value, {'p2': 0, 'p3': 0, 'p1': 0, 'p4': 0,
+                                     'p5': 0, 'ptype': 'NAK'})
+
+    def testRecordCanBeAdjusted(self):
+        dt2000.adjust_lap_hundreds_p_dict.lap_hundreds = 0
+        value = dt2000.classify_record([10, 0, 0, 0, 0])
+        value = dt2000.adjust_lap_hundreds_p_dict(value)
+        self.assertEqual(value.p5, 100)
+
 class TEST_adjust_lap_hundreds_p_dict(unittest.TestCase):
 
     def testAdjustmentAbsForHundreds(self):
@@ -158,3 +214,810 @@ class TEST_adjust_lap_hundreds_p_dict(unittest.TestCase):
             params['p5'] = test_value
             out_record = dt2000.adjust_lap_hundreds_p_dict(params)
             self.assertEqual(expected_value, out_record['p5'])
+
+
+DUMP_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dump')
+
+
+class TEST_bcd_buffer_to_integer_matrix(unittest.TestCase):
+    def setUp(self):
+        self.numpy = dt2000.numpy
+        dt2000.load_numpy()
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+        self.expected = [
+            dt2000.bcd_string_to_integer_list(self.bcd_buffer[i:i + 5])
+            for i in range(0, len(self.bcd_buffer), 5)]
+
+    def tearDown(self):
+        dt2000.numpy = self.numpy
+
+    def testEmptyBufferReturnsNoRecords(self):
+        value = dt2000.bcd_buffer_to_integer_matrix("")
+        self.assertEqual(len(value), 0)
+
+    def testPartialRecordRaisesException(self):
+        with self.assertRaises(ValueError):
+            dt2000.bcd_buffer_to_integer_matrix(chr(0x09) * 7)
+
+    def testLookupMatchesBcdToIntForEveryByte(self):
+        for byte in range(256):
+            self.assertEqual(dt2000.BCD_LOOKUP[byte],
+                             dt2000.bcd_to_int(chr(byte)))
+
+    def testDumpFileMatchesPerByteDecode(self):
+        value = dt2000.bcd_buffer_to_integer_matrix(self.bcd_buffer)
+        if dt2000.numpy is not None:
+            self.assertEqual(value.shape, (len(self.expected), 5))
+            value = value.tolist()
+        self.assertEqual(value, self.expected)
+
+    def testSmallBlocksAreDecodedWithoutNumpy(self):
+        value = dt2000.bcd_buffer_to_integer_matrix(
+            self.bcd_buffer[:5 * (dt2000.NUMPY_MIN_RECORDS - 1)])
+        self.assertTrue(isinstance(value, list))
+        self.assertEqual(value, self.expected[:dt2000.NUMPY_MIN_RECORDS - 1])
+
+    def testDumpFileMatchesPerByteDecodeWithoutNumpy(self):
+        dt2000.numpy = None
+        value = dt2000.bcd_buffer_to_integer_matrix(self.bcd_buffer)
+        self.assertEqual(value, self.expected)
+
+
+class TEST_DumpReader(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+        self.reader = dt2000.DumpReader(DUMP_FILE)
+
+    def tearDown(self):
+        self.reader.close()
+
+    def testLengthIsNumberOfRecords(self):
+        self.assertEqual(len(self.reader), len(self.bcd_buffer) // 5)
+
+    def testRandomAccessByRecordIndex(self):
+        self.assertEqual(str(self.reader[0]), self.bcd_buffer[0:5])
+        self.assertEqual(str(self.reader[7]), self.bcd_buffer[35:40])
+        self.assertEqual(str(self.reader[-1]), self.bcd_buffer[-5:])
+
+    def testIndexOutOfRangeRaisesException(self):
+        with self.assertRaises(IndexError):
+            self.reader[len(self.reader)]
+
+    def testSliceReturnsWholeRecords(self):
+        self.assertEqual(str(self.reader[2:4]), self.bcd_buffer[10:20])
+
+    def testIterationYieldsEveryRecord(self):
+        records = [str(record) for record in self.reader]
+        self.assertEqual(''.join(records), self.bcd_buffer)
+        self.assertTrue(all(len(record) == 5 for record in records))
+
+    def testBlocksCoverTheWholeDump(self):
+        blocks = [str(block) for block in self.reader.blocks(block_records=7)]
+        self.assertEqual(''.join(blocks), self.bcd_buffer)
+        self.assertEqual(len(blocks[0]), 35)
+
+    def testEmptyFileHasNoRecords(self):
+        with tempfile.NamedTemporaryFile() as empty:
+            with dt2000.DumpReader(empty.name) as reader:
+                self.assertEqual(len(reader), 0)
+                self.assertEqual(list(reader), [])
+
+    def testPartialRecordRaisesException(self):
+        with tempfile.NamedTemporaryFile() as partial:
+            partial.write(self.bcd_buffer[:7])
+            partial.flush()
+            with self.assertRaises(ValueError):
+                dt2000.DumpReader(partial.name)
+
+
+class TEST_ArchiveReader(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'dump.dtz')
+        # Small chunks, so records are split across several of them.
+        with open(DUMP_FILE, 'rb') as dump, \
+                open(self.filename, 'wb') as archive:
+            self.records = dt2000.writeArchive(dump, archive,
+                                               chunk_records=16)
+        self.reader = dt2000.ArchiveReader(self.filename)
+
+    def tearDown(self):
+        self.reader.close()
+        shutil.rmtree(self.directory)
+
+    def testArchiveIsSmallerAndHoldsEveryRecord(self):
+        self.assertEqual(self.records, len(self.bcd_buffer) // 5)
+        self.assertEqual(len(self.reader), self.records)
+        self.assertEqual(''.join(self.reader), self.bcd_buffer)
+        archive = StringIO.StringIO()
+        with open(DUMP_FILE, 'rb') as dump:
+            dt2000.writeArchive(dump, archive)
+        self.assertTrue(len(archive.getvalue()) < len(self.bcd_buffer))
+
+    def testRandomAccessDecompressesOnlyItsChunk(self):
+        self.assertEqual(self.reader[40], self.bcd_buffer[200:205])
+        self.assertEqual(self.reader._chunk_number, 2)
+        self.assertEqual(self.reader[-1], self.bcd_buffer[-5:])
+        with self.assertRaises(IndexError):
+            self.reader[len(self.reader)]
+
+    def testSlicesAndBlocksSpanChunks(self):
+        self.assertEqual(self.reader[10:50], self.bcd_buffer[50:250])
+        blocks = list(self.reader.blocks(3, 60, block_records=7))
+        self.assertEqual(''.join(blocks), self.bcd_buffer[15:300])
+        self.assertEqual(len(blocks[0]), 35)
+
+    def testReadStreamsLikeAPlainDump(self):
+        self.assertEqual(self.reader.read(7), self.bcd_buffer[:7])
+        self.assertEqual(self.reader.read(), self.bcd_buffer[7:])
+        self.assertEqual(self.reader.read(5), '')
+
+    def testOpenedTransparently(self):
+        expected = dt2000.readRecords(DUMP_FILE)
+        self.assertTrue(isinstance(dt2000.openFile(self.filename),
+                                   dt2000.ArchiveReader))
+        self.assertEqual(dt2000.readRecords(self.filename), expected)
+        self.assertEqual(list(dt2000.readRecord(
+            dt2000.openFile(self.filename))), expected)
+        with dt2000.DumpReader(DUMP_FILE) as reader:
+            races = dt2000.buildRaceIndex(reader)
+        start = races[2]['offset'] // 5
+        stop = races[3]['offset'] // 5 + races[3]['records']
+        self.assertEqual(list(dt2000.iterRaceRecords(self.filename, (3, 4))),
+                         list(dt2000.readBulkRecord(DUMP_FILE, start, stop)))
+
+    def testShortReadsStillGiveFullChunks(self):
+        class ShortReads(object):
+            """A stream giving at most 7 bytes per read, like a pipe."""
+            def __init__(self, data):
+                self.data = StringIO.StringIO(data)
+
+            def read(self, size):
+                return self.data.read(min(size, 7))
+
+        archive = StringIO.StringIO()
+        records = dt2000.writeArchive(ShortReads(self.bcd_buffer), archive,
+                                      chunk_records=16)
+        self.assertEqual(records, len(self.bcd_buffer) // 5)
+        with open(self.filename, 'wb') as f:
+            f.write(archive.getvalue())
+        with dt2000.ArchiveReader(self.filename) as reader:
+            self.assertEqual(reader[40], self.bcd_buffer[200:205])
+            self.assertEqual(''.join(reader), self.bcd_buffer)
+
+    def testInvalidArchiveRaisesException(self):
+        with open(self.filename, 'r+b') as archive:
+            archive.truncate(os.path.getsize(self.filename) - 1)
+        with self.assertRaises(ValueError):
+            dt2000.ArchiveReader(self.filename)
+        with self.assertRaises(ValueError):
+            dt2000.ArchiveReader(DUMP_FILE)
+
+
+class TEST_race_index(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+        self.types = [dt2000.bcd_to_int(self.bcd_buffer[i])
+                      for i in range(0, len(self.bcd_buffer), 5)]
+        self.records = [dt2000.classify_record(
+            dt2000.bcd_string_to_integer_list(self.bcd_buffer[i:i + 5]))
+            for i in range(0, len(self.bcd_buffer), 5)]
+
+    def testIndexHasOneRaceForEachHeader(self):
+        with dt2000.DumpReader(DUMP_FILE) as reader:
+            races = dt2000.buildRaceIndex(reader)
+        headers = [i for i, t in enumerate(self.types) if t == 90]
+        self.assertEqual([race['offset'] for race in races],
+                         [i * 5 for i in headers])
+        self.assertEqual(sum(race['records'] for race in races),
+                         len(self.types) - headers[0])
+        self.assertEqual(sum(race['laps'] for race in races),
+                         len([t for t in self.types if 10 <= t < 20]))
+
+    def testIndexIsIndependentOfBlockSize(self):
+        with dt2000.DumpReader(DUMP_FILE) as reader:
+            self.assertEqual(dt2000.buildRaceIndex(reader, block_records=3),
+                             dt2000.buildRaceIndex(reader))
+
+    def testIndexIsSavedAndReused(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'dump')
+            with open(filename, 'wb') as dump:
+                dump.write(self.bcd_buffer)
+            races = dt2000.loadRaceIndex(filename)
+            self.assertTrue(os.path.exists(filename + '.idx'))
+            with open(filename + '.idx', 'r') as index:
+                saved = json.load(index)
+            saved['races'] = saved['races'][:1]
+            with open(filename + '.idx', 'w') as index:
+                json.dump(saved, index)
+            self.assertEqual(dt2000.loadRaceIndex(filename), races[:1])
+        finally:
+            shutil.rmtree(directory)
+
+    def testParseRaceIds(self):
+        self.assertEqual(dt2000.parseRaceIds("3"), (3, 3))
+        self.assertEqual(dt2000.parseRaceIds("2-5"), (2, 5))
+        self.assertEqual(dt2000.parseRaceIds("last"), (-1, -1))
+        for invalid in ("", "0", "x", "5-2", "1-2-3"):
+            with self.assertRaises(ValueError):
+                dt2000.parseRaceIds(invalid)
+
+    def testResolveRaceIds(self):
+        self.assertEqual(dt2000.resolveRaceIds((-1, -1), 10), (10, 10))
+        self.assertEqual(dt2000.resolveRaceIds((2, 5), 10), (2, 5))
+        with self.assertRaises(ValueError):
+            dt2000.resolveRaceIds((9, 11), 10)
+
+    def testSelectRacesMatchesIndexSlice(self):
+        with dt2000.DumpReader(DUMP_FILE) as reader:
+            races = dt2000.buildRaceIndex(reader)
+        for selection, (first, last) in (((2, 3), (2, 3)),
+                                         ((-1, -1), (10, 10))):
+            start = races[first - 1]['offset'] // 5
+            stop = races[last - 1]['offset'] // 5 + races[last - 1]['records']
+            value = list(dt2000.selectRaces(iter(self.records), selection))
+            self.assertEqual(value, self.records[start:stop])
+
+    def testSelectRacesBeyondTheStreamRaisesException(self):
+        for selection in ((11, 11), (9, 12)):
+            with self.assertRaises(ValueError):
+                list(dt2000.selectRaces(iter(self.records), selection))
+
+
+class TEST_library_api(unittest.TestCase):
+    def testImportLoadsNoOptionalModules(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        loaded = subprocess.check_output(
+            [sys.executable, '-c', 'import sys, dt2000; print " ".join('
+             'm for m in ("serial", "numpy", "csv", "optparse", '
+             '"multiprocessing", "hashlib", "json", "tempfile", "Queue", '
+             '"threading", "zlib") if m in sys.modules)'], cwd=root)
+        self.assertEqual(loaded.strip(), '')
+
+    def testDecodingASmallDumpDoesNotLoadNumpy(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        loaded = subprocess.check_output(
+            [sys.executable, '-c', 'import sys, dt2000; '
+             'records = list(dt2000.iter_records(%r)); '
+             'print len(records), "numpy" in sys.modules' % DUMP_FILE],
+            cwd=root)
+        self.assertEqual(loaded.split(), ['345', 'False'])
+
+    def testDecodingALargeDumpLoadsNumpy(self):
+        if dt2000.numpy is None:
+            self.skipTest("numpy is not installed")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        loaded = subprocess.check_output(
+            [sys.executable, '-c', 'import sys, dt2000; '
+             'dt2000.NUMPY_LOAD_RECORDS = 345; '
+             'records = list(dt2000.iter_records(%r)); '
+             'print len(records), "numpy" in sys.modules' % DUMP_FILE],
+            cwd=root)
+        self.assertEqual(loaded.split(), ['345', 'True'])
+
+    def testDecodeBytesMatchesReadRecords(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            records = dt2000.decode_bytes(dump.read())
+        self.assertEqual(records, dt2000.readRecords(DUMP_FILE))
+        with self.assertRaises(ValueError):
+            dt2000.decode_bytes('\x90\x15')
+
+    def testIterRacesGroupsTheRecords(self):
+        races = list(dt2000.iter_races(DUMP_FILE))
+        self.assertEqual([race.number for race in races],
+                         range(1, len(races) + 1))
+        self.assertEqual(list(races[0].hundredths), [183, 59, 57, 59, 56])
+        self.assertEqual(list(dt2000.iter_records(DUMP_FILE)),
+                         dt2000.readRecords(DUMP_FILE))
+
+
+class ChunkedPort(object):
+    """Serial port stand-in that returns data in fixed chunks."""
+
+    def __init__(self, data, chunks):
+        self.data = data
+        self.chunks = list(chunks)
+
+    @property
+    def in_waiting(self):
+        if not self.chunks:
+            return len(self.data)
+        return min(self.chunks[0], len(self.data))
+
+    def read(self, size):
+        if self.chunks:
+            size = max(size, self.chunks.pop(0))
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+class TEST_LiveReader(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+        self.expected = [self.bcd_buffer[i:i + 5]
+                         for i in range(0, len(self.bcd_buffer), 5)]
+
+    def testFramesAreReassembledAcrossReads(self):
+        port = ChunkedPort(self.bcd_buffer, [1, 3, 7, 2, 64, 5, 11] * 40)
+        frames = list(dt2000.LiveReader(port).frames())
+        self.assertEqual(frames, self.expected)
+
+    def testIncompleteTrailingRecordIsDiscarded(self):
+        port = ChunkedPort(self.bcd_buffer[:12], [])
+        stderr, sys.stderr = sys.stderr, StringIO.StringIO()
+        try:
+            frames = list(dt2000.LiveReader(port).frames())
+            message = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(frames, self.expected[:2])
+        self.assertIn("Discarding 2 bytes", message)
+
+    def testArrivalIsSetForEachRead(self):
+        reader = dt2000.LiveReader(ChunkedPort(self.bcd_buffer[:5], []))
+        before = time.time()
+        list(reader.frames())
+        self.assertTrue(reader.arrival >= before)
+
+
+class TEST_Decoder(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+
+    def testDecodersKeepSeparateOverflowState(self):
+        first = dt2000.Decoder()
+        second = dt2000.Decoder()
+        for decoder in (first, second):
+            decoder.decode(chr(0x09) + chr(0x00) * 4)
+        # Laps 99, 0 (overflow) and 1 on the first decoder only.
+        for lap in (chr(0x99), chr(0x00), chr(0x10)):
+            record = first.decode(chr(0x01) + chr(0x00) * 3 + lap)
+        self.assertEqual(record.p5, 101)
+        record = second.decode(chr(0x01) + chr(0x00) * 3 + chr(0x10))
+        self.assertEqual(record.p5, 1)
+
+    def testDecodeBlockMatchesDecode(self):
+        decoder = dt2000.Decoder()
+        expected = [decoder.decode(self.bcd_buffer[i:i + 5])
+                    for i in range(0, len(self.bcd_buffer), 5)]
+        value = list(dt2000.Decoder().decode_block(self.bcd_buffer))
+        self.assertEqual(value, expected)
+
+    def testDumpFileReceivesRawRecords(self):
+        dump_file = StringIO.StringIO()
+        decoder = dt2000.Decoder(dump_file=dump_file)
+        list(decoder.decode_block(self.bcd_buffer[:50]))
+        decoder.decode(self.bcd_buffer[50:55])
+        self.assertEqual(dump_file.getvalue(), self.bcd_buffer[:55])
+
+    def testPlainDecoderSkipsTracing(self):
+        decoder = dt2000.Decoder()
+        self.assertFalse('decode' in vars(decoder))
+        decoder = dt2000.Decoder(stats=dt2000.PipelineStats())
+        self.assertTrue('decode' in vars(decoder))
+
+    def testStatsCountRecordsNaksAndOverflows(self):
+        stats = dt2000.PipelineStats()
+        decoder = dt2000.Decoder(stats=stats)
+        value = list(decoder.decode_block(self.bcd_buffer[:100]))
+        value += [decoder.decode(self.bcd_buffer[i:i + 5])
+                  for i in range(100, len(self.bcd_buffer), 5)]
+        expected = list(dt2000.Decoder().decode_block(self.bcd_buffer))
+        self.assertEqual(value, expected)
+        self.assertEqual(stats.records, len(expected))
+        self.assertEqual(stats.bytes, len(self.bcd_buffer))
+        self.assertEqual(stats.naks,
+                         len([r for r in expected if r.ptype == 'NAK']))
+        self.assertEqual(stats.overflows, 1)
+
+
+class TEST_DumpTee(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, paths):
+        data = ''
+        for path in paths:
+            with open(path, 'rb') as f:
+                data += f.read()
+        return data
+
+    def testDecoderTeesRawRecords(self):
+        tee = dt2000.DumpTee(self.directory)
+        decoder = dt2000.Decoder(dump_file=tee)
+        list(decoder.decode_block(buffer(self.bcd_buffer, 0, 50)))
+        decoder.decode(self.bcd_buffer[50:55])
+        tee.close()
+        self.assertEqual(len(tee.paths), 1)
+        self.assertTrue(os.path.basename(tee.paths[0]).startswith('dump-'))
+        self.assertEqual(self.read(tee.paths), self.bcd_buffer[:55])
+
+    def testFilesRotateOnWholeRecords(self):
+        tee = dt2000.DumpTee(self.directory, max_bytes=502)
+        for offset in range(0, len(self.bcd_buffer), 35):
+            tee.write(self.bcd_buffer[offset:offset + 35])
+        tee.close()
+        self.assertEqual(len(tee.paths), 4)
+        self.assertEqual(len(set(tee.paths)), 4)
+        for path in tee.paths[:-1]:
+            self.assertEqual(os.path.getsize(path), 500)
+        self.assertEqual(self.read(tee.paths), self.bcd_buffer)
+
+    def testNothingWrittenCreatesNoFile(self):
+        tee = dt2000.DumpTee(self.directory)
+        tee.close()
+        self.assertEqual(tee.paths, [])
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def testWriterErrorIsRaised(self):
+        tee = dt2000.DumpTee(os.path.join(self.directory, 'missing'))
+        tee.write(self.bcd_buffer[:5])
+        with self.assertRaises(IOError):
+            tee.close()
+
+    def testWriterErrorNeverStopsDecoding(self):
+        tee = dt2000.DumpTee(os.path.join(self.directory, 'missing'),
+                             sync_interval=0.01)
+        decoder = dt2000.Decoder(dump_file=tee)
+        expected = dt2000.Decoder().decode(self.bcd_buffer[:5])
+        self.assertEqual(decoder.decode(self.bcd_buffer[:5]), expected)
+        deadline = time.time() + 5
+        while tee.error is None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(isinstance(tee.error, IOError))
+        # The failed tee drops the data; decoding carries on.
+        records = list(decoder.decode_block(self.bcd_buffer))
+        self.assertEqual(len(records), len(self.bcd_buffer) // 5)
+        self.assertTrue(tee._queue.empty())
+        with self.assertRaises(IOError):
+            tee.close()
+
+    def runCommandLine(self, args, stdin=None):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        command = subprocess.Popen(
+            [sys.executable, 'dt2000.py'] + args, cwd=root,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        out, err = command.communicate(stdin)
+        self.assertEqual(command.returncode, 0, err)
+        return out
+
+    def captured(self, directory):
+        data = self.read(sorted(os.path.join(directory, name)
+                                for name in os.listdir(directory)))
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        return data
+
+    def testRaceSelectionAndIngestTeeTheWholeDump(self):
+        dump = os.path.join(self.directory, 'dump')
+        shutil.copy(DUMP_FILE, dump)
+        captures = os.path.join(self.directory, 'captures')
+        os.mkdir(captures)
+        everything = self.runCommandLine(['-f', dump])
+
+        out = self.runCommandLine(['-f', dump, '-r', '2', '--dump',
+                                   '--dump-dir', captures])
+        self.assertEqual(out.count('New Race Detected'), 1)
+        self.assertEqual(self.captured(captures), self.bcd_buffer)
+
+        seen = os.path.join(self.directory, 'seen.txt')
+        out = self.runCommandLine(['-f', dump, '--ingest', seen, '--dump',
+                                   '--dump-dir', captures])
+        self.assertEqual(out, everything)
+        self.assertEqual(self.captured(captures), self.bcd_buffer)
+        out = self.runCommandLine(['-f', dump, '--ingest', seen, '--dump',
+                                   '--dump-dir', captures])
+        self.assertEqual(out, '')
+        self.assertEqual(self.captured(captures), self.bcd_buffer)
+
+    def testRaceSelectionTeesTheWholeStream(self):
+        captures = os.path.join(self.directory, 'captures')
+        os.mkdir(captures)
+        out = self.runCommandLine(['-r', '1', '--dump', '--dump-dir',
+                                   captures], stdin=self.bcd_buffer)
+        self.assertEqual(out.count('New Race Detected'), 1)
+        self.assertEqual(self.captured(captures), self.bcd_buffer)
+
+
+class TEST_PipelineStats(unittest.TestCase):
+    def testTimedFileAndWriterMeasureLatency(self):
+        stats = dt2000.PipelineStats()
+        with open(DUMP_FILE, 'rb') as dump:
+            records = dt2000.readRecord(dt2000.TimedFile(dump, stats),
+                                        dt2000.Decoder(stats=stats))
+            out = StringIO.StringIO()
+            dt2000.writeResults(records,
+                                dt2000.TimedWriter(csv.writer(out), stats))
+        self.assertEqual(stats.rows, len(out.getvalue().splitlines()))
+        self.assertEqual(stats.latency.count, stats.rows)
+        self.assertTrue(stats.latency.worst >= 0)
+
+        report = StringIO.StringIO()
+        stats.report(report)
+        lines = report.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith("Stats: 345 records, 1725 bytes"))
+
+    def testBulkReadStampsArrivalWhenEachBlockIsRead(self):
+        stats = dt2000.PipelineStats()
+        decoder = dt2000.Decoder(stats=stats)
+        before = time.time()
+        records = dt2000.readBulkRecord(DUMP_FILE, decoder=decoder)
+        next(records)
+        arrival = stats.arrival
+        self.assertTrue(before <= arrival <= time.time())
+
+        with open(DUMP_FILE, 'rb') as dump:
+            block = dump.read()
+        list(decoder.decode_block(block))
+        self.assertEqual(stats.arrival, arrival)
+        records.close()
+
+
+class TEST_convertDirectory(unittest.TestCase):
+    def setUp(self):
+        self.indir = tempfile.mkdtemp()
+        self.outdir = tempfile.mkdtemp()
+        for name in ('one', 'two'):
+            shutil.copy(DUMP_FILE, os.path.join(self.indir, name))
+        with open(os.path.join(self.indir, 'bad'), 'wb') as bad:
+            bad.write(chr(0x09) * 7)
+
+    def tearDown(self):
+        shutil.rmtree(self.indir)
+        shutil.rmtree(self.outdir)
+
+    def testOneOutputPerInput(self):
+        results = dt2000.convertDirectory(self.indir, self.outdir, 2)
+        self.assertEqual([os.path.basename(infile)
+                          for infile, outfile, error in results],
+                         ['bad', 'one', 'two'])
+        self.assertTrue(results[0][2])
+        self.assertEqual([error for infile, outfile, error in results[1:]],
+                         [None, None])
+        with open(os.path.join(self.outdir, 'one.csv'), 'rb') as one:
+            rows = one.read().splitlines()
+        self.assertEqual(rows[:3], ['New Race Detected',
+                                    'Finisher,1,0,0,1,83',
+                                    'Finisher,2,0,0,2,42'])
+        with open(os.path.join(self.outdir, 'two.csv'), 'rb') as two:
+            self.assertEqual(two.read().splitlines(), rows)
+
+    def testJobsBelowOneIsAUsageError(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for jobs in ('0', '-2'):
+            command = subprocess.Popen(
+                [sys.executable, 'dt2000.py', '--batch', self.indir,
+                 '-o', self.outdir, '-j', jobs],
+                cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = command.communicate()
+            self.assertEqual(command.returncode, 2)
+            self.assertIn("--jobs must be at least 1.", err)
+            self.assertNotIn("Traceback", err)
+        self.assertEqual(os.listdir(self.outdir), [])
+
+
+class TEST_results_engine(unittest.TestCase):
+    def setUp(self):
+        self.numpy = dt2000.numpy
+        dt2000.load_numpy()
+        self.vector_min_laps = dt2000.VECTOR_MIN_LAPS
+        dt2000.VECTOR_MIN_LAPS = 1
+
+    def tearDown(self):
+        dt2000.numpy = self.numpy
+        dt2000.VECTOR_MIN_LAPS = self.vector_min_laps
+
+    def testRecordHundredthsIncludesHoursFromTypeCode(self):
+        record = dt2000.Record('laptime', 11, 2, 3, 4, 1)
+        self.assertEqual(dt2000.record_hundredths(record), 372304)
+
+    def testSplitAndFormatHundredths(self):
+        self.assertEqual(dt2000.split_hundredths(372304), (1, 2, 3, 4))
+        self.assertEqual(dt2000.format_hundredths(372304), "1:02:03.04")
+        self.assertEqual(dt2000.format_hundredths(0), "0:00:00.00")
+
+    def testFinishTimesAreCumulative(self):
+        laps = [183, 59, 57, 59, 56]
+        self.assertEqual(dt2000.finish_times(laps), [183, 242, 299, 358, 414])
+        dt2000.numpy = None
+        self.assertEqual(dt2000.finish_times(laps), [183, 242, 299, 358, 414])
+        self.assertEqual(dt2000.finish_times([]), [])
+
+    def testRaceResultsGaps(self):
+        self.assertEqual(dt2000.race_results([183, 59, 57]),
+                         [(1, 183, 0, 0), (2, 242, 59, 59),
+                          (3, 299, 116, 57)])
+        self.assertEqual(dt2000.race_results([]), [])
+
+    def testFinishGapsWithAndWithoutNumpy(self):
+        times = [183, 242, 299]
+        for numpy in (self.numpy, None):
+            dt2000.numpy = numpy
+            self.assertEqual(dt2000.finish_gaps(times),
+                             ([0, 59, 116], [0, 59, 57]))
+            self.assertEqual(dt2000.finish_gaps(times, 100, 150),
+                             ([83, 142, 199], [33, 59, 57]))
+            self.assertEqual(dt2000.finish_gaps([]), ([], []))
+
+    def testWriteResultsCarriesMinutesIntoHours(self):
+        records = [dt2000.Record('raceheader', 90),
+                   dt2000.Record('laptime', 10, 50, 0, 0, 1),
+                   dt2000.Record('laptime', 10, 15, 30, 50, 2),
+                   dt2000.Record('raceend', 50)]
+        out = StringIO.StringIO()
+        dt2000.writeResults(records, csv.writer(out), gaps=True)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['New Race Detected',
+                          'Finisher,1,0,50,0,0,0:00:00.00,0:00:00.00',
+                          'Finisher,2,1,5,30,50,0:15:30.50,0:15:30.50',
+                          'Race Finished'])
+
+    def testWriteResultsChecksLapCounter(self):
+        records = [dt2000.Record('raceheader', 90),
+                   dt2000.Record('laptime', 10, 0, 1, 0, 2)]
+        with self.assertRaises(ValueError):
+            dt2000.writeResults(records, csv.writer(StringIO.StringIO()))
+
+    def testResultBuilderKeepsStateBetweenBatches(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            records = list(dt2000.Decoder().decode_block(dump.read()))
+        out = StringIO.StringIO()
+        dt2000.writeResults(records, csv.writer(out))
+        builder = dt2000.ResultBuilder()
+        batched = StringIO.StringIO()
+        for start in range(0, len(records), 7):
+            csv.writer(batched).writerows(
+                builder.rows(records[start:start + 7]))
+        self.assertEqual(batched.getvalue(), out.getvalue())
+
+    def testBatchedGapsMatchStreamedGaps(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            records = list(dt2000.Decoder().decode_block(dump.read()))
+        out = StringIO.StringIO()
+        dt2000.writeResults(records, csv.writer(out), gaps=True)
+        for numpy, vector_min_laps in ((self.numpy, 1), (None, 1),
+                                       (self.numpy, self.vector_min_laps)):
+            dt2000.numpy = numpy
+            dt2000.VECTOR_MIN_LAPS = vector_min_laps
+            for size in (3, len(records)):
+                builder = dt2000.ResultBuilder(gaps=True)
+                batched = StringIO.StringIO()
+                for start in range(0, len(records), size):
+                    csv.writer(batched).writerows(
+                        builder.rows(records[start:start + size]))
+                self.assertEqual(batched.getvalue(), out.getvalue())
+
+    def testRunsOfFinishersSpanTheRecordsBetweenLaps(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            records = list(dt2000.Decoder().decode_block(dump.read()))
+        runs = []
+        builder = dt2000.ResultBuilder()
+        lap_rows = builder.lap_rows
+        builder.lap_rows = lambda laps: runs.append(len(laps)) or \
+            lap_rows(laps)
+        builder.rows(records)
+        races = list(dt2000.iterRaces(records))
+        self.assertEqual(runs, [len(race) for race in races if len(race)])
+
+        dt2000.VECTOR_MIN_LAPS = self.vector_min_laps
+        runs[:] = []
+        builder.rows(records)
+        self.assertEqual(runs, [])
+
+
+class TEST_Race(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            bcd_buffer = dump.read()
+        self.records = list(dt2000.Decoder().decode_block(bcd_buffer))
+        self.race = dt2000.Race(1)
+        for lap, hundredths in ((1, 183), (2, 59), (3, 57)):
+            self.race.append(lap, hundredths)
+
+    def testLapsAreArrayColumns(self):
+        self.assertEqual(self.race.laps.typecode, 'i')
+        self.assertEqual(list(self.race.hundredths), [183, 59, 57])
+        self.assertFalse(hasattr(self.race, '__dict__'))
+
+    def testIndexingAndIteration(self):
+        self.assertEqual(len(self.race), 3)
+        self.assertEqual(self.race[1], dt2000.Lap(2, 59))
+        self.assertEqual(self.race[-1].hundredths, 57)
+        self.assertEqual(list(self.race), [(1, 183), (2, 59), (3, 57)])
+
+    def testSliceIsARace(self):
+        value = self.race[1:]
+        self.assertTrue(isinstance(value, dt2000.Race))
+        self.assertEqual(list(value.laps), [2, 3])
+        self.assertEqual(len(self.race), 3)
+
+    def testResults(self):
+        self.assertEqual(self.race.finish_times(), [183, 242, 299])
+        self.assertEqual(self.race.results()[-1], (3, 299, 116, 57))
+
+    def testIterRacesGroupsDump(self):
+        races = list(dt2000.iterRaces(self.records))
+        self.assertEqual([race.number for race in races], range(1, 11))
+        self.assertEqual(sum(len(race) for race in races),
+                         len([r for r in self.records
+                              if r.ptype == 'laptime']))
+        first = races[0]
+        self.assertEqual(list(first.hundredths), [183, 59, 57, 59, 56])
+        self.assertEqual((first.average, first.fastest), (82, 56))
+        self.assertEqual(first.end.ptype, 'raceend')
+
+
+class TEST_parse_hundredths(unittest.TestCase):
+    def testValidTimes(self):
+        self.assertEqual(dt2000.parse_hundredths("1:02:03.04"), 372304)
+        self.assertEqual(dt2000.parse_hundredths("5:00"), 30000)
+        self.assertEqual(dt2000.parse_hundredths("59.5"), 5950)
+        self.assertEqual(dt2000.parse_hundredths("12"), 1200)
+
+    def testInvalidTimesRaiseException(self):
+        for text in ("", "a", "1:2:3:4", "1.234", "1.x"):
+            with self.assertRaises(ValueError):
+                dt2000.parse_hundredths(text)
+
+
+class TEST_incremental_ingest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeDump(self, name, bcd_buffer):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'wb') as dump:
+            dump.write(bcd_buffer)
+        return filename
+
+    def testFirstIngestYieldsEveryRace(self):
+        dump = self.writeDump('dump', self.bcd_buffer)
+        races = list(dt2000.iterNewRaces(dump, set()))
+        self.assertEqual(len(races), 10)
+        self.assertEqual(len(set(fp for fp, records in races)), 10)
+        self.assertEqual(races[0][1][0].ptype, 'raceheader')
+
+    def testKnownRacesAreSkipped(self):
+        dump = self.writeDump('dump', self.bcd_buffer)
+        known = set(fp for fp, records in dt2000.iterNewRaces(dump, set()))
+        self.assertEqual(list(dt2000.iterNewRaces(dump, known)), [])
+
+    def testOnlyNewAndChangedRacesAreYielded(self):
+        # The first download stops part way through the last race.
+        first = self.writeDump('first', self.bcd_buffer[:-50])
+        known = set(fp for fp, records in dt2000.iterNewRaces(first, set()))
+        second = self.writeDump('second', self.bcd_buffer + self.bcd_buffer)
+        races = list(dt2000.iterNewRaces(second, known))
+        with dt2000.DumpReader(DUMP_FILE) as reader:
+            last_race = dt2000.buildRaceIndex(reader)[-1]
+        self.assertEqual(len(races), 1)
+        self.assertEqual(len(races[0][1]), last_race['records'])
+
+    def testFingerprintCacheRoundTrip(self):
+        cache = os.path.join(self.directory, 'cache')
+        self.assertEqual(dt2000.loadFingerprints(cache), set())
+        dt2000.saveFingerprints(cache, ['a', 'b'])
+        dt2000.saveFingerprints(cache, ['c'])
+        self.assertEqual(dt2000.loadFingerprints(cache), set('abc'))
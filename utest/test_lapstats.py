@@ -0,0 +1,98 @@
+##############################################################################
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Anthony Rogers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+import json
+import os
+import random
+import StringIO
+import unittest
+import dt2000
+import lapstats
+import sinks
+
+DUMP_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dump')
+
+
+class TEST_lapstats(unittest.TestCase):
+    def testP2QuantileTracksTheSortedSample(self):
+        rng = random.Random(1)
+        values = [rng.lognormvariate(7, 0.5) for _ in xrange(10000)]
+        for p in (0.1, 0.5, 0.9):
+            sketch = lapstats.P2Quantile(p)
+            for value in values:
+                sketch.add(value)
+            exact = sorted(values)[int(p * len(values))]
+            self.assertAlmostEqual(sketch.value() / exact, 1.0, delta=0.02)
+        self.assertEqual(len(sketch.heights), 5)
+
+        sketch = lapstats.P2Quantile(0.5)
+        self.assertEqual(sketch.value(), None)
+        for value in (30, 10, 20):
+            sketch.add(value)
+        self.assertEqual(sketch.value(), 20)
+
+    def testRaceStatsRunningValues(self):
+        stats = lapstats.RaceStats(1)
+        for lap in (3000, 2000, 1500, 500, 2500):
+            stats.add(lap)
+        summary = stats.summary()
+        self.assertEqual((summary["count"], summary["mean"],
+                          summary["fastest"], summary["slowest"]),
+                         (5, 1900.0, 500, 3000))
+        self.assertEqual(summary["percentiles"]["p50"], 2000)
+        # Finishers at 30, 50, 65, 70 and 95 seconds.
+        self.assertEqual(summary["rate"], 4)
+        self.assertEqual(stats.check(average=1900, fastest=500), [])
+        self.assertEqual(stats.check(average=1899, fastest=400),
+                         ['average', 'fastest'])
+
+    def testStatsSinkAgreesWithTheWatch(self):
+        records = list(dt2000.iterRecords(DUMP_FILE))
+        out = StringIO.StringIO()
+        self.assertTrue(isinstance(sinks.openSink('stats:-'),
+                                   lapstats.StatsSink))
+        sink = lapstats.StatsSink(out)
+        sinks.writeSinks(records, [sink], batch_records=1)
+        events = [json.loads(line) for line in out.getvalue().splitlines()]
+
+        checks = [event for event in events if event["event"] == "check"]
+        self.assertTrue(checks)
+        self.assertTrue(all(event["differ"] == [] for event in checks))
+        # One stats event per finisher when fed a record at a time.
+        laps = sum(1 for record in records if record.ptype == 'laptime')
+        stats = [event for event in events if event["event"] == "stats"]
+        self.assertEqual(len(stats), laps)
+        self.assertEqual(stats[0], {"event": "stats", "race": 1, "count": 1,
+                                    "mean": 183.0, "fastest": 183,
+                                    "slowest": 183,
+                                    "percentiles": {"p50": 183,
+                                                    "p90": 183},
+                                    "rate": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
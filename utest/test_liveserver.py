@@ -0,0 +1,172 @@
+##############################################################################
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Anthony Rogers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+import json
+import os
+import socket
+import unittest
+import urllib2
+import dt2000
+import liveserver
+
+DUMP_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dump')
+
+
+class TEST_LiveResults(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            self.records = list(dt2000.Decoder().decode_block(dump.read()))
+        self.results = liveserver.LiveResults()
+
+    def testStandingsFollowTheCurrentRace(self):
+        # Race 1 is a header, five finishers and its summary.
+        self.results.write(self.records[:4])
+        standings = json.loads(self.results.snapshot())
+        self.assertEqual(standings["race"], 1)
+        self.assertEqual([f["position"] for f in standings["finishers"]],
+                         [1, 2])
+        self.assertEqual(standings["finishers"][1]["time"], "0:00:02.42")
+        self.assertEqual((standings["stats"]["count"],
+                          standings["stats"]["fastest"]), (2, 59))
+        self.results.write(self.records[4:16])
+        standings = json.loads(self.results.snapshot())
+        self.assertTrue(standings["finished"])
+        self.assertEqual(standings["average"], 82)
+        self.results.write(self.records[16:17])
+        standings = json.loads(self.results.snapshot())
+        self.assertEqual((standings["race"], standings["finishers"]), (2, []))
+
+    def testStreamJoinedMidRaceWaitsForTheNextRace(self):
+        # Race 1's header and first two finishers were missed.
+        self.results.write(self.records[5:16])
+        standings = json.loads(self.results.snapshot())
+        self.assertEqual((standings["race"], standings["finishers"],
+                          standings["stats"]), (None, [], None))
+        self.results.write(self.records[16:19])
+        standings = json.loads(self.results.snapshot())
+        self.assertEqual(standings["race"], 1)
+        self.assertEqual(standings["stats"]["count"], 1)
+
+    def testSnapshotIsCachedUntilAFinisherArrives(self):
+        self.results.write(self.records[:2])
+        first = self.results.snapshot()
+        self.assertTrue(self.results.snapshot() is first)
+        # A NAK changes nothing.
+        self.results.write(self.records[2:3])
+        self.assertTrue(self.results.snapshot() is first)
+        self.results.write(self.records[3:4])
+        self.assertFalse(self.results.snapshot() is first)
+
+    def testSubscribersReceiveNewEvents(self):
+        self.results.write(self.records[:2])
+        subscriber = self.results.subscribe()
+        self.results.write(self.records[2:4])
+        event = json.loads(subscriber.get_nowait())
+        self.assertEqual((event["event"], event["position"]),
+                         ("finisher", 2))
+        self.assertTrue(subscriber.empty())
+        self.results.unsubscribe(subscriber)
+        self.assertEqual(self.results.subscribers, [])
+
+    def testSlowSubscriberIsDropped(self):
+        events = liveserver.SUBSCRIBER_EVENTS
+        liveserver.SUBSCRIBER_EVENTS = 2
+        try:
+            subscriber = self.results.subscribe()
+        finally:
+            liveserver.SUBSCRIBER_EVENTS = events
+        self.results.write(self.records[:10])
+        self.assertEqual(self.results.subscribers, [])
+        lines = [subscriber.get_nowait() for _ in range(subscriber.qsize())]
+        self.assertEqual(lines[-1], None)
+        self.assertTrue(len(lines) <= 2)
+
+    def testCloseEndsEveryQueue(self):
+        subscriber = self.results.subscribe()
+        self.results.close()
+        self.assertEqual(subscriber.get_nowait(), None)
+        self.assertEqual(self.results.subscribe().get_nowait(), None)
+
+
+class TEST_servers(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            self.records = list(dt2000.Decoder().decode_block(dump.read()))
+        self.results = liveserver.LiveResults()
+        self.results.write(self.records[:4])
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+            # shutdown() ends the event streams and joins their threads.
+            self.assertFalse([thread for thread in server.threads
+                              if thread.is_alive()])
+
+    def start(self, server_class):
+        server = server_class(('127.0.0.1', 0), self.results)
+        self.servers.append(server)
+        liveserver.startServer(server)
+        return server.server_address[1]
+
+    def testHttpStandingsAndEvents(self):
+        port = self.start(liveserver.ResultsHTTPServer)
+        url = 'http://127.0.0.1:%d' % port
+        body = urllib2.urlopen(url + '/standings', timeout=5).read()
+        self.assertEqual(body, self.results.snapshot())
+
+        # Read the stream from a socket, as urllib2 waits for whole blocks.
+        client = socket.create_connection(('127.0.0.1', port), timeout=5)
+        client.sendall("GET /events HTTP/1.0\r\n\r\n")
+        stream = client.makefile()
+        while stream.readline() != "\r\n":
+            pass
+        self.assertEqual(stream.readline(), "event: standings\n")
+        self.assertEqual(stream.readline(),
+                         "data: " + self.results.snapshot() + "\n")
+        stream.readline()
+        self.results.write(self.records[4:6])
+        line = stream.readline()
+        self.assertTrue(line.startswith("data: "))
+        self.assertEqual(json.loads(line[6:])["position"], 3)
+        client.close()
+
+        with self.assertRaises(urllib2.HTTPError):
+            urllib2.urlopen(url + '/missing', timeout=5)
+
+    def testTcpEventStream(self):
+        port = self.start(liveserver.ResultsTCPServer)
+        client = socket.create_connection(('127.0.0.1', port), timeout=5)
+        lines = client.makefile()
+        self.assertEqual(json.loads(lines.readline())["race"], 1)
+        self.results.write(self.records[4:6])
+        self.assertEqual(json.loads(lines.readline())["position"], 3)
+        # The stream is still open when the server shuts down.
+        self.servers[0].shutdown()
+        self.assertEqual(lines.readline(), '')
+        client.close()
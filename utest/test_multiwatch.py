@@ -0,0 +1,121 @@
+##############################################################################
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Anthony Rogers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+import csv
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+import dt2000
+import multiwatch
+import watchsim
+
+
+def races(*laps):
+    """Returns the decoded races of the given lap time lists."""
+    data = ''.join(watchsim.race_bytes(race, number)
+                   for number, race in enumerate(laps, 1))
+    return list(dt2000.iterRaces(dt2000.Decoder().decode_block(data)))
+
+
+class TEST_multiwatch(unittest.TestCase):
+    def testReadSourcesConcurrently(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for index, laps in enumerate(([100, 200], [150, 50, 25])):
+                path = os.path.join(tmpdir, 'watch%d.dump' % index)
+                with open(path, 'wb') as f:
+                    f.write(watchsim.race_bytes(laps, naks=True))
+                paths.append(path)
+            results = multiwatch.readSources(
+                paths + [os.path.join(tmpdir, 'missing')])
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(results[0][1], None)
+        self.assertEqual(results[0][0][0].finish_times(), [100, 300])
+        self.assertEqual(results[1][0][0].finish_times(), [150, 200, 225])
+        self.assertEqual(results[2][0], [])
+        self.assertNotEqual(results[2][1], None)
+
+    def testAlignSkipsMissedAndExtraRaces(self):
+        reference = races([1000, 500], [3000, 100, 100], [6000, 400])
+        # Misses the second race and has a test race before the third.
+        other = races([1010, 480], [50], [6005, 390])
+        self.assertEqual(multiwatch.alignRaces(reference, other),
+                         [(0, 0), (2, 2)])
+
+        groups = multiwatch.groupRaces([reference, other])
+        self.assertEqual([sorted(group) for group in groups],
+                         [[0, 1], [1], [0], [0, 1]])
+        self.assertEqual(groups[1][1].finish_times(), [50])
+
+    def testMergeKeepsEveryRunnerInEachChute(self):
+        # Runners in two chutes, within the tolerance of each other.
+        first, second = races([1000, 300])[0], races([1010, 295])[0]
+        merged = multiwatch.mergeFinishers({0: first, 1: second})
+        self.assertEqual(merged, [(1000, [0]), (1010, [1]),
+                                  (1300, [0]), (1305, [1])])
+
+        out = StringIO.StringIO()
+        duplicates = multiwatch.writeMergedResults([{0: first, 1: second}],
+                                                   csv.writer(out))
+        self.assertEqual(duplicates, 0)
+        self.assertEqual(len(out.getvalue().splitlines()), 6)
+
+    def testMergeDeduplicatesBackupWatches(self):
+        # A chute watch and its backup, with a finish on both and two close
+        # on the chute watch.
+        first, second = races([1000, 300, 5])[0], races([1010, 600])[0]
+        merged = multiwatch.mergeFinishers({0: first, 1: second},
+                                           backups=[1])
+        self.assertEqual(merged, [(1000, [0, 1]), (1300, [0]),
+                                  (1305, [0]), (1610, [1])])
+
+        out = StringIO.StringIO()
+        duplicates = multiwatch.writeMergedResults([{0: first, 1: second}],
+                                                   csv.writer(out),
+                                                   backups=[1])
+        self.assertEqual(duplicates, 1)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['New Race Detected',
+                          'Finisher,1,0,0,10,0,1+2',
+                          'Finisher,2,0,0,13,0,1',
+                          'Finisher,3,0,0,13,5,1',
+                          'Finisher,4,0,0,16,10,2',
+                          'Race Finished'])
+
+    def testBackupMatchesEitherChute(self):
+        # Two chutes close together and a backup of both.
+        chute1, chute2 = races([1000])[0], races([1005])[0]
+        backup = races([1002, 3])[0]
+        merged = multiwatch.mergeFinishers({0: chute1, 1: chute2,
+                                            2: backup}, backups=[2])
+        self.assertEqual(merged, [(1000, [0, 2]), (1005, [1, 2])])
+
+if __name__ == '__main__':
+    unittest.main()
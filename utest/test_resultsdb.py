@@ -0,0 +1,116 @@
+##############################################################################
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Anthony Rogers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+import os
+import unittest
+import dt2000
+import resultsdb
+
+DUMP_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dump')
+
+
+class TEST_resultsdb(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            bcd_buffer = dump.read()
+        self.races = list(dt2000.iterRaces(
+            dt2000.Decoder().decode_block(bcd_buffer)))
+        self.conn = resultsdb.connect(':memory:')
+        self.race_ids = resultsdb.storeRaces(self.conn, self.races, 'dump',
+                                             '2015', batch_rows=7)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def testEveryRaceAndFinisherIsStored(self):
+        self.assertEqual(len(self.race_ids), len(self.races))
+        count = self.conn.execute(
+            "SELECT COUNT(*) FROM finishers").fetchone()[0]
+        self.assertEqual(count, sum(len(race) for race in self.races))
+        self.assertEqual(resultsdb.listRaces(self.conn)[0],
+                         (self.race_ids[0], 'dump', 1, '2015', 5, 82, 56))
+
+    def testStoringAgainAddsNothing(self):
+        self.assertEqual(resultsdb.storeRaces(self.conn, self.races, 'dump'),
+                         [])
+        self.assertEqual(len(resultsdb.listRaces(self.conn)),
+                         len(self.races))
+
+    def testUnfinishedRaceIsReplaced(self):
+        conn = resultsdb.connect(':memory:')
+        race = self.races[-1]
+        running = race[:3]
+        running.average = running.fastest = running.end = None
+        first = resultsdb.storeRaces(conn, [running], 'watch')
+        self.assertEqual(resultsdb.storeRaces(conn, [race], 'watch'), first)
+        self.assertEqual(conn.execute(
+            "SELECT id, number, laps, finished FROM races").fetchall(),
+            [(first[0], race.watch_number, len(race), 1)])
+        self.assertEqual(len(resultsdb.topFinishers(conn, first[0], 1000)),
+                         len(race))
+        # A finished race with the same number is a new race.
+        other = race[:2]
+        self.assertNotEqual(resultsdb.storeRaces(conn, [other], 'watch'),
+                            first)
+        conn.close()
+
+    def testRacesAreNumberedByTheWatch(self):
+        # A download that starts at the third race.
+        records = list(dt2000.readRecords(DUMP_FILE))
+        start = [i for i, record in enumerate(records)
+                 if record.ptype == 'raceheader'][2]
+        races = list(dt2000.iterRaces(records[start:]))
+        self.assertEqual(races[0].number, 1)
+        conn = resultsdb.connect(':memory:')
+        resultsdb.storeRaces(conn, races, 'watch')
+        self.assertEqual([row[2] for row in resultsdb.listRaces(conn)],
+                         [race.watch_number for race in races])
+        self.assertEqual(resultsdb.listRaces(conn)[0][2], 3)
+        conn.close()
+
+    def testTopFinishers(self):
+        self.assertEqual(resultsdb.topFinishers(self.conn, self.race_ids[0],
+                                                3),
+                         [(1, 183), (2, 242), (3, 299)])
+
+    def testFinishersUnder(self):
+        rows = resultsdb.finishersUnder(self.conn, 300)
+        self.assertEqual([row[2] for row in rows], [183, 242, 299])
+        self.assertEqual(resultsdb.finishersUnder(self.conn, 300, '2014'),
+                         [])
+
+    def testFastestLaps(self):
+        expected = sorted(lap for race in self.races
+                          for lap in race.hundredths)[:5]
+        rows = resultsdb.fastestLaps(self.conn, 5, '2015')
+        self.assertEqual([row[2] for row in rows], expected)
+
+    def testIndexesExist(self):
+        names = [row[0] for row in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")]
+        for name in ('finishers_position', 'finishers_finish'):
+            self.assertIn(name, names)
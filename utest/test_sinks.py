@@ -0,0 +1,87 @@
+##############################################################################
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Anthony Rogers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+import csv
+import json
+import os
+import StringIO
+import unittest
+import dt2000
+import resultsdb
+import sinks
+
+DUMP_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dump')
+
+
+class TEST_sinks(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+        self.records = list(dt2000.Decoder().decode_block(self.bcd_buffer))
+
+    def testOnePassFeedsEverySink(self):
+        csv_out = StringIO.StringIO()
+        json_out = StringIO.StringIO()
+        board_out = StringIO.StringIO()
+        outputs = [sinks.CsvSink(csv_out), sinks.JsonLinesSink(json_out),
+                   sinks.BoardSink(board_out)]
+        # A generator can only be read once.
+        sinks.writeSinks(iter(self.records), outputs, batch_records=7)
+
+        expected = StringIO.StringIO()
+        dt2000.writeResults(self.records, csv.writer(expected))
+        self.assertEqual(csv_out.getvalue(), expected.getvalue())
+
+        events = [json.loads(line)
+                  for line in json_out.getvalue().splitlines()]
+        self.assertEqual(events[0], {"event": "race", "race": 1})
+        self.assertEqual(events[1], {"event": "finisher", "race": 1,
+                                     "position": 1, "lap": 183,
+                                     "finish": 183, "gap": 0})
+        self.assertEqual(len(events), len(expected.getvalue().splitlines()))
+
+        lines = board_out.getvalue().splitlines()
+        self.assertEqual(lines[0], "Race 1")
+        self.assertEqual(lines[3], "   2   0:00:02.42   0:00:00.59")
+        self.assertTrue(all(len(line) == len(lines[1])
+                            for line in lines[2:7]))
+
+    def testSqliteSinkMatchesStoreRaces(self):
+        sink = sinks.SqliteSink(resultsdb.connect(':memory:'), 'dump')
+        sinks.writeSinks(self.records, [sink], batch_records=10)
+        sink.close()
+        conn = resultsdb.connect(':memory:')
+        race_ids = resultsdb.storeRaces(conn,
+                                        dt2000.iterRaces(self.records), 'dump')
+        self.assertEqual(len(sink.race_ids), len(race_ids))
+        self.assertEqual(resultsdb.listRaces(sink.conn),
+                         resultsdb.listRaces(conn))
+
+    def testOpenSinkRejectsUnknownKind(self):
+        for spec in ('xml:out.xml', 'csv', 'csv:'):
+            with self.assertRaises(ValueError):
+                sinks.openSink(spec)
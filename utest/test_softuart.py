@@ -0,0 +1,112 @@
+##############################################################################
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Anthony Rogers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+import os
+import StringIO
+import unittest
+import dt2000
+import softuart
+
+DUMP_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dump')
+
+
+class TEST_softuart(unittest.TestCase):
+    def setUp(self):
+        self.numpy = softuart.numpy
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+
+    def tearDown(self):
+        softuart.numpy = self.numpy
+
+    def testEdgesRoundTrip(self):
+        edges, initial_level = softuart.encode_edges(self.bcd_buffer)
+        self.assertEqual(initial_level, 0)
+        value = softuart.decode_edges(edges, initial_level=initial_level)
+        self.assertEqual(value, (self.bcd_buffer, []))
+
+    def testEdgesRoundTripWithoutNumpy(self):
+        softuart.numpy = None
+        edges, initial_level = softuart.encode_edges(self.bcd_buffer[:100])
+        value = softuart.decode_edges(edges, initial_level=initial_level)
+        self.assertEqual(value, (self.bcd_buffer[:100], []))
+
+    def testBackToBackFramesWithoutIdleBits(self):
+        data = "\x00\xff\x55\x80"
+        edges, initial_level = softuart.encode_edges(data, idle_bits=0)
+        self.assertEqual(edges[0], 1.0 / softuart.BAUD)
+        value = softuart.decode_edges(edges, initial_level=initial_level)
+        self.assertEqual(value, (data, []))
+        samples = softuart.encode_samples(data, 8, idle_bits=0)
+        value = softuart.decode_samples(samples, 8)
+        self.assertEqual(value, (data, []))
+
+    def testClockDriftIsTolerated(self):
+        for drift in (-0.04, 0.04):
+            edges, initial_level = softuart.encode_edges(self.bcd_buffer,
+                                                         drift=drift)
+            value = softuart.decode_edges(edges, initial_level=initial_level)
+            self.assertEqual(value, (self.bcd_buffer, []))
+
+    def testNonInvertedSignal(self):
+        edges, initial_level = softuart.encode_edges("\x00\xff\x55",
+                                                     invert=False)
+        value = softuart.decode_edges(edges, initial_level=initial_level,
+                                      invert=False)
+        self.assertEqual(value.data, "\x00\xff\x55")
+
+    def testOversampledRoundTrip(self):
+        for samples_per_bit in (4, 7.3, 16):
+            samples = softuart.encode_samples(self.bcd_buffer[:200],
+                                              samples_per_bit)
+            value = softuart.decode_samples(samples, samples_per_bit)
+            self.assertEqual(value, (self.bcd_buffer[:200], []))
+        softuart.numpy = None
+        value = softuart.decode_samples(samples, samples_per_bit)
+        self.assertEqual(value, (self.bcd_buffer[:200], []))
+
+    def testMissingStopBitIsFramingError(self):
+        samples = softuart.encode_samples("\x41\x42\x43", 8)
+        # Each frame is two idle bits then ten bits; hold the (inverted) line
+        # high through the second stop bit.
+        for index in range(23 * 8, 24 * 8):
+            samples[index] = 1
+        value = softuart.decode_samples(samples, 8)
+        self.assertEqual(value.data, "\x41\x42\x43")
+        self.assertEqual(value.errors, [1])
+
+    def testCaptureFeedsReadRecord(self):
+        edges, initial_level = softuart.encode_edges(self.bcd_buffer)
+        level = initial_level
+        export = ["Time [s],Channel 0", "0.0,%d" % level]
+        for edge in edges:
+            level ^= 1
+            export.append("%r,%d" % (edge, level))
+        source = softuart.openCapture(StringIO.StringIO("\n".join(export)))
+        records = list(dt2000.readRecord(source))
+        expected = list(dt2000.Decoder().decode_block(self.bcd_buffer))
+        self.assertEqual(records, expected)
@@ -0,0 +1,91 @@
+##############################################################################
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Anthony Rogers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+#
+##############################################################################
+
+import os
+import unittest
+import dt2000
+import watchsim
+
+DUMP_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dump')
+
+
+class TEST_race_bytes(unittest.TestCase):
+    def testRaceDecodesToItsLaps(self):
+        laps = range(500, 500 + 150)
+        decoder = dt2000.Decoder()
+        races = list(dt2000.iterRaces(decoder.decode_block(
+            watchsim.race_bytes(laps, 7))))
+        self.assertEqual(len(races), 1)
+        race = races[0]
+        self.assertEqual(list(race.laps), range(1, 151))
+        self.assertEqual(list(race.hundredths), laps)
+        self.assertEqual(race.fastest, 500)
+        self.assertEqual(race.average, sum(laps) // len(laps))
+
+    def testGeneratedRacesAreRepeatable(self):
+        self.assertEqual(watchsim.generate_races(2, 10, seed=3),
+                         watchsim.generate_races(2, 10, seed=3))
+
+
+class TEST_WatchSimulator(unittest.TestCase):
+    def setUp(self):
+        with open(DUMP_FILE, 'rb') as dump:
+            self.bcd_buffer = dump.read()
+
+    def readAll(self, simulator):
+        port = dt2000.openFile(simulator.port)
+        port.timeout = 0.2
+        simulator.start()
+        try:
+            return list(dt2000.LiveReader(port))
+        finally:
+            simulator.join()
+            port.close()
+            simulator.close()
+
+    def testSerialPathReadsReplayedDump(self):
+        simulator = watchsim.WatchSimulator(self.bcd_buffer, speedup=0,
+                                            max_chunk=7, seed=1)
+        records = self.readAll(simulator)
+        expected = list(dt2000.Decoder().decode_block(self.bcd_buffer))
+        self.assertEqual(records, expected)
+        self.assertEqual(len(simulator.sent), len(expected))
+
+    def testPacingFollowsBaudRate(self):
+        simulator = watchsim.WatchSimulator(self.bcd_buffer[:100],
+                                            speedup=10)
+        self.readAll(simulator)
+        # 100 bytes at 48000 baud take about 21 ms.
+        self.assertGreaterEqual(simulator.finished - simulator.started,
+                                0.02)
+
+    def testCorruptBytesAreRecorded(self):
+        simulator = watchsim.WatchSimulator(self.bcd_buffer, speedup=0,
+                                            corrupt=0.05, seed=2)
+        records = self.readAll(simulator)
+        self.assertEqual(len(records), len(self.bcd_buffer) // 5)
+        self.assertTrue(simulator.corrupted)
@@ -0,0 +1,273 @@
+"""
+    watchsim.py
+    Copyright (C) 2015 Anthony Rogers tony@themailbox.name
+
+    This library is free software; you can redistribute it and/or
+    modify it under the terms of the GNU Lesser General Public
+    License as published by the Free Software Foundation; either
+    version 2.1 of the License, or (at your option) any later version.
+
+    This library is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+    Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public
+    License along with this library; if not, write to the Free Software
+    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+    USA
+
+A virtual DT2000 watch.  Replays a dump file, or generated races, over a
+pseudo-terminal so the serial path of dt2000.py can be exercised without a
+watch or cable.  Bytes are paced at the real baud rate or a multiple of it,
+and jitter, partial reads and corrupt bytes can be injected.
+"""
+
+import optparse
+import os
+import random
+import sys
+import threading
+import time
+import tty
+
+import dt2000
+
+BAUD = 4800
+
+# Bits on the wire per byte: start, eight data bits, stop.
+FRAME_BITS = 10
+
+# The race header bytes sent by the watch, less the race number.
+RACE_HEADER = '\x09\x51\x0a\x21'
+
+# Type code of the unknown record the watch sends after each lap.
+FILLER_TYPE = 66
+
+
+def time_record(type_code, hundredths, count):
+    """Encodes a time record: type code plus hours, then M, S, hh, count.
+
+    Returns the five byte record.
+    """
+    hours, minutes, seconds, hundredths = dt2000.split_hundredths(hundredths)
+    return dt2000.integer_list_to_bcd_string(
+        [type_code + hours, minutes, seconds, hundredths, count % 100])
+
+
+def race_bytes(lap_hundredths, number=1, naks=False):
+    """Encodes a race as the watch would send it.
+
+    lap_hundredths holds the lap times, in hundredths of a second, in
+    finishing order.  Lap numbers wrap at 100 as they do on the watch.  The
+    race is followed by its raceend, avtime and fastesttime records.  With
+    naks set, each lap is followed by an unknown (NAK) record, as in real
+    downloads.
+
+    Returns the race as a string of records.
+    """
+    records = [RACE_HEADER + dt2000.int_to_bcd(number % 100)]
+    for lap, hundredths in enumerate(lap_hundredths, 1):
+        records.append(time_record(10, hundredths, lap))
+        if naks:
+            records.append(dt2000.integer_list_to_bcd_string(
+                [FILLER_TYPE, 0, 0, 0, lap % 100]))
+    count = len(lap_hundredths)
+    if count:
+        fastest = min(lap_hundredths)
+        records.append(time_record(50, sum(lap_hundredths), count))
+        records.append(time_record(30, sum(lap_hundredths) // count, count))
+        records.append(time_record(40, fastest,
+                                   lap_hundredths.index(fastest) + 1))
+    return ''.join(records)
+
+
+def generate_races(races, laps, mean=6000, spread=1500, seed=None):
+    """Generates races of laps laps with normally distributed lap times.
+
+    Returns the races as a string of records.
+    """
+    rng = random.Random(seed)
+    return ''.join(
+        race_bytes([max(1, int(rng.gauss(mean, spread)))
+                    for _ in xrange(laps)], number)
+        for number in xrange(1, races + 1))
+
+
+class WatchSimulator(object):
+    """Sends data over a pseudo-terminal as the watch would.
+
+    Bytes are paced at baud * speedup bytes per FRAME_BITS bits; a speedup of
+    0 sends as fast as the reader takes them.  Each write carries between 1
+    and max_chunk bytes, so records are split across reads, and is delayed
+    by up to jitter seconds.  Each byte is replaced by a random byte with
+    probability corrupt.
+
+    The time the last byte of each record was sent is kept in 'sent', so
+    a reader can measure end-to-end latency.  'port' is the name of the
+    device to open.
+    """
+
+    def __init__(self, data, baud=BAUD, speedup=1.0, jitter=0.0,
+                 max_chunk=dt2000.RECORD_LENGTH, corrupt=0.0, seed=None):
+        self.data = data
+        self.baud = baud
+        self.speedup = speedup
+        self.jitter = jitter
+        self.max_chunk = max_chunk
+        self.corrupt = corrupt
+        self.rng = random.Random(seed)
+
+        self.sent = []
+        self.corrupted = []
+        self.started = None
+        self.finished = None
+        self._thread = None
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+    def byte_time(self):
+        """Returns the time to send one byte, or 0 if not paced."""
+        if not self.speedup:
+            return 0.0
+        return FRAME_BITS / float(self.baud) / self.speedup
+
+    def corrupt_chunk(self, chunk, offset):
+        """Replaces random bytes of chunk, recording their offsets."""
+        if not self.corrupt:
+            return chunk
+        chunk = bytearray(chunk)
+        for index in xrange(len(chunk)):
+            if self.rng.random() < self.corrupt:
+                chunk[index] = self.rng.randrange(256)
+                self.corrupted.append(offset + index)
+        return str(chunk)
+
+    def run(self):
+        """Sends all of the data, blocking until it has been written."""
+        byte_time = self.byte_time()
+        record_length = dt2000.RECORD_LENGTH
+        self.started = time.time()
+        offset = 0
+        while offset < len(self.data):
+            size = self.rng.randint(1, self.max_chunk)
+            chunk = self.corrupt_chunk(self.data[offset:offset + size],
+                                       offset)
+            # Keep to the schedule from the start, so jitter delays a write
+            # without slowing the whole stream.
+            due = self.started + (offset + len(chunk)) * byte_time
+            if self.jitter:
+                due += self.rng.uniform(0, self.jitter)
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            # Stamp records before writing, so a reader never sees a record
+            # before its time.
+            now = time.time()
+            offset += len(chunk)
+            self.sent.extend([now] * (offset // record_length
+                                      - len(self.sent)))
+            written = 0
+            while written < len(chunk):
+                written += os.write(self.master, chunk[written:])
+        self.finished = time.time()
+
+    def start(self):
+        """Sends the data on a background thread."""
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+
+    def close(self):
+        """Closes the pseudo-terminal; readers then see end of file."""
+        os.close(self.master)
+        os.close(self.slave)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-f", "--infile",
+                      dest="infile",
+                      metavar="FILE",
+                      default=None,
+                      help="Dump file to replay; generated races if not "
+                      "specified.")
+    parser.add_option("--races",
+                      dest="races",
+                      metavar="NUM",
+                      type=int,
+                      default=3,
+                      help="Number of races to generate, 3 if not "
+                      "specified.")
+    parser.add_option("--laps",
+                      dest="laps",
+                      metavar="NUM",
+                      type=int,
+                      default=120,
+                      help="Laps per generated race, 120 if not specified.")
+    parser.add_option("-s", "--speedup",
+                      dest="speedup",
+                      metavar="NUM",
+                      type=float,
+                      default=1.0,
+                      help="Multiple of " + str(BAUD) + " baud to send at, "
+                      "0 for as fast as possible.")
+    parser.add_option("--jitter",
+                      dest="jitter",
+                      metavar="SECONDS",
+                      type=float,
+                      default=0.0,
+                      help="Largest random delay added to each write.")
+    parser.add_option("--chunk",
+                      dest="max_chunk",
+                      metavar="NUM",
+                      type=int,
+                      default=dt2000.RECORD_LENGTH,
+                      help="Largest number of bytes per write.")
+    parser.add_option("--corrupt",
+                      dest="corrupt",
+                      metavar="RATE",
+                      type=float,
+                      default=0.0,
+                      help="Probability of each byte being corrupted.")
+    parser.add_option("--seed",
+                      dest="seed",
+                      metavar="NUM",
+                      type=int,
+                      default=None,
+                      help="Random seed, for repeatable runs.")
+    parser.add_option("--delay",
+                      dest="delay",
+                      metavar="SECONDS",
+                      type=float,
+                      default=5.0,
+                      help="Time to wait for a reader before sending, "
+                      "5 if not specified.")
+    (options, args) = parser.parse_args()
+
+    if options.infile:
+        with open(options.infile, 'rb') as f:
+            data = f.read()
+    else:
+        data = generate_races(options.races, options.laps, seed=options.seed)
+
+    simulator = WatchSimulator(data, speedup=options.speedup,
+                               jitter=options.jitter,
+                               max_chunk=options.max_chunk,
+                               corrupt=options.corrupt, seed=options.seed)
+    sys.stderr.write("Watch on " + simulator.port + "\n")
+    time.sleep(options.delay)
+    simulator.run()
+    sys.stderr.write("Sent %d bytes in %.3f s, %d corrupted.\n"
+                     % (len(data), simulator.finished - simulator.started,
+                        len(simulator.corrupted)))
+    # Give the reader time to drain the pseudo-terminal before closing it.
+    time.sleep(1.0)
+    simulator.close()